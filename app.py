@@ -7,10 +7,13 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import tkinter.font as tkfont
 
+import calc
+
 
 APP_TITLE = "产量记录"
 CSV_FILE = "records.csv"
 STATE_FILE = "app_state.json"
+DEFAULT_SHIFT_MINUTES = 480
 
 
 def get_app_dir() -> str:
@@ -44,6 +47,43 @@ def save_state(state: dict) -> None:
         pass
 
 
+def get_shift_minutes() -> int:
+    # 班次分钟数，可在 app_state.json 中以 shift_minutes 修改
+    try:
+        return int(load_state().get('shift_minutes') or DEFAULT_SHIFT_MINUTES)
+    except (TypeError, ValueError):
+        return DEFAULT_SHIFT_MINUTES
+
+
+def parse_number(text: str):
+    """解析表格单元格中的数字（去掉注释标记），空白或非法时为 None"""
+    text = (text or '').replace(' 📝', '').strip()
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+
+def parse_cell_value(field: str, text: str):
+    """解析计算用到的单元格，整数列与 Web 版存储时一样用 round 取整"""
+    number = parse_number(text)
+    if number is not None and field in calc.INTEGER_INPUT_FIELDS:
+        return int(round(number))
+    return number
+
+
+def format_derived_value(field: str, value) -> str:
+    """派生字段的显示文本：稼动率带 %，无法计算时为空"""
+    if value is None:
+        return ''
+    if field in ('capacity_rate', 'time_rate'):
+        return f"{value}%"
+    return str(value)
+
+
 def is_first_run() -> bool:
     data = load_state()
     return not bool(data.get('first_run_completed'))
@@ -85,6 +125,8 @@ class ProductionApp:
         self.var_position = tk.StringVar()
         # 人员名单：name -> position
         self.employees = {}
+        # 理论运行时长 = 班次分钟数 - 调机时长
+        self.shift_minutes = get_shift_minutes()
         self.current_filter = {"start_month": None, "start_day": None, "end_month": None, "end_day": None, "name": None, "product": None, "process": None}
         
         # 弹窗状态跟踪
@@ -1275,29 +1317,11 @@ class ProductionApp:
             if column_key == 'product':
                 display_val = self._wrap_text_to_column(new_val, 'product')
             self.tree.set(row_id, column_key, display_val)
-            # 若编辑了权重，自动计算实际数量 = (总重-去皮)/单重（四舍五入）
+            # 若编辑了权重，重新计算实际数量 = (总重-去皮)/单重 及产能稼动率
             if column_key in ('total_weight', 'unit_weight', 'tare_weight'):
-                try:
-                    tw = float(self.tree.set(row_id, 'total_weight') or 0) if (self.tree.set(row_id, 'total_weight') or '').strip() != '' else 0.0
-                    uw = float(self.tree.set(row_id, 'unit_weight') or 0) if (self.tree.set(row_id, 'unit_weight') or '').strip() != '' else 0.0
-                    tar = float(self.tree.set(row_id, 'tare_weight') or 0) if (self.tree.set(row_id, 'tare_weight') or '').strip() != '' else 0.0
-                except ValueError:
-                    # 非法数字直接不计算
-                    tw = uw = tar = 0.0
-                qty_val = ''
-                if uw > 0:
-                    # 四舍五入取整（ROUND_HALF_UP）
-                    from decimal import Decimal, ROUND_HALF_UP, InvalidOperation, getcontext
-                    getcontext().prec = 28
-                    try:
-                        qty_calc = (Decimal(str(tw)) - Decimal(str(tar))) / Decimal(str(uw))
-                        qty_int = int(qty_calc.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
-                        if qty_int < 0:
-                            qty_int = 0
-                        qty_val = str(qty_int)
-                    except (InvalidOperation, ZeroDivisionError):
-                        qty_val = ''
-                self.tree.set(row_id, 'actual_qty', qty_val)
+                if not parse_number(self.tree.set(row_id, 'unit_weight')):
+                    self.tree.set(row_id, 'actual_qty', '')
+                self._recalculate_row(row_id)
             # 同步数据
             self._rebuild_all_records_from_table()
             self._destroy_editor()
@@ -1414,10 +1438,8 @@ class ProductionApp:
             self.tree.set(row_id, column_key, final_value)
             # 重新添加注释标记（如果有注释的话）
             self._update_cell_comment_indicator(row_id, column_key)
-            # 自动计算实际运行时长
-            self._calculate_actual_runtime(row_id)
-            # 自动计算理论数量
-            self._calculate_theoretical_qty(row_id)
+            # 重新计算运行时长、理论数量和稼动率
+            self._recalculate_row(row_id)
             # 同步数据
             self._rebuild_all_records_from_table()
             self._destroy_editor()
@@ -1454,8 +1476,8 @@ class ProductionApp:
         # 存储引用
         self._editor = editor_frame
         
-        # 计算并显示产能稼动率
-        self._calculate_capacity_rate(row_id)
+        # 重新计算该行的派生列
+        self._recalculate_row(row_id)
 
     def _create_time_rate_editor(self, row_id: str, column_key: str, x: int, y: int, w: int, h: int, value: str) -> None:
         """创建时间稼动率编辑器，自动计算"""
@@ -1474,8 +1496,8 @@ class ProductionApp:
         # 存储引用
         self._editor = editor_frame
         
-        # 计算并显示时间稼动率
-        self._calculate_time_rate(row_id)
+        # 重新计算该行的派生列
+        self._recalculate_row(row_id)
 
     def _create_theoretical_runtime_editor(self, row_id: str, column_key: str, x: int, y: int, w: int, h: int, value: str) -> None:
         """创建理论运行时长编辑器，自动计算"""
@@ -1494,8 +1516,8 @@ class ProductionApp:
         # 存储引用
         self._editor = editor_frame
         
-        # 自动计算理论运行时长
-        self._calculate_theoretical_runtime(row_id)
+        # 重新计算该行的派生列
+        self._recalculate_row(row_id)
         
         def commit(event=None):
             # 理论运行时长是自动计算的，不需要手动保存
@@ -1526,8 +1548,8 @@ class ProductionApp:
         # 存储引用
         self._editor = editor_frame
         
-        # 自动计算理论运行时长和实际运行时长
-        self._calculate_actual_runtime(row_id)
+        # 重新计算该行的派生列
+        self._recalculate_row(row_id)
         
         def commit(event=None):
             # 实际运行时长是自动计算的，不需要手动保存
@@ -1587,10 +1609,8 @@ class ProductionApp:
             self.tree.set(row_id, column_key, final_value)
             # 重新添加注释标记（如果有注释的话）
             self._update_cell_comment_indicator(row_id, column_key)
-            # 自动计算理论运行时长和实际运行时长
-            self._calculate_actual_runtime(row_id)
-            # 自动计算理论数量
-            self._calculate_theoretical_qty(row_id)
+            # 重新计算运行时长、理论数量和稼动率
+            self._recalculate_row(row_id)
             # 同步数据
             self._rebuild_all_records_from_table()
             self._destroy_editor()
@@ -1698,8 +1718,8 @@ class ProductionApp:
             
             # 写入表格
             self.tree.set(row_id, column_key, final_value)
-            # 自动计算理论数量
-            self._calculate_theoretical_qty(row_id)
+            # 重新计算理论数量和产能稼动率
+            self._recalculate_row(row_id)
             # 同步数据
             self._rebuild_all_records_from_table()
             self._destroy_editor()
@@ -1719,164 +1739,15 @@ class ProductionApp:
         
         editor.bind('<FocusOut>', on_focus_out)
 
-    def _calculate_theoretical_runtime(self, row_id: str) -> None:
-        """计算理论运行时长 = 480 - 调机时长"""
-        try:
-            # 获取调机时长
-            adjustment_time = self.tree.set(row_id, 'adjustment_time').replace(' 📝', '')
-            if not adjustment_time:
-                adjustment_time = '0'
-            
-            # 计算理论运行时长
-            adjustment_minutes = int(adjustment_time)
-            theoretical_minutes = 480 - adjustment_minutes
-            
-            # 确保不为负数
-            if theoretical_minutes < 0:
-                theoretical_minutes = 0
-            
-            # 更新表格
-            self.tree.set(row_id, 'theoretical_runtime', str(theoretical_minutes))
-            # 更新时间稼动率
-            self._calculate_time_rate(row_id)
-            
-        except (ValueError, TypeError):
-            # 如果计算失败，设置为480
-            self.tree.set(row_id, 'theoretical_runtime', '480')
-            self._calculate_time_rate(row_id)
-
-    def _calculate_actual_runtime(self, row_id: str) -> None:
-        """计算实际运行时长 = 理论运行时长 - 停机时长"""
-        try:
-            # 先计算理论运行时长
-            self._calculate_theoretical_runtime(row_id)
-            
-            # 获取理论运行时长
-            theoretical_runtime = self.tree.set(row_id, 'theoretical_runtime')
-            if not theoretical_runtime:
-                theoretical_runtime = '480'
-            
-            # 获取停机时长
-            downtime_duration = self.tree.set(row_id, 'downtime_duration').replace(' 📝', '')
-            if not downtime_duration:
-                downtime_duration = '0'
-            
-            # 计算实际运行时长
-            theoretical_minutes = int(theoretical_runtime)
-            downtime_minutes = int(downtime_duration)
-            actual_minutes = theoretical_minutes - downtime_minutes
-            
-            # 确保不为负数
-            if actual_minutes < 0:
-                actual_minutes = 0
-            
-            # 更新表格
-            self.tree.set(row_id, 'actual_runtime', str(actual_minutes))
-            # 更新时间稼动率
-            self._calculate_time_rate(row_id)
-            
-        except (ValueError, TypeError):
-            # 如果计算失败，设置为空
-            self.tree.set(row_id, 'actual_runtime', '')
-            self._calculate_time_rate(row_id)
-
-    def _calculate_theoretical_qty(self, row_id: str) -> None:
-        """计算理论数量 = 实际运行时长 / 单个实际"""
-        try:
-            # 获取实际运行时长（分钟）
-            actual_runtime = self.tree.set(row_id, 'actual_runtime')
-            if not actual_runtime:
-                return
-            
-            # 获取单个实际（秒）
-            single_time = self.tree.set(row_id, 'single_time')
-            if not single_time:
-                return
-            
-            # 计算理论数量
-            actual_minutes = int(actual_runtime)
-            single_seconds = int(single_time)
-            
-            if single_seconds > 0:
-                # 将分钟转换为秒，然后除以单个时间
-                actual_seconds = actual_minutes * 60
-                theoretical_qty = actual_seconds / single_seconds
-                # 四舍五入到整数
-                theoretical_qty = round(theoretical_qty)
-            else:
-                theoretical_qty = 0
-            
-            # 更新表格
-            self.tree.set(row_id, 'theoretical_qty', str(theoretical_qty))
-            # 更新产能稼动率
-            self._calculate_capacity_rate(row_id)
-            
-        except (ValueError, TypeError):
-            # 如果计算失败，设置为空
-            self.tree.set(row_id, 'theoretical_qty', '')
-            self._calculate_capacity_rate(row_id)
-
-    def _calculate_capacity_rate(self, row_id: str) -> None:
-        """计算产能稼动率 = 实际数量 / 理论数量"""
-        try:
-            # 获取实际数量
-            actual_qty = self.tree.set(row_id, 'actual_qty')
-            if not actual_qty:
-                actual_qty = '0'
-            
-            # 获取理论数量
-            theoretical_qty = self.tree.set(row_id, 'theoretical_qty')
-            if not theoretical_qty:
-                theoretical_qty = '0'
-            
-            # 计算产能稼动率
-            actual = int(actual_qty)
-            theoretical = int(theoretical_qty)
-            
-            if theoretical > 0:
-                capacity_rate = actual / theoretical
-                # 转换为百分比，保留2位小数
-                capacity_rate_percent = round(capacity_rate * 100, 2)
-            else:
-                capacity_rate_percent = 0
-            
-            # 更新表格
-            self.tree.set(row_id, 'capacity_rate', f"{capacity_rate_percent}%")
-            
-        except (ValueError, TypeError):
-            # 如果计算失败，设置为空
-            self.tree.set(row_id, 'capacity_rate', '')
-
-    def _calculate_time_rate(self, row_id: str) -> None:
-        """计算时间稼动率 = 实际运行时长 / 理论运行时长"""
-        try:
-            # 获取实际运行时长
-            actual_runtime = self.tree.set(row_id, 'actual_runtime')
-            if not actual_runtime:
-                actual_runtime = '0'
-            
-            # 获取理论运行时长
-            theoretical_runtime = self.tree.set(row_id, 'theoretical_runtime')
-            if not theoretical_runtime:
-                theoretical_runtime = '0'
-            
-            # 计算时间稼动率
-            actual = int(actual_runtime)
-            theoretical = int(theoretical_runtime)
-            
-            if theoretical > 0:
-                time_rate = actual / theoretical
-                # 转换为百分比，保留2位小数
-                time_rate_percent = round(time_rate * 100, 2)
-            else:
-                time_rate_percent = 0
-            
-            # 更新表格
-            self.tree.set(row_id, 'time_rate', f"{time_rate_percent}%")
-            
-        except (ValueError, TypeError):
-            # 如果计算失败，设置为空
-            self.tree.set(row_id, 'time_rate', '')
+    def _recalculate_row(self, row_id: str) -> None:
+        """按 calc 模块重新计算该行的派生列：一次读取输入列、一次写回结果"""
+        values = {field: parse_cell_value(field, self.tree.set(row_id, field))
+                  for field in calc.DERIVATION_INPUT_FIELDS}
+        derived = calc.derive_fields(values, self.shift_minutes)
+        # 未填写单重时保留手工填写的实际数量
+        calc.keep_actual_qty(derived, parse_cell_value('actual_qty', self.tree.set(row_id, 'actual_qty')))
+        for field, value in derived.items():
+            self.tree.set(row_id, field, format_derived_value(field, value))
 
     def _destroy_editor(self) -> None:
         if self._editor is not None:
@@ -0,0 +1,181 @@
+"""产量记录派生字段的计算（Web 版和桌面版共用）
+
+只依赖标准库；安装了 numpy 时 derive_fields_batch 整列向量化计算，否则逐行计算，结果相同。
+"""
+import bisect
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+# 可选依赖：批量计算时用于向量化
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 由输入字段计算得出、不接受直接写入的字段
+DERIVED_FIELDS = ('theoretical_runtime', 'actual_runtime', 'theoretical_qty',
+                  'actual_qty', 'capacity_rate', 'time_rate')
+# 计算派生字段用到的输入字段
+DERIVATION_INPUT_FIELDS = ('adjustment_time', 'downtime_duration', 'single_time',
+                           'total_weight', 'tare_weight', 'unit_weight')
+# 计算用到的整数列（含手工填写的实际数量）：Web 版存储时用 round 取整，桌面版读取单元格时同样取整
+INTEGER_INPUT_FIELDS = ('adjustment_time', 'downtime_duration', 'single_time', 'actual_qty')
+
+
+class ShiftCalendar:
+    """按日期和工序查找班次分钟数。
+
+    rows 为 {process, start_date, minutes} 字典的序列（start_date 为 ISO 日期字符串或 None）。
+    指定了工序的设置优先于所有工序（process 为空）的设置；同一工序取生效日期不晚于记录日期的最近一条，
+    都没有时使用 default。
+    """
+
+    def __init__(self, rows, default):
+        self.default = default
+        self.rules = {}
+        for row in sorted(rows, key=lambda row: row['start_date'] or ''):
+            starts, minutes = self.rules.setdefault(row['process'], ([], []))
+            starts.append(date.fromisoformat(row['start_date']).toordinal() if row['start_date'] else 0)
+            minutes.append(row['minutes'])
+
+    def minutes(self, record_date, process):
+        for key in (process, ''):
+            rule = self.rules.get(key)
+            if rule:
+                position = bisect.bisect_right(rule[0], record_date.toordinal()) - 1
+                if position >= 0:
+                    return rule[1][position]
+        return self.default
+
+
+def percent(part, whole):
+    """part / whole 的百分比，保留 2 位小数；whole 为空或不大于 0 时为 None"""
+    if not whole or whole <= 0:
+        return None
+    return round(((part or 0) / whole) * 100, 2)
+
+
+def weight_quantity(total_weight, tare_weight, unit_weight):
+    """按重量计算的数量 = (总重 - 去皮重量) / 单重：十进制精确相除后四舍五入（ROUND_HALF_UP）取整，
+    负数按 0 计，与桌面版原先的计算相同。unit_weight 须大于 0"""
+    quotient = (Decimal(str(total_weight)) - Decimal(str(tare_weight))) / Decimal(str(unit_weight))
+    return max(0, int(quotient.quantize(Decimal('1'), rounding=ROUND_HALF_UP)))
+
+
+def derive_fields(values, shift_minutes):
+    """根据输入字段计算派生字段（纯函数）
+
+    values 为字段名到数值的映射，空值（None 或缺失）按 0 计算；shift_minutes 为该记录的班次分钟数。
+    返回派生字段字典，无法计算的字段为 None：理论数量或理论运行时长为 0 时稼动率为 None（显示为空），
+    不按 0% 计，以免拉低平均稼动率。
+    """
+    derived = {}
+
+    # 计算理论运行时长 = 班次分钟数 - 调机时长
+    adjustment_time = values.get('adjustment_time') or 0
+    theoretical_runtime = max(0, shift_minutes - adjustment_time)
+    derived['theoretical_runtime'] = theoretical_runtime
+
+    # 计算实际运行时长 = 理论运行时长 - 停机时长
+    downtime_duration = values.get('downtime_duration') or 0
+    actual_runtime = max(0, theoretical_runtime - downtime_duration)
+    derived['actual_runtime'] = actual_runtime
+
+    # 计算理论数量 = 实际运行时长 / 单个时间
+    single_time = values.get('single_time') or 0
+    theoretical_qty = round((actual_runtime * 60) / single_time) if single_time > 0 else None
+    derived['theoretical_qty'] = theoretical_qty
+
+    # 计算实际数量 = (总重 - 去皮重量) / 单重
+    total_weight = values.get('total_weight') or 0
+    tare_weight = values.get('tare_weight') or 0
+    unit_weight = values.get('unit_weight') or 0
+    actual_qty = weight_quantity(total_weight, tare_weight, unit_weight) if unit_weight > 0 else None
+    derived['actual_qty'] = actual_qty
+
+    # 计算产能稼动率 = 实际数量 / 理论数量
+    derived['capacity_rate'] = percent(actual_qty, theoretical_qty)
+
+    # 计算时间稼动率 = 实际运行时长 / 理论运行时长
+    derived['time_rate'] = percent(actual_runtime, theoretical_runtime)
+
+    return derived
+
+
+def keep_actual_qty(derived, actual_qty):
+    """无法按重量计算实际数量（未填写单重）时保留已有的实际数量（如手工填写的），产能稼动率按它重新计算。
+    修改并返回 derived"""
+    if derived['actual_qty'] is None and actual_qty is not None:
+        derived['actual_qty'] = actual_qty
+        derived['capacity_rate'] = percent(actual_qty, derived['theoretical_qty'])
+    return derived
+
+
+def _round_percent(percent):
+    """与 Python round(x, 2) 结果相同的舍入。numpy 先乘 100 再取整，乘法的误差可能使
+    恰好在两个结果中间附近的值舍入方向不同，这些值逐个用 round 计算"""
+    scaled = percent * 100
+    result = numpy.rint(scaled) / 100
+    with numpy.errstate(invalid='ignore'):
+        near_half = numpy.flatnonzero(numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6)
+    for index in near_half.tolist():
+        result[index] = round(float(percent[index]), 2)
+    return result
+
+
+def _round_quantity(total_weight, tare_weight, unit_weight):
+    """与 weight_quantity 结果相同的向量化计算。浮点相除的误差可能使恰好在两个整数中间附近的值
+    舍入方向不同，这些值逐个用 weight_quantity 计算；单重不大于 0 的为 nan"""
+    valid = unit_weight > 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        quotient = (total_weight - tare_weight) / unit_weight
+        result = numpy.where(valid, numpy.maximum(0, numpy.floor(quotient + 0.5)), numpy.nan)
+        near_half = numpy.flatnonzero(valid & (numpy.abs(quotient - numpy.floor(quotient) - 0.5) < 1e-6))
+    for index in near_half.tolist():
+        result[index] = weight_quantity(float(total_weight[index]), float(tare_weight[index]),
+                                        float(unit_weight[index]))
+    return result
+
+
+def _batch_values(array, integer):
+    """把 nan 表示空值的数组转换为列表，空值为 None"""
+    valid = ~numpy.isnan(array)
+    values = numpy.where(valid, array, 0).astype(numpy.int64 if integer else numpy.float64).tolist()
+    return [value if ok else None for value, ok in zip(values, valid.tolist())]
+
+
+def derive_fields_batch(columns, shift_minutes):
+    """derive_fields 的批量版本：columns 为输入字段到各行取值列表的映射，shift_minutes 为各行的
+    班次分钟数，返回派生字段到各行结果列表的映射，结果与逐行调用 derive_fields 完全相同。
+
+    安装了 numpy 时整列向量化计算，否则逐行计算。
+    """
+    if numpy is None:
+        rows = [derive_fields(dict(zip(columns, values)), minutes)
+                for values, minutes in zip(zip(*columns.values()), shift_minutes)]
+        return {field: [row[field] for row in rows] for field in DERIVED_FIELDS}
+
+    def column(field):
+        # 空值与 0 相同
+        return numpy.nan_to_num(numpy.array(columns[field], dtype=numpy.float64))
+
+    nan = numpy.nan
+    theoretical_runtime = numpy.maximum(0, numpy.array(shift_minutes, dtype=numpy.float64) - column('adjustment_time'))
+    actual_runtime = numpy.maximum(0, theoretical_runtime - column('downtime_duration'))
+    single_time = column('single_time')
+    actual_qty = _round_quantity(column('total_weight'), column('tare_weight'), column('unit_weight'))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        theoretical_qty = numpy.where(single_time > 0, numpy.rint(actual_runtime * 60 / single_time), nan)
+        # 理论数量为空或不大于 0 时产能稼动率为空
+        capacity_rate = numpy.where(numpy.nan_to_num(theoretical_qty) > 0,
+                                    _round_percent(numpy.nan_to_num(actual_qty) / theoretical_qty * 100), nan)
+        time_rate = numpy.where(theoretical_runtime > 0,
+                                _round_percent(actual_runtime / theoretical_runtime * 100), nan)
+    return {
+        'theoretical_runtime': _batch_values(theoretical_runtime, True),
+        'actual_runtime': _batch_values(actual_runtime, True),
+        'theoretical_qty': _batch_values(theoretical_qty, True),
+        'actual_qty': _batch_values(actual_qty, True),
+        'capacity_rate': _batch_values(capacity_rate, False),
+        'time_rate': _batch_values(time_rate, False),
+    }
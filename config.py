@@ -3,10 +3,63 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def database_uri():
+    """DATABASE_URL 中的 postgres:// 或 postgresql://（Railway、Render 等平台的写法）统一使用 psycopg2 驱动"""
+    uri = os.environ.get('DATABASE_URL') or 'sqlite:///production.db'
+    for prefix in ('postgres://', 'postgresql://'):
+        if uri.startswith(prefix):
+            return 'postgresql+psycopg2://' + uri[len(prefix):]
+    return uri
+
+def engine_options(uri):
+    """PostgreSQL 连接池参数，每个 gunicorn worker 各有一个连接池。
+
+    worker 内同时使用连接的最多是 --threads 个请求线程加一个变更推送线程，
+    pool_size + max_overflow 不应小于这个数；所有 worker 的总和不应超过服务器的 max_connections。
+    """
+    if not uri.startswith('postgresql'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 28)),
+        'pool_timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        # 借出连接前检测是否已被服务器或防火墙断开
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        # 批量 UPDATE/DELETE 等 executemany 语句按页合并发送，而不是每行往返一次
+        'executemany_mode': 'values_plus_batch',
+    }
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///production.db'
+    SQLALCHEMY_DATABASE_URI = database_uri()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 不分页读取记录时每次从数据库取的行数（PostgreSQL 使用服务端游标，不一次把结果全部读入内存）
+    RECORDS_STREAM_BATCH = int(os.environ.get('RECORDS_STREAM_BATCH', 2000))
+    # 默认班次分钟数，理论运行时长 = 班次分钟数 - 调机时长；可在 shift_length 表中按工序和日期另行设置
+    SHIFT_MINUTES = int(os.environ.get('SHIFT_MINUTES', 480))
+    # 小于此字节数的响应不压缩
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    # 每个 worker 的记录查询响应缓存上限（字节）
+    RECORDS_CACHE_MAX_BYTES = int(os.environ.get('RECORDS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    # 每个 worker 在内存中按列保存全部生产记录，统计和分组汇总直接在数组上计算（需安装 numpy，
+    # 每条记录约占 60 字节）；未启用时读汇总表
+    RECORDS_COLUMNAR_CACHE = os.environ.get('RECORDS_COLUMNAR_CACHE', '').lower() in ('1', 'true', 'yes')
+    # SQLite 每个连接执行的 PRAGMA（按顺序）：WAL 下读写互不阻塞，写锁被占用时最多等待 busy_timeout 毫秒
+    SQLITE_PRAGMAS = {
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64 * 1024,  # 负数单位为 KiB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # 每个 worker 进程最多同时保持的 SSE 推送连接数。每个连接长期占用一个线程，
+    # 应小于 gunicorn 的 --threads（默认 32），留出的线程处理普通请求；超出的页面改为定时轮询
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 16))
+    # SQLite 写请求在等待写锁超时后整体重试的次数
+    SQLITE_WRITE_RETRIES = int(os.environ.get('SQLITE_WRITE_RETRIES', 3))
 
 class DevelopmentConfig(Config):
     DEBUG = True
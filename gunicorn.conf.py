@@ -0,0 +1,13 @@
+# gunicorn 启动时自动读取当前目录下的本文件
+
+# 多线程 worker：每个 SSE 推送连接（/api/events）长期占用一个线程，每个 worker 最多 SSE_MAX_STREAMS 个，
+# 其余线程处理普通请求。命令行的 --threads 优先于这里的设置
+worker_class = 'gthread'
+threads = 32
+
+
+def post_worker_init(worker):
+    """每个 worker 启动后预加载员工、工序、产品规格快照，以及启用时的列式缓存"""
+    from web_app import preload_master_data, preload_record_columns
+    preload_master_data()
+    preload_record_columns()
@@ -1,6 +1,18 @@
 // 全局变量
 let records = [];
+let recordsNextCursor = null; // 下一页游标，null 表示已全部加载
+let recordsSyncCursor = null; // 增量同步游标，由 /api/records 和 /api/records/changes 返回
+let liveUpdatesConnected = false; // SSE 推送已连接时不再定时轮询记录
+let processNames = []; // 工序名称缓存，用于填充新追加行的工序选择框
 let employees = [];
+const RECORDS_PAGE_SIZE = 200;
+const RECORDS_MAX_PAGE_SIZE = 1000;
+const RECORDS_BATCH_MAX = 1000;
+// 表格用到的字段，列表请求只取这些列并使用紧凑格式（columns + rows）
+const RECORD_TABLE_FIELDS = ['date', 'name', 'position', 'product', 'process',
+    'theoretical_runtime', 'actual_runtime', 'single_time', 'theoretical_qty', 'actual_qty',
+    'total_weight', 'unit_weight', 'tare_weight', 'capacity_rate', 'time_rate',
+    'downtime_duration', 'adjustment_time', 'adjustment_master'];
 let currentCommentRecordId = null;
 let currentCommentColumn = null;
 let currentCommentDisplay = null;
@@ -28,8 +40,15 @@ document.addEventListener('DOMContentLoaded', function() {
         applyFilters();
     }, 1000); // 延迟1秒确保数据加载完成
     
-    // 设置自动刷新
-    setInterval(refreshData, 30000); // 每30秒刷新一次
+    // 优先使用服务器推送；推送不可用或断开时每30秒轮询一次
+    connectChangeEvents();
+    setInterval(() => {
+        if (liveUpdatesConnected) {
+            loadEmployees();
+        } else {
+            refreshData();
+        }
+    }, 30000);
     
     // 为筛选条件添加变化监听
     const filterInputs = ['filterStartDate', 'filterEndDate', 'filterName', 'filterProduct', 'filterProcess', 'filterAdjustmentMaster'];
@@ -68,8 +87,7 @@ document.addEventListener('DOMContentLoaded', function() {
 // 加载员工数据
 async function loadEmployees() {
     try {
-        const response = await fetch('/api/employees');
-        employees = await response.json();
+        employees = await fetchApiData('/api/employees');
         updateEmployeeSelects();
     } catch (error) {
         console.error('加载员工数据失败:', error);
@@ -105,45 +123,287 @@ function updateEmployeeSelects() {
     });
 }
 
-// 加载记录数据
-async function loadRecords() {
+// 构建筛选参数
+function buildFilterParams() {
+    const params = new URLSearchParams();
+    const startDate = document.getElementById('filterStartDate').value;
+    const endDate = document.getElementById('filterEndDate').value;
+    const name = document.getElementById('filterName').value;
+    const product = document.getElementById('filterProduct').value;
+    const process = document.getElementById('filterProcess').value;
+    const adjustmentMaster = document.getElementById('filterAdjustmentMaster').value;
+    
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    if (name) params.append('name', name);
+    if (product) params.append('product', product);
+    if (process) params.append('process', process);
+    if (adjustmentMaster) params.append('adjustment_master', adjustmentMaster);
+    return params;
+}
+
+// 加载记录数据（第一页）；keepLoaded 为 true 时重新加载当前已显示的行数
+async function loadRecords(keepLoaded = false) {
     try {
-        // 构建筛选参数
-        const params = new URLSearchParams();
-        const startDate = document.getElementById('filterStartDate').value;
-        const endDate = document.getElementById('filterEndDate').value;
-        const name = document.getElementById('filterName').value;
-        const product = document.getElementById('filterProduct').value;
-        const process = document.getElementById('filterProcess').value;
-        const adjustmentMaster = document.getElementById('filterAdjustmentMaster').value;
-        
-        if (startDate) params.append('start_date', startDate);
-        if (endDate) params.append('end_date', endDate);
-        if (name) params.append('name', name);
-        if (product) params.append('product', product);
-        if (process) params.append('process', process);
-        if (adjustmentMaster) params.append('adjustment_master', adjustmentMaster);
-        
-        const url = '/api/records' + (params.toString() ? '?' + params.toString() : '');
-        const response = await fetch(url);
-        records = await response.json();
+        const params = buildRecordPageParams();
+        const limit = keepLoaded
+            ? Math.min(Math.max(records.length, RECORDS_PAGE_SIZE), RECORDS_MAX_PAGE_SIZE)
+            : RECORDS_PAGE_SIZE;
+        params.append('limit', limit);
+        
+        const page = await fetchApiData('/api/records?' + params.toString());
+        records = expandRecords(page.records);
+        recordsNextCursor = page.next_cursor;
+        recordsSyncCursor = page.sync_cursor;
         displayRecords();
         updateFilterOptions();
-        calculateStats();
+        loadStatistics();
     } catch (error) {
         console.error('加载记录数据失败:', error);
     }
 }
 
+// 记录列表请求参数：筛选条件 + 只取表格字段的紧凑格式
+function buildRecordPageParams() {
+    const params = buildFilterParams();
+    params.append('fields', RECORD_TABLE_FIELDS.join(','));
+    params.append('shape', 'compact');
+    return params;
+}
+
+// 把 {columns, rows} 紧凑格式还原为记录对象数组
+function expandCompactRecords(compact) {
+    return compact.rows.map(row => {
+        const record = {};
+        compact.columns.forEach((column, index) => {
+            record[column] = row[index];
+        });
+        return record;
+    });
+}
+
+// 带 ETag 的 GET 响应缓存：保存原始响应体，304 时重新解码，调用方拿到的总是新对象
+const apiResponseCache = new Map();
+const API_RESPONSE_CACHE_SIZE = 50;
+const apiRequestsInFlight = new Map();
+
+// 请求 API 数据，优先使用 MessagePack，服务器不支持时按 JSON 解析；
+// 已缓存的地址带上 If-None-Match，数据未变时服务器返回 304，直接使用缓存
+async function fetchApiData(url) {
+    // 同一地址的并发请求（如计划编辑器每道工序各加载一次工序列表）共用一次网络请求，各自解码
+    let pending = apiRequestsInFlight.get(url);
+    if (!pending) {
+        pending = fetchApiEntry(url).finally(() => apiRequestsInFlight.delete(url));
+        apiRequestsInFlight.set(url, pending);
+    }
+    const entry = await pending;
+    
+    if (entry.contentType.startsWith('application/msgpack')) {
+        return decodeMsgpack(entry.body);
+    }
+    return JSON.parse(new TextDecoder().decode(entry.body));
+}
+
+async function fetchApiEntry(url) {
+    const cached = apiResponseCache.get(url);
+    const headers = { 'Accept': 'application/msgpack, application/json;q=0.9' };
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    const response = await fetch(url, { headers: headers });
+    
+    let entry = cached;
+    if (!(response.status === 304 && cached)) {
+        entry = {
+            etag: response.headers.get('ETag'),
+            contentType: response.headers.get('Content-Type') || '',
+            body: await response.arrayBuffer()
+        };
+    }
+    apiResponseCache.delete(url);
+    if (response.ok || response.status === 304) {
+        if (entry.etag) {
+            // Map 按插入顺序迭代，重新插入后最早的键即最久未用
+            apiResponseCache.set(url, entry);
+            if (apiResponseCache.size > API_RESPONSE_CACHE_SIZE) {
+                apiResponseCache.delete(apiResponseCache.keys().next().value);
+            }
+        }
+    }
+    return entry;
+}
+
+// 解码 MessagePack（只实现后端会用到的类型，不含 ext）
+function decodeMsgpack(buffer) {
+    const bytes = new Uint8Array(buffer);
+    const view = new DataView(buffer);
+    const textDecoder = new TextDecoder();
+    let offset = 0;
+    
+    function readUint(size) {
+        let value;
+        if (size === 1) value = view.getUint8(offset);
+        else if (size === 2) value = view.getUint16(offset);
+        else if (size === 4) value = view.getUint32(offset);
+        else value = Number(view.getBigUint64(offset));
+        offset += size;
+        return value;
+    }
+    function readInt(size) {
+        let value;
+        if (size === 1) value = view.getInt8(offset);
+        else if (size === 2) value = view.getInt16(offset);
+        else if (size === 4) value = view.getInt32(offset);
+        else value = Number(view.getBigInt64(offset));
+        offset += size;
+        return value;
+    }
+    function readString(length) {
+        const text = textDecoder.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return text;
+    }
+    function readBinary(length) {
+        const data = bytes.slice(offset, offset + length);
+        offset += length;
+        return data;
+    }
+    function readArray(length) {
+        const result = new Array(length);
+        for (let i = 0; i < length; i++) result[i] = read();
+        return result;
+    }
+    function readMap(length) {
+        const result = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            result[key] = read();
+        }
+        return result;
+    }
+    function read() {
+        const type = bytes[offset++];
+        if (type <= 0x7f) return type;
+        if (type <= 0x8f) return readMap(type & 0x0f);
+        if (type <= 0x9f) return readArray(type & 0x0f);
+        if (type <= 0xbf) return readString(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return readBinary(readUint(1));
+            case 0xc5: return readBinary(readUint(2));
+            case 0xc6: return readBinary(readUint(4));
+            case 0xca: { const value = view.getFloat32(offset); offset += 4; return value; }
+            case 0xcb: { const value = view.getFloat64(offset); offset += 8; return value; }
+            case 0xcc: return readUint(1);
+            case 0xcd: return readUint(2);
+            case 0xce: return readUint(4);
+            case 0xcf: return readUint(8);
+            case 0xd0: return readInt(1);
+            case 0xd1: return readInt(2);
+            case 0xd2: return readInt(4);
+            case 0xd3: return readInt(8);
+            case 0xd9: return readString(readUint(1));
+            case 0xda: return readString(readUint(2));
+            case 0xdb: return readString(readUint(4));
+            case 0xdc: return readArray(readUint(2));
+            case 0xdd: return readArray(readUint(4));
+            case 0xde: return readMap(readUint(2));
+            case 0xdf: return readMap(readUint(4));
+        }
+        throw new Error(`不支持的 MessagePack 类型 0x${type.toString(16)}`);
+    }
+    
+    return read();
+}
+
+// 把记录列表（MessagePack 的字典编码格式或 JSON 的紧凑格式）还原为记录对象数组
+function expandRecords(payload) {
+    if (!payload.strings) {
+        return expandCompactRecords(payload);
+    }
+    
+    // MessagePack 中数值列为数值、比率不带百分号，这里转换为与 JSON 接口相同的字符串
+    const RAW = 0, DICTIONARY = 1, NUMBER = 2, RATE = 3;
+    const dictionaryColumns = new Set(payload.dictionary_columns);
+    const columns = payload.columns;
+    const strings = payload.strings;
+    const kinds = columns.map(column => {
+        if (column === 'id' || column === 'created_at' || column === 'updated_at') return RAW;
+        if (dictionaryColumns.has(column)) return DICTIONARY;
+        return column === 'capacity_rate' || column === 'time_rate' ? RATE : NUMBER;
+    });
+    
+    const result = new Array(payload.rows.length);
+    for (let i = 0; i < payload.rows.length; i++) {
+        const row = payload.rows[i];
+        const record = {};
+        for (let j = 0; j < columns.length; j++) {
+            const value = row[j];
+            const kind = kinds[j];
+            if (kind === DICTIONARY) {
+                record[columns[j]] = strings[value];
+            } else if (kind === RAW) {
+                record[columns[j]] = value;
+            } else if (value === null) {
+                record[columns[j]] = '';
+            } else {
+                record[columns[j]] = kind === RATE ? value + '%' : '' + value;
+            }
+        }
+        result[i] = record;
+    }
+    return result;
+}
+
+// 加载下一页记录
+async function loadMoreRecords() {
+    if (!recordsNextCursor) return;
+    
+    const button = document.getElementById('loadMoreRecordsBtn');
+    button.disabled = true;
+    try {
+        const params = buildRecordPageParams();
+        params.append('limit', RECORDS_PAGE_SIZE);
+        params.append('after', recordsNextCursor);
+        
+        const page = await fetchApiData('/api/records?' + params.toString());
+        const pageRecords = expandRecords(page.records);
+        records = records.concat(pageRecords);
+        recordsNextCursor = page.next_cursor;
+        appendRecordRows(pageRecords);
+        updateLoadMoreButton();
+    } catch (error) {
+        console.error('加载更多记录失败:', error);
+    } finally {
+        button.disabled = false;
+    }
+}
+
+// 根据是否还有下一页显示“加载更多”按钮
+function updateLoadMoreButton() {
+    const button = document.getElementById('loadMoreRecordsBtn');
+    button.style.display = recordsNextCursor ? 'inline-block' : 'none';
+}
+
 // 显示记录
 function displayRecords() {
+    document.getElementById('recordsTableBody').innerHTML = '';
+    appendRecordRows(records);
+    updateLoadMoreButton();
+}
+
+// 在表格末尾追加记录行
+function appendRecordRows(pageRecords) {
     const tbody = document.getElementById('recordsTableBody');
-    tbody.innerHTML = '';
+    const checkboxDisplay = batchDeleteMode ? 'table-cell' : 'none';
     
-    records.forEach(record => {
+    pageRecords.forEach(record => {
         const row = document.createElement('tr');
         row.innerHTML = `
-            <td style="display: none;" class="checkbox-cell">
+            <td style="display: ${checkboxDisplay};" class="checkbox-cell">
                 <input type="checkbox" class="record-checkbox" value="${record.id}" onchange="updateBatchDeleteButtons()">
             </td>
             <td>${record.date}</td>
@@ -180,21 +440,35 @@ function displayRecords() {
             </td>
         `;
         tbody.appendChild(row);
+        fillProcessSelect(row.querySelector('select[data-current-value]'));
+    });
+}
+
+// 用缓存的工序列表填充记录行中的工序选择框
+function fillProcessSelect(select) {
+    const currentValue = select.getAttribute('data-current-value');
+    select.innerHTML = '<option value="">选择工序</option>';
+    processNames.forEach(process => {
+        const option = document.createElement('option');
+        option.value = process;
+        option.textContent = process;
+        select.appendChild(option);
     });
+    select.value = currentValue;
 }
 
 // 更新筛选选项
 function updateFilterOptions() {
-    // 并行获取记录数据和工序数据
+    // 并行获取各筛选字段的不同取值（服务端分组统计并缓存）和工序数据
     Promise.all([
-        fetch('/api/records').then(response => response.json()),
-        fetch('/api/processes').then(response => response.json())
+        fetchApiData('/api/records/facets?fields=product,name,adjustment_master'),
+        fetchApiData('/api/processes')
     ])
-        .then(([allRecords, processes]) => {
-            const products = [...new Set(allRecords.map(r => r.product).filter(p => p))];
-            const processNames = processes.map(p => p.name);
-            const names = [...new Set(allRecords.map(r => r.name).filter(n => n))];
-            const adjustmentMasters = [...new Set(allRecords.map(r => r.adjustment_master).filter(m => m))];
+        .then(([facets, processes]) => {
+            const products = facets.product.map(item => item.value);
+            processNames = processes.map(p => p.name);
+            const names = facets.name.map(item => item.value);
+            const adjustmentMasters = facets.adjustment_master.map(item => item.value);
             
             const productSelect = document.getElementById('filterProduct');
             const processSelect = document.getElementById('filterProcess');
@@ -280,18 +554,7 @@ function updateFilterOptions() {
             }
             
             // 更新记录表格中的工序选择框
-            const recordProcessSelects = document.querySelectorAll('select[data-current-value]');
-            recordProcessSelects.forEach(select => {
-                const currentValue = select.getAttribute('data-current-value');
-                select.innerHTML = '<option value="">选择工序</option>';
-                processNames.forEach(process => {
-                    const option = document.createElement('option');
-                    option.value = process;
-                    option.textContent = process;
-                    select.appendChild(option);
-                });
-                select.value = currentValue;
-            });
+            document.querySelectorAll('select[data-current-value]').forEach(fillProcessSelect);
             
             // 更新编辑模态框中的工序选择框
             const editProcessSelect = document.getElementById('editProcess');
@@ -312,37 +575,16 @@ function updateFilterOptions() {
         });
 }
 
-// 计算统计信息
-function calculateStats() {
-    let totalActualQty = 0;
-    let capacityRates = [];
-    let timeRates = [];
-    
-    records.forEach(record => {
-        if (record.actual_qty) {
-            totalActualQty += parseInt(record.actual_qty) || 0;
-        }
-        
-        if (record.capacity_rate && record.capacity_rate.endsWith('%')) {
-            const rate = parseFloat(record.capacity_rate.replace('%', ''));
-            if (!isNaN(rate)) capacityRates.push(rate);
-        }
-        
-        if (record.time_rate && record.time_rate.endsWith('%')) {
-            const rate = parseFloat(record.time_rate.replace('%', ''));
-            if (!isNaN(rate)) timeRates.push(rate);
-        }
-    });
-    
-    document.getElementById('totalActualQty').textContent = totalActualQty;
-    
-    const avgCapacityRate = capacityRates.length > 0 ? 
-        (capacityRates.reduce((a, b) => a + b, 0) / capacityRates.length).toFixed(2) : 0;
-    document.getElementById('avgCapacityRate').textContent = avgCapacityRate + '%';
-    
-    const avgTimeRate = timeRates.length > 0 ? 
-        (timeRates.reduce((a, b) => a + b, 0) / timeRates.length).toFixed(2) : 0;
-    document.getElementById('avgTimeRate').textContent = avgTimeRate + '%';
+// 加载统计信息（服务端按当前筛选条件聚合，与已加载的页数无关）
+async function loadStatistics() {
+    try {
+        const stats = await fetchApiData('/api/statistics?' + buildFilterParams().toString());
+        document.getElementById('totalActualQty').textContent = stats.total_actual_qty;
+        document.getElementById('avgCapacityRate').textContent = stats.avg_capacity_rate.toFixed(2) + '%';
+        document.getElementById('avgTimeRate').textContent = stats.avg_time_rate.toFixed(2) + '%';
+    } catch (error) {
+        console.error('加载统计信息失败:', error);
+    }
 }
 
 // 添加员工
@@ -557,14 +799,12 @@ function openProductionPlanning() {
 // 加载产量计划用于计划管理
 async function loadProductionPlansForPlanning() {
     try {
-        // 获取所有记录中的产品规格
-        const recordsResponse = await fetch('/api/records');
-        const records = await recordsResponse.json();
-        const products = [...new Set(records.map(r => r.product).filter(p => p))];
-        
-        // 获取现有产量计划
-        const plansResponse = await fetch('/api/production-plans');
-        const plans = await plansResponse.json();
+        // 记录中出现过的产品规格取自筛选取值接口，不下载全部记录；与现有产量计划并行请求
+        const [facets, plans] = await Promise.all([
+            fetchApiData('/api/records/facets?fields=product'),
+            fetchApiData('/api/production-plans')
+        ]);
+        const products = facets.product.map(item => item.value).filter(p => p);
         
         displayProductionPlansForPlanning(products, plans);
     } catch (error) {
@@ -584,27 +824,11 @@ function displayProductionPlansForPlanning(products, plans) {
         // 构建工序配置显示（包含完成率）
         let processConfig = '';
         if (plan) {
-            const processes = [];
-            if (plan.process1) {
-                const completion = plan.process_completion && plan.process_completion[plan.process1];
-                const completionText = completion ? ` (完成率: ${completion.completion_rate}%)` : '';
-                processes.push(`${plan.process1}: ${plan.qty1 || 0}${completionText}`);
-            }
-            if (plan.process2) {
-                const completion = plan.process_completion && plan.process_completion[plan.process2];
-                const completionText = completion ? ` (完成率: ${completion.completion_rate}%)` : '';
-                processes.push(`${plan.process2}: ${plan.qty2 || 0}${completionText}`);
-            }
-            if (plan.process3) {
-                const completion = plan.process_completion && plan.process_completion[plan.process3];
+            const processes = plan.steps.map(step => {
+                const completion = plan.process_completion && plan.process_completion[step.process];
                 const completionText = completion ? ` (完成率: ${completion.completion_rate}%)` : '';
-                processes.push(`${plan.process3}: ${plan.qty3 || 0}${completionText}`);
-            }
-            if (plan.process4) {
-                const completion = plan.process_completion && plan.process_completion[plan.process4];
-                const completionText = completion ? ` (完成率: ${completion.completion_rate}%)` : '';
-                processes.push(`${plan.process4}: ${plan.qty4 || 0}${completionText}`);
-            }
+                return `${step.process}: ${step.qty || 0}${completionText}`;
+            });
             processConfig = processes.length > 0 ? processes.join('<br>') : '未配置';
         } else {
             processConfig = '未配置';
@@ -664,24 +888,22 @@ function editProductionPlan(product) {
     });
 }
 
+// 获取单个产品的产量计划，不存在时返回 undefined
+async function fetchProductionPlan(product) {
+    const plans = await fetchApiData('/api/production-plans?product=' + encodeURIComponent(product));
+    return plans[0];
+}
+
 // 加载产量计划配置
 async function loadProductionPlanConfig(product) {
     try {
-        const response = await fetch('/api/production-plans');
-        const plans = await response.json();
-        const plan = plans.find(p => p.product === product);
+        const plan = await fetchProductionPlan(product);
         
         const container = document.getElementById('processConfigContainer');
         container.innerHTML = '';
         
         // 默认至少有一个工序
-        const processes = [];
-        if (plan) {
-            if (plan.process1) processes.push({process: plan.process1, qty: plan.qty1 || 0});
-            if (plan.process2) processes.push({process: plan.process2, qty: plan.qty2 || 0});
-            if (plan.process3) processes.push({process: plan.process3, qty: plan.qty3 || 0});
-            if (plan.process4) processes.push({process: plan.process4, qty: plan.qty4 || 0});
-        }
+        const processes = plan ? plan.steps.map(step => ({process: step.process, qty: step.qty || 0})) : [];
         
         // 如果没有工序，添加一个默认的
         if (processes.length === 0) {
@@ -730,8 +952,7 @@ function addProcessConfigRow(processNum, selectedProcess = '', qty = 0) {
 // 加载工序选项
 async function loadProcessOptions(processNum, selectedProcess = '') {
     try {
-        const response = await fetch('/api/processes');
-        const processes = await response.json();
+        const processes = await fetchApiData('/api/processes');
         
         const select = document.querySelector(`select[data-process-num="${processNum}"]`);
         select.innerHTML = '<option value="">选择工序</option>';
@@ -769,24 +990,18 @@ async function saveProductionPlan(product) {
     const processRows = document.querySelectorAll('#processConfigContainer .row');
     const planData = {
         product: product,
-        process1: '',
-        qty1: 0,
-        process2: '',
-        qty2: 0,
-        process3: '',
-        qty3: 0,
-        process4: '',
-        qty4: 0
+        steps: []
     };
     
-    processRows.forEach((row, index) => {
+    processRows.forEach(row => {
         const processSelect = row.querySelector('.process-select');
         const qtyInput = row.querySelector('.process-qty');
         
-        if (processSelect && qtyInput) {
-            const processNum = index + 1;
-            planData[`process${processNum}`] = processSelect.value;
-            planData[`qty${processNum}`] = parseInt(qtyInput.value) || 0;
+        if (processSelect && qtyInput && processSelect.value) {
+            planData.steps.push({
+                process: processSelect.value,
+                qty: parseInt(qtyInput.value) || 0
+            });
         }
     });
     
@@ -871,16 +1086,10 @@ async function loadProductionPlanInfo(product) {
     }
     
     try {
-        const response = await fetch('/api/production-plans');
-        const plans = await response.json();
-        const plan = plans.find(p => p.product === product);
+        const plan = await fetchProductionPlan(product);
         
         if (plan) {
-            const processes = [];
-            if (plan.process1) processes.push(`${plan.process1}: ${plan.qty1 || 0}`);
-            if (plan.process2) processes.push(`${plan.process2}: ${plan.qty2 || 0}`);
-            if (plan.process3) processes.push(`${plan.process3}: ${plan.qty3 || 0}`);
-            if (plan.process4) processes.push(`${plan.process4}: ${plan.qty4 || 0}`);
+            const processes = plan.steps.map(step => `${step.process}: ${step.qty || 0}`);
             
             if (processes.length > 0) {
                 detailsDiv.innerHTML = `
@@ -908,128 +1117,61 @@ async function loadProductionPlanInfo(product) {
     }
 }
 
-// 导出数据到Excel
-async function exportToExcel() {
+// 导出数据到Excel：服务器按当前筛选条件边查询边生成文件（含筛选范围的统计），浏览器直接下载，
+// 不在页面中加载全部记录
+function exportToExcel(format = 'xlsx') {
+    const params = buildFilterParams();
+    params.append('format', format);
+    const link = document.createElement('a');
+    link.href = '/api/records/export?' + params.toString();
+    link.download = '';
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+}
+
+// 从 CSV/XLSX 文件导入记录：服务器边读边分批写入，中断后重新选择同一文件会从中断处继续
+async function importRecords(input) {
+    const file = input.files[0];
+    input.value = '';
+    if (!file) return;
+
+    const formData = new FormData();
+    formData.append('file', file);
     try {
-        // 显示加载提示
-        const exportBtn = event.target.closest('button');
-        const originalText = exportBtn.innerHTML;
-        exportBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>导出中...';
-        exportBtn.disabled = true;
-        
-        // 获取筛选后的数据
-        const filterProduct = document.getElementById('filterProduct')?.value || '';
-        const filterProcess = document.getElementById('filterProcess')?.value || '';
-        const filterName = document.getElementById('filterName')?.value || '';
-        const filterAdjustmentMaster = document.getElementById('filterAdjustmentMaster')?.value || '';
-        const startDate = document.getElementById('filterStartDate')?.value || '';
-        const endDate = document.getElementById('filterEndDate')?.value || '';
-        
-        // 构建筛选URL
-        let recordsUrl = '/api/records';
-        const params = new URLSearchParams();
-        if (filterProduct) params.append('product', filterProduct);
-        if (filterProcess) params.append('process', filterProcess);
-        if (filterName) params.append('name', filterName);
-        if (filterAdjustmentMaster) params.append('adjustment_master', filterAdjustmentMaster);
-        if (startDate) params.append('start_date', startDate);
-        if (endDate) params.append('end_date', endDate);
-        
-        if (params.toString()) {
-            recordsUrl += '?' + params.toString();
+        let response = await fetch('/api/records/import', { method: 'POST', body: formData });
+        let result = await response.json();
+        if (result.already_imported) {
+            if (!confirm(`该文件已导入过（${result.total_imported} 条记录），确定要再导入一次吗？`)) {
+                return;
+            }
+            formData.append('restart', '1');
+            response = await fetch('/api/records/import', { method: 'POST', body: formData });
+            result = await response.json();
         }
-        
-        // 获取筛选后的数据和统计数据
-        const [recordsResponse, statisticsResponse] = await Promise.all([
-            fetch(recordsUrl),
-            fetch('/api/statistics')
-        ]);
-        
-        const records = await recordsResponse.json();
-        const statistics = await statisticsResponse.json();
-        
-        // 调试信息
-        console.log('筛选条件:', {
-            product: filterProduct,
-            process: filterProcess,
-            name: filterName,
-            adjustment_master: filterAdjustmentMaster,
-            start_date: startDate,
-            end_date: endDate
-        });
-        console.log('筛选后的记录数量:', records.length);
-        console.log('统计数据:', statistics);
-        
-        // 创建工作簿
-        const wb = XLSX.utils.book_new();
-        
-        // 创建产量记录格式的数据表
-        const recordsData = [];
-        
-        // 添加筛选后的产量记录数据（与页面表格格式一致）
-        records.forEach(record => {
-            recordsData.push({
-                '日期': record.date,
-                '姓名': record.name,
-                '职位': record.position,
-                '产品规格': record.product,
-                '工序': record.process,
-                '单件时间': record.single_time,
-                '实际数量': record.actual_qty,
-                '总重量': record.total_weight,
-                '单重': record.unit_weight,
-                '皮重': record.tare_weight,
-                '停机时长': record.downtime_duration,
-                '调机时间': record.adjustment_time,
-                '调机师傅': record.adjustment_master,
-                '创建时间': record.created_at ? new Date(record.created_at).toLocaleString('zh-CN') : '',
-                '更新时间': record.updated_at ? new Date(record.updated_at).toLocaleString('zh-CN') : ''
-            });
-        });
-        
-        // 创建产量记录工作表
-        const recordsWS = XLSX.utils.json_to_sheet(recordsData);
-        XLSX.utils.book_append_sheet(wb, recordsWS, '产量记录');
-        
-        // 创建统计数据工作表
-        const statisticsData = [
-            { '统计项目': '合计实际数量', '数值': statistics.total_actual_qty, '单位': '件' },
-            { '统计项目': '平均产能稼动率', '数值': statistics.avg_capacity_rate, '单位': '%' },
-            { '统计项目': '平均时间稼动率', '数值': statistics.avg_time_rate, '单位': '%' },
-            { '统计项目': '总记录数', '数值': statistics.total_records, '单位': '条' },
-            { '统计项目': '导出时间', '数值': new Date().toLocaleString('zh-CN'), '单位': '' }
-        ];
-        
-        const statisticsWS = XLSX.utils.json_to_sheet(statisticsData);
-        XLSX.utils.book_append_sheet(wb, statisticsWS, '统计数据');
-        
-        // 生成文件名
-        const now = new Date();
-        const timestamp = now.toISOString().slice(0, 19).replace(/[:-]/g, '');
-        const filename = `阳昶产量记录管理系统_${timestamp}.xlsx`;
-        
-        // 导出文件
-        XLSX.writeFile(wb, filename);
-        
-        // 恢复按钮状态
-        exportBtn.innerHTML = originalText;
-        exportBtn.disabled = false;
-        
-        // 显示导出的工作表信息
-        const sheetNames = wb.SheetNames;
-        console.log('导出的工作表:', sheetNames);
-        alert(`数据导出成功！包含 ${sheetNames.length} 个工作表：${sheetNames.join(', ')}`);
-        
+        if (!result.success) {
+            alert('导入失败：' + result.message);
+            return;
+        }
+
+        let message = `导入 ${result.imported} 条记录`;
+        if (result.resumed_from_row) {
+            message = `从第 ${result.resumed_from_row} 行继续，` + message;
+        }
+        if (result.failed > 0) {
+            message += `，${result.failed} 行失败：\n` +
+                result.errors.map(error => `第 ${error.row} 行：${error.message}`).join('\n');
+        }
+        if (result.ignored_columns.length > 0) {
+            message += `\n未识别的列已忽略：${result.ignored_columns.join('、')}`;
+        }
+        alert(message);
+
+        loadRecords();
+        refreshProductionPlanInfo();
     } catch (error) {
-        console.error('导出失败:', error);
-        console.error('错误详情:', error.message);
-        console.error('错误堆栈:', error.stack);
-        alert('导出失败，请重试。错误信息：' + error.message);
-        
-        // 恢复按钮状态
-        const exportBtn = event.target.closest('button');
-        exportBtn.innerHTML = '<i class="fas fa-file-excel me-2"></i>导出数据';
-        exportBtn.disabled = false;
+        console.error('导入数据失败:', error);
+        alert('导入数据失败');
     }
 }
 
@@ -1131,18 +1273,25 @@ async function deleteSelectedRecords() {
         deleteBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>删除中...';
         deleteBtn.disabled = true;
         
-        // 并行删除所有选中的记录
-        const deletePromises = selectedIds.map(id => 
-            fetch(`/api/records/${id}`, { method: 'DELETE' })
-        );
-        
-        const responses = await Promise.all(deletePromises);
-        
-        // 检查所有删除操作是否成功
-        const failedDeletes = responses.filter(response => !response.ok);
+        // 通过批量接口删除，每次请求最多 RECORDS_BATCH_MAX 条，在一个事务中完成
+        let failedCount = 0;
+        for (let i = 0; i < selectedIds.length; i += RECORDS_BATCH_MAX) {
+            const ids = selectedIds.slice(i, i + RECORDS_BATCH_MAX).map(Number);
+            const response = await fetch('/api/records/batch', {
+                method: 'DELETE',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids: ids })
+            });
+            if (!response.ok) {
+                failedCount += ids.length;
+                continue;
+            }
+            const result = await response.json();
+            failedCount += result.failed;
+        }
         
-        if (failedDeletes.length > 0) {
-            alert(`删除失败：${failedDeletes.length} 条记录删除失败`);
+        if (failedCount > 0) {
+            alert(`删除失败：${failedCount} 条记录删除失败`);
         } else {
             alert(`成功删除 ${selectedIds.length} 条记录`);
         }
@@ -1199,44 +1348,14 @@ async function loadProductionPlanInfoForFilter(product) {
     }
     
     try {
-        const response = await fetch('/api/production-plans');
-        const plans = await response.json();
-        const plan = plans.find(p => p.product === product);
+        const plan = await fetchProductionPlan(product);
         
         if (plan) {
-            const processes = [];
-            if (plan.process1) {
-                const completion = plan.process_completion && plan.process_completion[plan.process1];
-                processes.push({
-                    name: plan.process1,
-                    qty: plan.qty1 || 0,
-                    completion: completion
-                });
-            }
-            if (plan.process2) {
-                const completion = plan.process_completion && plan.process_completion[plan.process2];
-                processes.push({
-                    name: plan.process2,
-                    qty: plan.qty2 || 0,
-                    completion: completion
-                });
-            }
-            if (plan.process3) {
-                const completion = plan.process_completion && plan.process_completion[plan.process3];
-                processes.push({
-                    name: plan.process3,
-                    qty: plan.qty3 || 0,
-                    completion: completion
-                });
-            }
-            if (plan.process4) {
-                const completion = plan.process_completion && plan.process_completion[plan.process4];
-                processes.push({
-                    name: plan.process4,
-                    qty: plan.qty4 || 0,
-                    completion: completion
-                });
-            }
+            const processes = plan.steps.map(step => ({
+                name: step.process,
+                qty: step.qty || 0,
+                completion: plan.process_completion && plan.process_completion[step.process]
+            }));
             
             if (processes.length > 0) {
                 detailsDiv.innerHTML = `
@@ -1318,8 +1437,7 @@ function initProcessManagement() {
 // 加载工序列表
 async function loadProcesses() {
     try {
-        const response = await fetch('/api/processes');
-        const processes = await response.json();
+        const processes = await fetchApiData('/api/processes');
         displayProcesses(processes);
         updateProcessOptions(processes);
     } catch (error) {
@@ -1347,7 +1465,7 @@ function displayProcesses(processes) {
 
 // 更新所有工序选项
 function updateProcessOptions(processes) {
-    const processNames = processes.map(p => p.name);
+    processNames = processes.map(p => p.name);
     
     // 更新筛选区域的工序选项
     const processSelect = document.getElementById('filterProcess');
@@ -1365,18 +1483,7 @@ function updateProcessOptions(processes) {
     
     
     // 更新记录表格中的工序选择框
-    const recordProcessSelects = document.querySelectorAll('select[data-current-value]');
-    recordProcessSelects.forEach(select => {
-        const currentValue = select.getAttribute('data-current-value');
-        select.innerHTML = '<option value="">选择工序</option>';
-        processNames.forEach(process => {
-            const option = document.createElement('option');
-            option.value = process;
-            option.textContent = process;
-            select.appendChild(option);
-        });
-        select.value = currentValue;
-    });
+    document.querySelectorAll('select[data-current-value]').forEach(fillProcessSelect);
     
     // 更新编辑模态框中的工序选择框
     const editProcessSelect = document.getElementById('editProcess');
@@ -1472,8 +1579,7 @@ function openProcessManagement() {
 // 为工序管理弹窗加载工序列表
 async function loadProcessesForManagement() {
     try {
-        const response = await fetch('/api/processes');
-        const processes = await response.json();
+        const processes = await fetchApiData('/api/processes');
         displayProcessesForManagement(processes);
     } catch (error) {
         console.error('加载工序列表失败:', error);
@@ -1508,8 +1614,7 @@ function searchProcesses() {
         return;
     }
     
-    fetch('/api/processes')
-        .then(response => response.json())
+    fetchApiData('/api/processes')
         .then(processes => {
             const filteredProcesses = processes.filter(process => 
                 process.name.toLowerCase().includes(searchTerm) ||
@@ -1537,8 +1642,7 @@ function openEmployeeManagement() {
 // 为员工管理弹窗加载员工列表
 async function loadEmployeesForManagement() {
     try {
-        const response = await fetch('/api/employees');
-        const employees = await response.json();
+        const employees = await fetchApiData('/api/employees');
         displayEmployeesForManagement(employees);
     } catch (error) {
         console.error('加载员工列表失败:', error);
@@ -1573,8 +1677,7 @@ function searchEmployees() {
         return;
     }
     
-    fetch('/api/employees')
-        .then(response => response.json())
+    fetchApiData('/api/employees')
         .then(employees => {
             const filteredEmployees = employees.filter(employee => 
                 employee.name.toLowerCase().includes(searchTerm) ||
@@ -1745,8 +1848,7 @@ async function toggleComment(recordId, columnKey, event) {
     
     // 获取注释内容
     try {
-        const response = await fetch(`/api/comments/${recordId}/${columnKey}`);
-        const data = await response.json();
+        const data = await fetchApiData(`/api/comments/${recordId}/${columnKey}`);
         
         if (data.comment) {
             showCommentDisplay(event, data.comment, commentKey);
@@ -1797,8 +1899,7 @@ async function editComment(recordId, columnKey, event) {
     currentCommentColumn = columnKey;
     
     try {
-        const response = await fetch(`/api/comments/${recordId}/${columnKey}`);
-        const data = await response.json();
+        const data = await fetchApiData(`/api/comments/${recordId}/${columnKey}`);
         document.getElementById('commentText').value = data.comment || '';
     } catch (error) {
         console.error('获取注释失败:', error);
@@ -1870,10 +1971,107 @@ function clearFilters() {
 
 // 刷新数据
 function refreshData() {
-    loadRecords();
+    syncRecordChanges();
     loadEmployees();
 }
 
+// 只拉取上次同步之后变化的记录，游标失效时回退为重新加载
+async function syncRecordChanges() {
+    if (!recordsSyncCursor) {
+        loadRecords(true);
+        return;
+    }
+    try {
+        const params = buildFilterParams();
+        params.append('since', recordsSyncCursor);
+        const response = await fetch('/api/records/changes?' + params.toString());
+        const changes = response.ok ? await response.json() : { reset: true };
+        if (changes.reset) {
+            loadRecords(true);
+            return;
+        }
+        recordsSyncCursor = changes.cursor;
+        if (changes.records.length > 0 || changes.deleted.length > 0) {
+            applyRecordChanges(changes.records, changes.deleted);
+        }
+    } catch (error) {
+        console.error('同步记录变化失败:', error);
+    }
+}
+
+// 订阅服务器推送的变更事件
+function connectChangeEvents() {
+    if (!window.EventSource) return;
+    
+    const source = new EventSource('/api/events');
+    source.onopen = function() {
+        liveUpdatesConnected = true;
+        // 连接或重连后补齐断开期间的变化
+        syncRecordChanges();
+    };
+    source.onerror = function() {
+        // EventSource 会自动重连，期间回退为定时轮询
+        liveUpdatesConnected = false;
+        if (source.readyState === EventSource.CLOSED) {
+            // 服务器拒绝连接（如推送连接数已满返回 503）时不会自动重连，一分钟后再试
+            setTimeout(connectChangeEvents, 60000);
+        }
+    };
+    source.addEventListener('record', scheduleRecordSync);
+    source.addEventListener('comment', event => applyCommentEvent(JSON.parse(event.data)));
+    source.addEventListener('plan', () => refreshProductionPlanInfo());
+}
+
+// 合并短时间内的多条记录事件（如批量操作）为一次增量同步
+function scheduleRecordSync() {
+    clearTimeout(window.recordSyncTimeout);
+    window.recordSyncTimeout = setTimeout(syncRecordChanges, 200);
+}
+
+// 正在显示的注释被其他用户修改或删除时同步更新
+function applyCommentEvent(change) {
+    const commentKey = `${change.record_id}-${change.column_key}`;
+    if (currentCommentDisplay !== commentKey) return;
+    
+    if (change.action === 'delete') {
+        hideCommentDisplay();
+    } else {
+        const popup = document.getElementById('commentDisplay');
+        if (popup) {
+            popup.textContent = change.comment;
+        }
+    }
+}
+
+// 记录排序与后端一致：按日期、ID 倒序
+function compareRecords(a, b) {
+    if (a.date !== b.date) return a.date < b.date ? 1 : -1;
+    return b.id - a.id;
+}
+
+// 把变化合并到已加载的记录中并重新显示
+function applyRecordChanges(changedRecords, deletedIds) {
+    const removed = new Set(deletedIds.concat(changedRecords.map(record => record.id)));
+    records = records.filter(record => !removed.has(record.id));
+    
+    // 还有未加载的页时，排在已加载范围之后的记录留给“加载更多”，避免重复
+    let boundary = null;
+    if (recordsNextCursor) {
+        const [date, id] = recordsNextCursor.split('_');
+        boundary = { date: date, id: Number(id) };
+    }
+    changedRecords.forEach(record => {
+        if (!boundary || compareRecords(record, boundary) < 0) {
+            records.push(record);
+        }
+    });
+    records.sort(compareRecords);
+    
+    displayRecords();
+    updateFilterOptions();
+    loadStatistics();
+}
+
 // 姓名选择变化时更新职位
 document.getElementById('newRecordName').addEventListener('change', function() {
     const selectedName = this.value;
@@ -1907,8 +2105,7 @@ function openProductManagement() {
 // 加载产品规格列表用于管理
 async function loadProductsForManagement() {
     try {
-        const response = await fetch('/api/products');
-        const products = await response.json();
+        const products = await fetchApiData('/api/products');
         allProducts = products;
         displayProductsForManagement(products);
     } catch (error) {
@@ -2020,8 +2217,7 @@ function clearProductSearch() {
 // 更新产品规格选项（用于添加记录）
 async function updateProductOptions() {
     try {
-        const response = await fetch('/api/products');
-        const products = await response.json();
+        const products = await fetchApiData('/api/products');
         allProducts = products;
         
         // 更新产品规格下拉框选项
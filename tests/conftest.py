@@ -0,0 +1,44 @@
+"""测试在临时 SQLite 数据库上运行；设置 TEST_DATABASE_URL（须为空库，结束后删除建立的表）时改用该数据库，
+如 TEST_DATABASE_URL=postgresql://postgres@localhost/test python -m pytest -q"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+DATABASE_DIR = tempfile.mkdtemp()
+# web_app 导入时读取 DATABASE_URL，须在导入之前设置
+os.environ['DATABASE_URL'] = (os.environ.get('TEST_DATABASE_URL')
+                              or 'sqlite:///' + os.path.join(DATABASE_DIR, 'test.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    web_app.app.testing = True
+    with web_app.app.app_context():
+        if web_app.sa.inspect(web_app.db.engine).get_table_names():
+            pytest.exit('测试数据库不是空的，拒绝执行')
+        web_app.init_database()
+    yield web_app.app
+    with web_app.app.app_context():
+        web_app.db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def record_ids(client):
+    """新建几条记录，返回它们的 ID"""
+    def create(count, **values):
+        records = [dict({'date': '2025-01-15', 'name': '员工1', 'product': '产品1', 'process': '工序1'}, **values)
+                   for _ in range(count)]
+        response = client.post('/api/records/batch', json={'records': records})
+        assert response.status_code == 200
+        return [item['id'] for item in response.get_json()['results']]
+    return create
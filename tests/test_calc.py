@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+import calc
+import web_app
+
+# (总重, 去皮重量, 单重, 桌面版 Decimal ROUND_HALF_UP 的结果)
+HALF_UP_CASES = [
+    (2.5, 0, 1, 3),
+    (3.5, 0, 1, 4),         # round() 取偶数时同为 4，与 2.5 一起区分两种舍入
+    (0.3, 0, 0.2, 2),       # 浮点相除为 1.4999999999999998
+    (10.5, 0, 3, 4),        # 3.5
+    (100.5, 0, 0.5, 201),
+    (1.1, 0.2, 0.6, 2),     # 浮点相减为 0.9000000000000001，相除 1.5
+    (0.7, 0, 0.2, 4),       # 浮点相除为 3.4999999999999996
+    (2.4999, 0, 1, 2),
+    (1, 5, 1, 0),           # 去皮重量大于总重时为 0，而不是负数
+    (1, 1.5, 1, 0),         # -0.5
+]
+
+
+@pytest.mark.parametrize('total_weight, tare_weight, unit_weight, expected', HALF_UP_CASES)
+def test_weight_quantity_rounds_half_up_and_clamps(total_weight, tare_weight, unit_weight, expected):
+    assert calc.weight_quantity(total_weight, tare_weight, unit_weight) == expected
+    values = {'total_weight': total_weight, 'tare_weight': tare_weight, 'unit_weight': unit_weight}
+    assert calc.derive_fields(values, 480)['actual_qty'] == expected
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_batch_half_up_cases_match_scalar(monkeypatch, use_numpy):
+    if use_numpy and calc.numpy is None:
+        pytest.skip('未安装 numpy')
+    if not use_numpy:
+        monkeypatch.setattr(calc, 'numpy', None)
+    columns = {field: [None] * len(HALF_UP_CASES) for field in calc.DERIVATION_INPUT_FIELDS}
+    columns['total_weight'], columns['tare_weight'], columns['unit_weight'], expected = map(list, zip(*HALF_UP_CASES))
+    assert calc.derive_fields_batch(columns, [480] * len(HALF_UP_CASES))['actual_qty'] == expected
+
+
+def random_columns(rng, count):
+    def number(low, high, places):
+        choice = rng.random()
+        if choice < 0.1:
+            return None
+        if choice < 0.15:
+            return 0
+        return round(rng.uniform(low, high), places)
+    rows = [{'adjustment_time': number(0, 120, 0), 'downtime_duration': number(0, 600, 0),
+             'single_time': number(1, 120, 0), 'total_weight': number(0, 5000, 3),
+             'tare_weight': number(0, 300, 3), 'unit_weight': number(0.001, 50, 3)} for _ in range(count)]
+    return {field: [row[field] for row in rows] for field in calc.DERIVATION_INPUT_FIELDS}, rows
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_derive_fields_batch_matches_derive_fields(monkeypatch, use_numpy):
+    if use_numpy and calc.numpy is None:
+        pytest.skip('未安装 numpy')
+    if not use_numpy:
+        monkeypatch.setattr(calc, 'numpy', None)
+    rng = random.Random(1)
+    columns, rows = random_columns(rng, 20000)
+    shift_minutes = [rng.choice((480, 540, 600, 30, 0)) for _ in rows]
+    batch = calc.derive_fields_batch(columns, shift_minutes)
+    for index, (row, minutes) in enumerate(zip(rows, shift_minutes)):
+        assert {field: batch[field][index] for field in calc.DERIVED_FIELDS} == calc.derive_fields(row, minutes)
+
+
+def test_desktop_and_web_calculations_match():
+    pytest.importorskip('tkinter')
+    mismatches, examples = web_app.calc_parity_mismatches(20000)
+    assert not mismatches, examples
+
+
+# (输入, 班次分钟数, 期望的派生字段)：理论数量或理论运行时长为 0 时稼动率为空（None），不是 0%
+ZERO_THEORETICAL_CASES = [
+    # 停机时长不小于理论运行时长：理论数量为 0
+    ({'downtime_duration': 480, 'single_time': 10, 'total_weight': 50, 'unit_weight': 1}, 480,
+     {'theoretical_runtime': 480, 'actual_runtime': 0, 'theoretical_qty': 0, 'actual_qty': 50,
+      'capacity_rate': None, 'time_rate': 0.0}),
+    # 调机时长不小于班次：理论运行时长为 0
+    ({'adjustment_time': 500, 'single_time': 10, 'total_weight': 50, 'unit_weight': 1}, 480,
+     {'theoretical_runtime': 0, 'actual_runtime': 0, 'theoretical_qty': 0, 'actual_qty': 50,
+      'capacity_rate': None, 'time_rate': None}),
+    # 班次分钟数为 0
+    ({'single_time': 10}, 0,
+     {'theoretical_runtime': 0, 'actual_runtime': 0, 'theoretical_qty': 0, 'actual_qty': None,
+      'capacity_rate': None, 'time_rate': None}),
+]
+
+
+@pytest.mark.parametrize('values, shift_minutes, expected', ZERO_THEORETICAL_CASES)
+def test_rates_are_blank_when_theoretical_is_zero(values, shift_minutes, expected):
+    assert calc.derive_fields(values, shift_minutes) == expected
+    # 手工填写的实际数量同样不按 0% 计
+    derived = calc.keep_actual_qty(calc.derive_fields(dict(values, unit_weight=None), shift_minutes), 30)
+    assert derived['actual_qty'] == 30 and derived['capacity_rate'] is None
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_batch_rates_are_blank_when_theoretical_is_zero(monkeypatch, use_numpy):
+    if use_numpy and calc.numpy is None:
+        pytest.skip('未安装 numpy')
+    if not use_numpy:
+        monkeypatch.setattr(calc, 'numpy', None)
+    columns = {field: [values.get(field) for values, _, _ in ZERO_THEORETICAL_CASES]
+               for field in calc.DERIVATION_INPUT_FIELDS}
+    batch = calc.derive_fields_batch(columns, [minutes for _, minutes, _ in ZERO_THEORETICAL_CASES])
+    for index, (_, _, expected) in enumerate(ZERO_THEORETICAL_CASES):
+        assert {field: batch[field][index] for field in calc.DERIVED_FIELDS} == expected
+
+
+@pytest.mark.parametrize('field, text', [
+    ('single_time', '12.5'), ('single_time', '13.5 📝'), ('adjustment_time', '20.4'),
+    ('downtime_duration', '7.6'), ('actual_qty', '99.5'), ('single_time', 'abc'), ('single_time', ''),
+    ('unit_weight', '0.35'),
+])
+def test_desktop_parses_cells_like_web(field, text):
+    pytest.importorskip('tkinter')
+    import app as desktop
+    assert desktop.parse_cell_value(field, text) == web_app.parse_record_value(field, text.replace(' 📝', ''))
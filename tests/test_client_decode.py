@@ -0,0 +1,18 @@
+import shutil
+
+import pytest
+
+import web_app
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='需要 node 运行前端解码函数')
+def test_msgpack_and_json_decode_to_same_records(app, record_ids):
+    record_ids(3, total_weight='1234.5', unit_weight='0.3', single_time='12', adjustment_master='师傅1')
+    record_ids(2, name='员工2', product='产品2', downtime_duration='15')
+    fields = list(web_app.RECORD_OUTPUT_FIELDS)
+    with app.app_context():
+        rows = web_app.record_columns_query(web_app.ProductionRecord.query.order_by(*web_app.RECORD_ORDER),
+                                            fields).all()
+        decoded = web_app.client_decode_times(fields, rows, repeat=1)
+    assert decoded['same']
+    assert decoded['msgpack_bytes'] < decoded['json_bytes']
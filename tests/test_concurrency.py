@@ -0,0 +1,9 @@
+import web_app
+
+
+def test_concurrent_sqlite_writers_hit_no_lock_errors():
+    # 与 benchmark-concurrency 相同：多个进程各用多个线程混合读写同一个临时 SQLite 库
+    totals = web_app.concurrency_totals(processes=3, threads=4, seconds=3, rows=500)
+    assert totals['reads'] and totals['writes']
+    assert totals['locked'] == 0
+    assert totals['errors'] == 0
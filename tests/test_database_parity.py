@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+import web_app
+
+PARITY_DATABASE_URL = os.environ.get('TEST_PARITY_DATABASE_URL')
+
+
+def differing_labels(database_url, rows):
+    return [label for label, expected, actual, *_ in web_app.database_parity_results(database_url, rows)
+            if actual != expected]
+
+
+def test_parity_sequence_is_repeatable(tmp_path):
+    # 两个 SQLite 库上的响应须完全相同，否则与其他数据库对比时的差异无从判断
+    assert not differing_labels('sqlite:///' + str(tmp_path / 'other.db'), rows=500)
+
+
+@pytest.mark.skipif(not PARITY_DATABASE_URL, reason='未设置 TEST_PARITY_DATABASE_URL（空的 PostgreSQL 库）')
+def test_other_database_matches_sqlite():
+    assert not differing_labels(PARITY_DATABASE_URL, rows=2000)
@@ -0,0 +1,17 @@
+import web_app
+
+
+def facet_values(client, field):
+    return {item['value'] for item in client.get(f'/api/records/facets?fields={field}').get_json()[field]}
+
+
+def test_facets_follow_writes_without_change_events(app, client, record_ids):
+    (record_id,) = record_ids(1, product='分面产品')
+    assert '分面产品' in facet_values(client, 'product')
+    # 直接执行的批量语句不发布变更事件，缓存按写入代数失效
+    with app.app_context():
+        web_app.db.session.execute(web_app.sa.update(web_app.ProductionRecord)
+                                   .where(web_app.ProductionRecord.id == record_id).values(product='改名产品'))
+        web_app.db.session.commit()
+    products = facet_values(client, 'product')
+    assert '改名产品' in products and '分面产品' not in products
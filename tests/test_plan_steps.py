@@ -0,0 +1,29 @@
+import web_app
+
+
+def plans_by_product(client):
+    return {plan['product']: plan for plan in client.get('/api/production-plans').get_json()}
+
+
+def test_legacy_plan_steps_are_visible_before_migration(app, client):
+    with app.app_context():
+        with web_app.db.engine.begin() as connection:
+            # 旧版 production_plan 表的工序列
+            for slot in (1, 2):
+                connection.exec_driver_sql(f'ALTER TABLE production_plan ADD COLUMN process{slot} VARCHAR(100)')
+                connection.exec_driver_sql(f'ALTER TABLE production_plan ADD COLUMN qty{slot} INTEGER')
+            connection.exec_driver_sql(
+                "INSERT INTO production_plan (product, process1, qty1, process2, qty2) "
+                "VALUES ('旧计划', '冲压', 500, '焊接', 300)")
+    try:
+        # 部署时执行的 init-db 即复制工序，不必等 migrate-plan-steps
+        assert app.test_cli_runner().invoke(args=['init-db']).exit_code == 0
+        steps = [(step['process'], step['qty']) for step in plans_by_product(client)['旧计划']['steps']]
+        assert steps == [('冲压', 500), ('焊接', 300)]
+        # 重复执行不会再复制一遍
+        assert app.test_cli_runner().invoke(args=['init-db']).exit_code == 0
+        assert len(plans_by_product(client)['旧计划']['steps']) == 2
+    finally:
+        result = app.test_cli_runner().invoke(args=['migrate-plan-steps'])
+    assert result.exit_code == 0, result.output
+    assert len(plans_by_product(client)['旧计划']['steps']) == 2
@@ -0,0 +1,18 @@
+import web_app
+
+
+def test_every_endpoint_query_uses_an_index(app):
+    with app.app_context():
+        results = list(web_app.query_plan_results())
+        web_app.db.session.rollback()
+    assert results
+    failures = {label: details for label, details, problems in results if problems}
+    assert not failures
+
+
+def test_plan_problems_flags_full_scans():
+    # 检查本身要能识别全表扫描，否则上面的用例永远通过
+    assert web_app._plan_problems(['SCAN production_record'])
+    assert web_app._plan_problems(['Seq Scan on production_record  (cost=0.00..1.00 rows=1 width=8)'])
+    assert not web_app._plan_problems(['SEARCH production_record USING INDEX ix_production_record_date (date>?)'])
+    assert not web_app._plan_problems(['SCAN production_record'], ('production_record',))
@@ -0,0 +1,21 @@
+def records_by_id(client):
+    return {record['id']: record for record in client.get('/api/records').get_json()}
+
+
+def test_batch_delete_rejects_non_integer_ids(client, record_ids):
+    # true == 1、1.0 == 1，只按“在已删除集合中”判断时会被当作删除成功
+    first, second = record_ids(2)
+    response = client.delete('/api/records/batch', json={'ids': [first, True, float(second), 99999999]})
+    results = response.get_json()['results']
+    assert [item['success'] for item in results] == [True, False, False, False]
+    assert second in records_by_id(client)
+
+
+def test_batch_update_rejects_non_integer_ids(client, record_ids):
+    (record_id,) = record_ids(1)
+    response = client.put('/api/records/batch', json={'records': [
+        {'id': record_id, 'downtime_duration': '5'}, {'id': True, 'downtime_duration': '6'},
+        {'id': float(record_id), 'downtime_duration': '7'}]})
+    results = response.get_json()['results']
+    assert [item['success'] for item in results] == [True, False, False]
+    assert records_by_id(client)[record_id]['downtime_duration'] == '5'
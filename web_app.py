@@ -1,10 +1,63 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import (Flask, Response, make_response, render_template, request, jsonify, redirect, url_for, flash,
+                   stream_with_context)
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+import sqlalchemy as sa
+import click
+from collections import Counter, OrderedDict
+from datetime import datetime, date, timedelta
+import codecs
+import csv
+import functools
+import gzip
+import hashlib
+import io
+import itertools
 import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from urllib.parse import quote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
 from config import Config, DevelopmentConfig, ProductionConfig
+from calc import (DERIVATION_INPUT_FIELDS, DERIVED_FIELDS, ShiftCalendar, derive_fields, derive_fields_batch,
+                  keep_actual_qty)
 import json
 from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import NO_VALUE
+
+# 可选依赖：安装后自动启用更快的 JSON 编码和更高压缩率的算法
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# 可选依赖：启用 RECORDS_COLUMNAR_CACHE 时用于列式分析缓存
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 app = Flask(__name__)
 
@@ -14,32 +67,122 @@ if os.environ.get('FLASK_ENV') == 'production':
 else:
     app.config.from_object(DevelopmentConfig)
 
+class FastJSONProvider(DefaultJSONProvider):
+    """安装了 orjson 时用它编码响应，否则使用标准库 json；中文直接输出 UTF-8 而不转义"""
+    ensure_ascii = False
+    compact = True
+
+    @staticmethod
+    def _orjson_default(value):
+        if isinstance(value, Decimal):
+            return float(value)
+        return DefaultJSONProvider.default(value)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self._orjson_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def dumps_bytes(self, obj):
+        """编码为 UTF-8 字节"""
+        if orjson is None:
+            return super().dumps(obj).encode()
+        return orjson.dumps(obj, default=self._orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self._orjson_default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
 db = SQLAlchemy(app)
 
+@sa.event.listens_for(sa.engine.Engine, 'connect')
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """为每个新建的 SQLite 连接设置 PRAGMA"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
 # 数据库模型
 class ProductionRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(10), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     position = db.Column(db.String(100), nullable=False)
     product = db.Column(db.Text, nullable=False)
     process = db.Column(db.String(200), nullable=False)
-    theoretical_runtime = db.Column(db.String(20), default='')
-    actual_runtime = db.Column(db.String(20), default='')
-    single_time = db.Column(db.String(20), default='')
-    theoretical_qty = db.Column(db.String(20), default='')
-    actual_qty = db.Column(db.String(20), default='')
-    total_weight = db.Column(db.String(20), default='')
-    unit_weight = db.Column(db.String(20), default='')
-    tare_weight = db.Column(db.String(20), default='')
-    capacity_rate = db.Column(db.String(20), default='')
-    time_rate = db.Column(db.String(20), default='')
-    downtime_duration = db.Column(db.String(20), default='')
-    adjustment_time = db.Column(db.String(20), default='')
+    theoretical_runtime = db.Column(db.Integer)  # 分钟
+    actual_runtime = db.Column(db.Integer)  # 分钟
+    single_time = db.Column(db.Integer)  # 秒
+    theoretical_qty = db.Column(db.Integer)
+    actual_qty = db.Column(db.Integer)
+    total_weight = db.Column(db.Numeric(12, 3, asdecimal=False))
+    unit_weight = db.Column(db.Numeric(12, 3, asdecimal=False))
+    tare_weight = db.Column(db.Numeric(12, 3, asdecimal=False))
+    capacity_rate = db.Column(db.Numeric(7, 2, asdecimal=False))  # 百分比数值，如 97.83 表示 97.83%
+    time_rate = db.Column(db.Numeric(7, 2, asdecimal=False))
+    downtime_duration = db.Column(db.Integer)  # 分钟
+    adjustment_time = db.Column(db.Integer)  # 分钟
     adjustment_master = db.Column(db.String(100), default='')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # 每个等值筛选列都以 date 结尾，同时满足日期范围和按日期排序
+    __table_args__ = (
+        db.Index('ix_production_record_date', 'date'),
+        db.Index('ix_production_record_name_date', 'name', 'date'),
+        # 后两列供汇总表按分组重算时直接定位该组的记录
+        db.Index('ix_production_record_product_date_group', 'product', 'date', 'process', 'name'),
+        db.Index('ix_production_record_process_date', 'process', 'date'),
+        db.Index('ix_production_record_master_date', 'adjustment_master', 'date'),
+        db.Index('ix_production_record_updated_at', 'updated_at'),
+    )
+
+class RecordDailyRollup(db.Model):
+    """按 产品规格×日期×工序×姓名×调机师傅 汇总的生产记录，统计接口读这张表。
+
+    随记录的写入在同一事务中增量更新（见 apply_rollup_deltas）。比率合计以百分之一为单位
+    存为整数（97.83% 记为 9783），加减不产生舍入误差；平均值由 *_rate_sum / *_rate_count 计算，空值不计入。
+    """
+    __tablename__ = 'record_daily_rollup'
+    product = db.Column(db.Text, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    process = db.Column(db.String(200), primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+    adjustment_master = db.Column(db.String(100), primary_key=True)
+    record_count = db.Column(db.Integer, nullable=False)
+    actual_qty_sum = db.Column(db.Integer)
+    actual_qty_min = db.Column(db.Integer)
+    actual_qty_max = db.Column(db.Integer)
+    theoretical_qty_sum = db.Column(db.Integer)
+    theoretical_runtime_sum = db.Column(db.Integer)
+    actual_runtime_sum = db.Column(db.Integer)
+    downtime_duration_sum = db.Column(db.Integer)
+    adjustment_time_sum = db.Column(db.Integer)
+    capacity_rate_sum = db.Column(db.BigInteger)
+    capacity_rate_count = db.Column(db.Integer)
+    capacity_rate_min = db.Column(db.Numeric(7, 2, asdecimal=False))
+    capacity_rate_max = db.Column(db.Numeric(7, 2, asdecimal=False))
+    time_rate_sum = db.Column(db.BigInteger)
+    time_rate_count = db.Column(db.Integer)
+    time_rate_min = db.Column(db.Numeric(7, 2, asdecimal=False))
+    time_rate_max = db.Column(db.Numeric(7, 2, asdecimal=False))
+
+    # 主键以 (product, date) 开头，按产品规格筛选和按分组重算都走主键
+    __table_args__ = (
+        db.Index('ix_record_daily_rollup_date', 'date'),
+        db.Index('ix_record_daily_rollup_name_date', 'name', 'date'),
+        db.Index('ix_record_daily_rollup_process_date', 'process', 'date'),
+        db.Index('ix_record_daily_rollup_master_date', 'adjustment_master', 'date'),
+    )
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     record_id = db.Column(db.Integer, db.ForeignKey('production_record.id'), nullable=False)
@@ -48,6 +191,37 @@ class Comment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_comment_record_column', 'record_id', 'column_key'),
+    )
+
+class RecordTombstone(db.Model):
+    """已删除记录的墓碑，供增量同步接口报告删除，保留 RECORD_TOMBSTONE_DAYS 天"""
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_record_tombstone_deleted_at', 'deleted_at'),
+    )
+
+class ChangeEvent(db.Model):
+    """变更事件，与触发它的写操作在同一事务中提交；各进程轮询此表向 SSE 连接推送"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'record'、'comment' 或 'plan'
+    action = db.Column(db.String(20), nullable=False)  # 'upsert' 或 'delete'
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_change_event_created_at', 'created_at'),
+    )
+
+class TableGeneration(db.Model):
+    """各表的写入代数：每次提交写入某表时加一，用于 ETag 和缓存失效"""
+    name = db.Column(db.String(200), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
 class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -56,17 +230,25 @@ class Employee(db.Model):
 
 class ProductionPlan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    product = db.Column(db.String(200), nullable=False)
-    process1 = db.Column(db.String(100))
-    qty1 = db.Column(db.Integer, default=0)
-    process2 = db.Column(db.String(100))
-    qty2 = db.Column(db.Integer, default=0)
-    process3 = db.Column(db.String(100))
-    qty3 = db.Column(db.Integer, default=0)
-    process4 = db.Column(db.String(100))
-    qty4 = db.Column(db.Integer, default=0)
+    product = db.Column(db.String(200), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    steps = db.relationship('ProductionPlanStep', backref='plan', order_by='ProductionPlanStep.position',
+                            cascade='all, delete-orphan')
+
+class ProductionPlanStep(db.Model):
+    """产量计划中的一道工序及其计划产量，按 position 排序，数量不限"""
+    id = db.Column(db.Integer, primary_key=True)
+    plan_id = db.Column(db.Integer, db.ForeignKey('production_plan.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    process = db.Column(db.String(100), nullable=False)
+    qty = db.Column(db.Integer, default=0)
+
+    # (process, plan_id) 用于“哪些计划使用了此工序”，只读索引即可计数
+    __table_args__ = (
+        db.Index('ix_production_plan_step_plan_position', 'plan_id', 'position'),
+        db.Index('ix_production_plan_step_process_plan', 'process', 'plan_id'),
+    )
 
 class Process(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -80,127 +262,951 @@ class Product(db.Model):
     description = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class ShiftLength(db.Model):
+    """班次分钟数设置：从 start_date（为空表示不限）起对 process（为空表示所有工序）生效，
+    查找规则见 ShiftCalendar；都没有设置时使用配置 SHIFT_MINUTES"""
+    id = db.Column(db.Integer, primary_key=True)
+    process = db.Column(db.String(200), nullable=False, default='')
+    start_date = db.Column(db.Date)
+    minutes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RecordImport(db.Model):
+    """记录导入的进度，与每批导入的记录在同一事务中提交；文件按内容的 SHA-256 识别"""
+    id = db.Column(db.Integer, primary_key=True)
+    file_hash = db.Column(db.String(64), nullable=False, unique=True)
+    filename = db.Column(db.String(255), nullable=False, default='')
+    rows_done = db.Column(db.Integer, nullable=False, default=0)  # 已处理的数据行数（含失败的行）
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 写入代数：会话事件记录本事务写过的表，提交前在同一事务中把这些表的代数加一。
+# 生产记录另按日期、产品规格、工序分区计数（名称如 production_record:product:产品A），
+# 修改记录时新旧两侧的分区都会加一，供记录查询缓存精确失效；
+# 同时按旧值减、新值加累计汇总表的增量，提交前一并写入
+RECORD_PARTITION_FIELDS = ('product', 'process', 'date')
+# 未声明 removed_records/added_records 的批量语句写入生产记录时使用，
+# 所有分区缓存都依赖它，汇总表整体重建
+RECORD_BULK_PARTITION = 'production_record:*'
+
+def record_partition_name(field, value):
+    if isinstance(value, date):
+        value = value.isoformat()
+    return f'production_record:{field}:{value}'
+
+def record_partitions(rows):
+    """一组记录值（字典）涉及的分区名称"""
+    return {record_partition_name(field, row[field])
+            for row in rows for field in RECORD_PARTITION_FIELDS if row.get(field) is not None}
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _track_flushed_tables(session, flush_context):
+    tables = session.info.setdefault('written_tables', set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        tables.add(obj.__table__.name)
+        if isinstance(obj, ProductionRecord):
+            # flush 后的事件中属性历史仍是 flush 前的状态，包含旧值和新值
+            state = sa.inspect(obj)
+            for field in RECORD_PARTITION_FIELDS:
+                for value in state.attrs[field].history.sum():
+                    if value is not None:
+                        tables.add(record_partition_name(field, value))
+            _track_rollup_object(session, obj, state)
+
+def _track_rollup_object(session, obj, state):
+    if obj in session.new:
+        # 新对象未赋值的属性为空
+        add_rollup_deltas(session, [{field: state.dict.get(field) for field in ROLLUP_RECORD_FIELDS}], 1)
+        return
+    old_values, new_values = {}, {}
+    for field in ROLLUP_RECORD_FIELDS:
+        # committed_state 保存本次修改前的值，未修改的属性取当前值；
+        # 属性未加载时不知道旧值，只能整体重建
+        new_values[field] = state.dict.get(field, NO_VALUE)
+        old_values[field] = state.committed_state.get(field, new_values[field])
+        if old_values[field] is NO_VALUE or new_values[field] is NO_VALUE:
+            session.info['rollup_rebuild'] = True
+            return
+    add_rollup_deltas(session, [old_values], -1)
+    if obj not in session.deleted:
+        add_rollup_deltas(session, [new_values], 1)
+
+@sa.event.listens_for(db.session, 'do_orm_execute')
+def _track_bulk_writes(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        tables = state.session.info.setdefault('written_tables', set())
+        table = state.statement.table.name
+        tables.add(table)
+        if table == ProductionRecord.__tablename__:
+            # 批量语句通过 execution_options(removed_records=..., added_records=...) 声明写入前后的完整记录值
+            removed = state.execution_options.get('removed_records')
+            added = state.execution_options.get('added_records')
+            if removed is None and added is None:
+                tables.add(RECORD_BULK_PARTITION)
+                state.session.info['rollup_rebuild'] = True
+                return
+            for rows, sign in ((removed or [], -1), (added or [], 1)):
+                tables.update(record_partitions(rows))
+                add_rollup_deltas(state.session, rows, sign)
+
+@sa.event.listens_for(db.session, 'before_commit')
+def _bump_written_tables(session):
+    session.flush()
+    deltas = session.info.pop('rollup_deltas', {})
+    if session.info.pop('rollup_rebuild', False):
+        refresh_record_rollup(session.connection())
+    elif deltas:
+        apply_rollup_deltas(session.connection(), deltas)
+    tables = session.info.pop('written_tables', set())
+    tables.discard(TableGeneration.__tablename__)
+    if tables:
+        bump_generations(session.connection(), tables)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _forget_written_tables(session, previous_transaction):
+    for key in ('written_tables', 'rollup_deltas', 'rollup_rebuild'):
+        session.info.pop(key, None)
+
+# 汇总表：分组列、累加的列和取最值的列
+ROLLUP_GROUP_FIELDS = ('product', 'date', 'process', 'name', 'adjustment_master')
+ROLLUP_SUM_FIELDS = ('actual_qty', 'theoretical_qty', 'theoretical_runtime', 'actual_runtime',
+                     'downtime_duration', 'adjustment_time')
+ROLLUP_RATE_FIELDS = ('capacity_rate', 'time_rate')
+ROLLUP_EXTREME_FIELDS = ('actual_qty',) + ROLLUP_RATE_FIELDS
+ROLLUP_VALUE_FIELDS = ROLLUP_SUM_FIELDS + ROLLUP_RATE_FIELDS
+# 计算汇总增量需要的记录字段
+ROLLUP_RECORD_FIELDS = ROLLUP_GROUP_FIELDS + ROLLUP_VALUE_FIELDS
+ROLLUP_ADDITIVE_COLUMNS = (('record_count',) + tuple(f'{field}_sum' for field in ROLLUP_SUM_FIELDS)
+                           + tuple(f'{field}_{kind}' for field in ROLLUP_RATE_FIELDS for kind in ('sum', 'count')))
+ROLLUP_MIN_COLUMNS = tuple(f'{field}_min' for field in ROLLUP_EXTREME_FIELDS)
+ROLLUP_MAX_COLUMNS = tuple(f'{field}_max' for field in ROLLUP_EXTREME_FIELDS)
+# 记录字段与对应的汇总列，逐条累计增量时不必每次拼接列名
+_ROLLUP_SUM_COLUMNS = tuple((field, f'{field}_sum') for field in ROLLUP_SUM_FIELDS)
+_ROLLUP_RATE_COLUMNS = tuple((field, f'{field}_sum', f'{field}_count') for field in ROLLUP_RATE_FIELDS)
+_ROLLUP_EXTREME_COLUMNS = tuple(zip(ROLLUP_EXTREME_FIELDS, ROLLUP_MIN_COLUMNS, ROLLUP_MAX_COLUMNS))
+# 旧表中为文本、累计前须转换类型的字段
+_ROLLUP_TYPED_FIELDS = ('date',) + ROLLUP_VALUE_FIELDS
+
+def rollup_group_key(values):
+    return (values['product'], values['date'], values['process'], values['name'],
+            values.get('adjustment_master') or '')
+
+def add_rollup_deltas(session, rows, sign):
+    """把一组记录值按 sign（1 为新增，-1 为移除）累计到本事务的汇总增量中"""
+    deltas = session.info.setdefault('rollup_deltas', {})
+    for row in rows:
+        if any(isinstance(row.get(field), str) for field in _ROLLUP_TYPED_FIELDS):
+            # 迁移完成前旧表中仍是文本（如 '36.63%'、空串），先转换为数值再累计和比较
+            row = {**row, **{field: parse_record_value(field, row.get(field)) for field in _ROLLUP_TYPED_FIELDS}}
+        key = rollup_group_key(row)
+        delta = deltas.get(key)
+        if delta is None:
+            delta = deltas[key] = dict.fromkeys(ROLLUP_ADDITIVE_COLUMNS, 0)
+            delta.update(dict.fromkeys(ROLLUP_MIN_COLUMNS + ROLLUP_MAX_COLUMNS))
+            delta['removed'] = None
+        delta['record_count'] += sign
+        for field, column in _ROLLUP_SUM_COLUMNS:
+            delta[column] += sign * (row.get(field) or 0)
+        for field, sum_column, count_column in _ROLLUP_RATE_COLUMNS:
+            value = row.get(field)
+            if value is not None:
+                delta[sum_column] += sign * round(value * 100)
+                delta[count_column] += sign
+        # 新增记录的最值合并到 *_min/*_max；移除记录的最值另记在 removed 中，用于判断是否需要重算该分组
+        if sign > 0:
+            extremes = delta
+        else:
+            if delta['removed'] is None:
+                delta['removed'] = dict.fromkeys(ROLLUP_MIN_COLUMNS + ROLLUP_MAX_COLUMNS)
+            extremes = delta['removed']
+        for field, min_column, max_column in _ROLLUP_EXTREME_COLUMNS:
+            value = row.get(field)
+            if value is not None:
+                low, high = extremes[min_column], extremes[max_column]
+                extremes[min_column] = value if low is None or value < low else low
+                extremes[max_column] = value if high is None or value > high else high
+
+@functools.cache
+def rollup_upsert_statement(dialect_name):
+    """汇总增量的 INSERT ... ON CONFLICT DO UPDATE 语句，不支持的数据库返回 None"""
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(dialect_name)
+    if dialect is None:
+        return None
+    table = RecordDailyRollup.__table__
+    statement = dialect.insert(table)
+    excluded = statement.excluded
+    updates = {name: table.c[name] + excluded[name] for name in ROLLUP_ADDITIVE_COLUMNS}
+    for name in ROLLUP_MIN_COLUMNS:
+        updates[name] = sa.case((sa.or_(table.c[name].is_(None), excluded[name] < table.c[name]), excluded[name]),
+                                else_=table.c[name])
+    for name in ROLLUP_MAX_COLUMNS:
+        updates[name] = sa.case((sa.or_(table.c[name].is_(None), excluded[name] > table.c[name]), excluded[name]),
+                                else_=table.c[name])
+    return statement.on_conflict_do_update(index_elements=table.primary_key.columns, set_=updates)
+
+def apply_rollup_deltas(connection, deltas):
+    """在调用方的事务中把汇总增量写入 record_daily_rollup。
+
+    计数和合计直接加减；新增记录的最值与原值比较合并。最值无法在移除记录后倒推，
+    移出的记录可能是分组最值（其值不在合并后的最小值和最大值之间）或分组已空时，
+    该分组从生产记录重新汇总（只读该分组的几条记录）。
+    """
+    statement = rollup_upsert_statement(connection.dialect.name)
+    if statement is None:
+        refresh_record_rollup(connection)
+        return
+    # 按分组排序写入，多个事务同时更新时加锁顺序一致
+    rows = [dict(zip(ROLLUP_GROUP_FIELDS, key), **{name: value for name, value in delta.items() if name != 'removed'})
+            for key, delta in sorted(deltas.items())]
+    connection.execute(statement, rows)
+
+    removed = [(key, delta['removed']) for key, delta in sorted(deltas.items()) if delta['removed'] is not None]
+    if removed:
+        delete, insert = rollup_group_statements(connection.dialect.name)
+        params = [dict(group, **{f'removed_{name}': value for name, value in extremes.items()})
+                  for group, (_, extremes) in zip(rollup_group_params([key for key, _ in removed]), removed)]
+        connection.execute(delete, params)
+        connection.execute(insert, params)
+
+def record_group_columns():
+    """生产记录上与汇总表分组列对应的表达式"""
+    record = ProductionRecord
+    return (record.product, record.date, record.process, record.name, sa.func.coalesce(record.adjustment_master, ''))
+
+def record_value_column(field, dialect_name):
+    """生产记录上参与汇总的数值列。SQLite 上迁移完成前旧表中仍是文本（如 '36.63%'），
+    空串按空值、其余按数值前缀转换；对已迁移的数值列结果不变"""
+    column = getattr(ProductionRecord, field)
+    if dialect_name != 'sqlite':
+        return column
+    return sa.cast(sa.func.nullif(column, ''), column.type)
+
+@functools.cache
+def record_rollup_select(dialect_name):
+    """从生产记录计算汇总行的查询，列顺序与 record_daily_rollup 表相同；调用方用 .where() 限定范围"""
+    func = sa.func
+    group_columns = record_group_columns()
+    columns = dict(zip(ROLLUP_GROUP_FIELDS, group_columns))
+    columns['record_count'] = func.count()
+    for field in ROLLUP_SUM_FIELDS:
+        columns[f'{field}_sum'] = func.coalesce(func.sum(record_value_column(field, dialect_name)), 0)
+    for field in ROLLUP_RATE_FIELDS:
+        rate = record_value_column(field, dialect_name)
+        columns[f'{field}_sum'] = func.coalesce(func.sum(sa.cast(func.round(rate * 100), sa.Integer)), 0)
+        columns[f'{field}_count'] = func.count(rate)
+    for field in ROLLUP_EXTREME_FIELDS:
+        columns[f'{field}_min'] = func.min(record_value_column(field, dialect_name))
+        columns[f'{field}_max'] = func.max(record_value_column(field, dialect_name))
+    return sa.select(*(columns[column.name] for column in RecordDailyRollup.__table__.columns)).group_by(
+        *group_columns)
+
+def rollup_group_match(columns):
+    """五个分组列逐一等于 group_* 绑定参数的条件，以 executemany 每组执行一次"""
+    return sa.and_(*(column == sa.bindparam(f'group_{field}') for column, field in zip(columns, ROLLUP_GROUP_FIELDS)))
+
+def rollup_group_params(keys):
+    return [{f'group_{field}': value for field, value in zip(ROLLUP_GROUP_FIELDS, key)} for key in keys]
+
+@functools.cache
+def rollup_group_statements(dialect_name):
+    """有记录移出的分组按需重算的两条语句：删除可能失效的汇总行（removed_* 为移出记录的最值），
+    再为汇总行已删除的分组从生产记录重新汇总"""
+    table = RecordDailyRollup.__table__
+    stale = [table.c.record_count <= 0]
+    for field in ROLLUP_EXTREME_FIELDS:
+        # 比较的一侧为空时结果为空，不触发重算
+        stale.append(table.c[f'{field}_min'] >= sa.bindparam(f'removed_{field}_min'))
+        stale.append(table.c[f'{field}_max'] <= sa.bindparam(f'removed_{field}_max'))
+    delete = table.delete().where(rollup_group_match(table.primary_key.columns), sa.or_(*stale))
+    missing = ~sa.exists().where(rollup_group_match(table.primary_key.columns))
+    insert = table.insert().from_select([column.name for column in table.columns], record_rollup_select(dialect_name).where(
+        rollup_group_match(record_group_columns()), missing))
+    return delete, insert
+
+def refresh_record_rollup(connection):
+    """在调用方的事务中按生产记录重建整张汇总表"""
+    table = RecordDailyRollup.__table__
+    connection.execute(table.delete())
+    connection.execute(table.insert().from_select([column.name for column in table.columns],
+                                                  record_rollup_select(connection.dialect.name)))
+
+def bump_generations(connection, names):
+    """把指定名称的代数加一（不存在时插入），在调用方的事务中执行"""
+    table = TableGeneration.__table__
+    # 按名称排序写入，多个事务同时更新时加锁顺序一致
+    rows = [{'name': name, 'generation': 1} for name in sorted(names)]
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is None:
+        updated = connection.execute(table.update().where(table.c.name.in_(names))
+                                     .values(generation=table.c.generation + 1))
+        if updated.rowcount < len(rows):
+            existing = set(connection.execute(sa.select(table.c.name).where(table.c.name.in_(names))).scalars())
+            connection.execute(table.insert(), [row for row in rows if row['name'] not in existing])
+        return
+    statement = dialect.insert(table).values(rows)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name], set_={'generation': table.c.generation + 1}
+    ))
+
+def table_generations(names):
+    """读取各名称当前的代数，未写入过的为 0"""
+    rows = db.session.execute(
+        sa.select(TableGeneration.name, TableGeneration.generation).where(TableGeneration.name.in_(names))
+    )
+    generations = dict(rows.all())
+    return tuple(generations.get(name, 0) for name in names)
+
+def conditional_by_generation(*tables):
+    """GET 接口的条件请求：ETag 由依赖表的写入代数、请求参数和返回格式计算，
+    If-None-Match 匹配时直接返回 304，不执行查询。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = repr((request.path, sorted(request.args.items(multi=True)), wants_msgpack(),
+                        table_generations(tables)))
+            etag = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # 压缩后的响应与原始响应共用 ETag，因此使用弱 ETag
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
+
+# SQLite 同一时刻只允许一个写事务；进程内的写请求先在这里排队，不在 SQLite 的锁上互相等待
+sqlite_write_lock = threading.Lock()
+
+def is_database_locked(exc):
+    return isinstance(exc.orig, sqlite3.OperationalError) and 'locked' in str(exc.orig)
+
+def serialized_write(view):
+    """SQLite 下写接口在进程内串行执行；其他进程长时间占用写锁导致 busy_timeout 超时时，
+    回滚后退避重试整个请求（各写接口都只在最后提交一次，重试不会重复写入）。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if db.engine.dialect.name != 'sqlite':
+            return view(*args, **kwargs)
+        for attempt in itertools.count():
+            with sqlite_write_lock:
+                try:
+                    return view(*args, **kwargs)
+                except sa.exc.OperationalError as exc:
+                    db.session.rollback()
+                    if attempt >= app.config['SQLITE_WRITE_RETRIES'] or not is_database_locked(exc):
+                        raise
+            app.logger.warning('数据库写锁等待超时，第 %d 次重试', attempt + 1)
+            time.sleep(0.05 * 2 ** attempt)
+    return wrapper
+
+class MasterDataSnapshot:
+    """员工、工序、产品规格等小表的进程内只读快照。
+
+    快照 (代数, 行, JSON) 整体替换，读取方拿到的引用不会被修改；每次读取先比较
+    表的写入代数，任一 worker 提交写入后，各 worker 在下一次请求时重新加载。
+    """
+
+    def __init__(self, table, load):
+        self.table = table
+        self.load = load
+        self.snapshot = (None, (), b'[]')
+        self.lock = threading.Lock()
+
+    def current(self):
+        (generation,) = table_generations([self.table])
+        snapshot = self.snapshot
+        if snapshot[0] != generation:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot[0] != generation:
+                    # 代数先于数据读取，加载期间的写入只会让下次请求再加载一次
+                    rows = tuple(self.load())
+                    snapshot = (generation, rows, app.json.dumps_bytes(rows))
+                    self.snapshot = snapshot
+        return snapshot
+
+    def rows(self):
+        return self.current()[1]
+
+    def response(self):
+        return raw_api_response(self.current()[2], False)
+
+def _load_employees():
+    return ({'id': emp.id, 'name': emp.name, 'position': emp.position} for emp in Employee.query.all())
+
+def _load_named_items(model, sort_by_name=False):
+    def load():
+        items = [{
+            'id': item.id,
+            'name': item.name,
+            'description': item.description,
+            'created_at': item.created_at.isoformat() if item.created_at else None
+        } for item in model.query.order_by(model.id).all()]
+        if sort_by_name:
+            # 在 Python 中排序，顺序与数据库的排序规则无关
+            items.sort(key=lambda item: item['name'])
+        return items
+    return load
+
+def _load_shift_lengths():
+    items = [{'id': item.id, 'process': item.process,
+              'start_date': item.start_date.isoformat() if item.start_date else None,
+              'minutes': item.minutes} for item in ShiftLength.query.all()]
+    # 在 Python 中排序，不限日期的设置排在最前，与数据库对空值的排序规则无关
+    items.sort(key=lambda item: (item['process'], item['start_date'] or ''))
+    return items
+
+master_data = {
+    'employee': MasterDataSnapshot('employee', _load_employees),
+    'process': MasterDataSnapshot('process', _load_named_items(Process, sort_by_name=True)),
+    'product': MasterDataSnapshot('product', _load_named_items(Product)),
+    'shift_length': MasterDataSnapshot('shift_length', _load_shift_lengths),
+}
+
+def preload_master_data():
+    """worker 启动时加载主数据快照，第一个请求无需等待查询"""
+    with app.app_context():
+        try:
+            for snapshot in master_data.values():
+                snapshot.current()
+        except sa.exc.SQLAlchemyError as exc:
+            # 数据库尚未初始化时跳过，首次请求时再加载
+            app.logger.warning('预加载主数据失败: %s', exc)
+        finally:
+            db.session.remove()
+
+# 记录字段类型
+RECORD_FIELDS = ['date', 'name', 'position', 'product', 'process',
+                 'theoretical_runtime', 'actual_runtime', 'single_time',
+                 'theoretical_qty', 'actual_qty', 'total_weight',
+                 'unit_weight', 'tare_weight', 'capacity_rate',
+                 'time_rate', 'downtime_duration', 'adjustment_time',
+                 'adjustment_master']
+INTEGER_FIELDS = ('theoretical_runtime', 'actual_runtime', 'single_time',
+                  'theoretical_qty', 'actual_qty', 'downtime_duration', 'adjustment_time')
+DECIMAL_FIELDS = ('total_weight', 'unit_weight', 'tare_weight')
+RATE_FIELDS = ('capacity_rate', 'time_rate')
+
+def parse_date(value):
+    """解析 YYYY-MM-DD 日期，无效时返回None"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip().replace('/', '-'), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def parse_number(value):
+    """解析数值（兼容 '97.83%' 这类旧格式），空值或无效值返回None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().rstrip('%').strip()
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_record_value(field, value):
+    """把前端或CSV传入的原始值转换为对应列的类型"""
+    if field == 'date':
+        return parse_date(value)
+    if field in INTEGER_FIELDS:
+        number = parse_number(value)
+        return None if number is None else int(round(number))
+    if field in DECIMAL_FIELDS or field in RATE_FIELDS:
+        number = parse_number(value)
+        return None if number is None else float(number)
+    return '' if value is None else str(value)
+
+def format_number(value):
+    """整数值不带小数点输出"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def format_record_value(field, value):
+    """把列值格式化为前端使用的字符串，比率在此处才加上百分号"""
+    if value is None:
+        return ''
+    if field == 'date':
+        return value if isinstance(value, str) else value.isoformat()
+    if field in INTEGER_FIELDS or field in DECIMAL_FIELDS or field in RATE_FIELDS:
+        if isinstance(value, str):
+            # 迁移完成前旧表中仍是文本
+            number = parse_number(value)
+            if number is None:
+                return value
+            value = number
+        text = format_number(value)
+        return f"{text}%" if field in RATE_FIELDS else text
+    return value
+
+def record_to_dict(record):
+    """序列化生产记录"""
+    result = {'id': record.id}
+    for field in RECORD_FIELDS:
+        result[field] = format_record_value(field, getattr(record, field))
+    result['created_at'] = record.created_at.isoformat() if record.created_at else None
+    result['updated_at'] = record.updated_at.isoformat() if record.updated_at else None
+    return result
+
+def shift_calendar():
+    """当前的班次设置，读取进程内快照"""
+    return ShiftCalendar(master_data['shift_length'].rows(), app.config['SHIFT_MINUTES'])
+
+def record_shift_minutes(values):
+    """记录所在日期和工序的班次分钟数"""
+    return shift_calendar().minutes(values['date'], values['process'])
+
+def apply_derived_fields(record):
+    """把派生字段写到记录对象上（仅修改会话中的对象，不提交）"""
+    values = {field: parse_record_value(field, getattr(record, field)) for field in RECORD_FIELDS}
+    for field, value in derive_fields(values, record_shift_minutes(values)).items():
+        setattr(record, field, value)
+
+# /api/records 可输出的字段，fields 参数从中选取
+RECORD_OUTPUT_FIELDS = ('id', *RECORD_FIELDS, 'created_at', 'updated_at')
+
+def parse_record_fields(text):
+    """解析 fields 参数（逗号分隔），id 总是输出；含未知字段时返回None"""
+    if not text:
+        return list(RECORD_OUTPUT_FIELDS)
+    fields = ['id']
+    for field in text.split(','):
+        field = field.strip()
+        if field not in RECORD_OUTPUT_FIELDS:
+            return None
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def format_timestamp(value):
+    return value.isoformat() if value else None
+
+def record_field_formatter(field):
+    """单个输出字段的格式化函数"""
+    if field == 'id':
+        return int
+    if field in ('created_at', 'updated_at'):
+        return format_timestamp
+    return functools.partial(format_record_value, field)
+
+def record_columns_query(query, fields):
+    """只查询需要的列，返回元组而不构造 ORM 对象；末尾附带分页游标需要的 date、id"""
+    names = fields + [field for field in ('date', 'id') if field not in fields]
+    return query.with_entities(*(getattr(ProductionRecord, name) for name in names))
+
+def serialize_record_rows(fields, rows, compact=False):
+    """把按 fields 顺序查询出的行序列化。
+
+    compact 为 True 时返回 {'columns': [...], 'rows': [[...], ...]}，
+    不在每行重复字段名；否则返回字典列表。
+    """
+    formatters = [record_field_formatter(field) for field in fields]
+    values = [[formatter(value) for formatter, value in zip(formatters, row)] for row in rows]
+    if compact:
+        return {'columns': fields, 'rows': values}
+    return [dict(zip(fields, row)) for row in values]
+
+# MessagePack 格式：数值列为真实数值，重复的文本列在每个响应中只出现一次
+MSGPACK_MIMETYPE = 'application/msgpack'
+DICTIONARY_FIELDS = ('date', 'name', 'position', 'product', 'process', 'adjustment_master')
+
+def wants_msgpack():
+    """请求的 Accept 头更偏好 MessagePack 且服务器安装了 msgpack"""
+    return msgpack is not None and request.accept_mimetypes.best_match(
+        ['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'无法编码 {type(value).__name__}')
+
+def api_response(obj):
+    """按 Accept 头返回 MessagePack 或 JSON"""
+    if wants_msgpack():
+        response = app.response_class(msgpack.packb(obj, default=_msgpack_default), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(obj)
+    response.vary.add('Accept')
+    return response
+
+def encode_api_body(obj, binary):
+    """把对象编码为 MessagePack 或 JSON 字节"""
+    if binary:
+        return msgpack.packb(obj, default=_msgpack_default)
+    return app.json.dumps_bytes(obj)
+
+def raw_api_response(body, binary):
+    """用已编码的字节构造响应"""
+    response = app.response_class(body, mimetype=MSGPACK_MIMETYPE if binary else 'application/json')
+    response.vary.add('Accept')
+    return response
+
+def record_binary_encoder(field, strings, string_index):
+    """单个字段的二进制编码函数；DICTIONARY_FIELDS 编码为 strings 中的下标"""
+    if field in DICTIONARY_FIELDS:
+        def encode(value):
+            text = format_record_value(field, value)
+            index = string_index.get(text)
+            if index is None:
+                index = string_index[text] = len(strings)
+                strings.append(text)
+            return index
+        return encode
+    if field in INTEGER_FIELDS or field in DECIMAL_FIELDS or field in RATE_FIELDS:
+        # 迁移完成前旧表中仍可能是文本
+        return lambda value: parse_number(value) if isinstance(value, str) else value
+    return record_field_formatter(field)
+
+def pack_record_rows(fields, rows):
+    """MessagePack 响应中的记录：{'columns', 'strings', 'dictionary_columns', 'rows'}。
+
+    dictionary_columns 中的列在 rows 里是 strings 的下标，数值列为数值或 None，
+    比率为不带百分号的数值。
+    """
+    strings = []
+    string_index = {}
+    encoders = [record_binary_encoder(field, strings, string_index) for field in fields]
+    packed_rows = [[encode(value) for encode, value in zip(encoders, row)] for row in rows]
+    return {
+        'columns': fields,
+        'strings': strings,
+        'dictionary_columns': [field for field in fields if field in DICTIONARY_FIELDS],
+        'rows': packed_rows,
+    }
+
+RECORD_FILTER_FIELDS = ('name', 'product', 'process', 'adjustment_master')
+
+class ResponseCache:
+    """按总字节数限制大小的 LRU 缓存，每个条目记录其依赖的写入代数，
+    读取时代数与当前不一致即视为失效。各 worker 进程各有一份。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generations):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != generations:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, generations, value, size):
+        # 单个条目超过上限四分之一时不缓存，避免一次挤掉大部分条目
+        if size > self.max_bytes // 4:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (generations, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+record_response_cache = ResponseCache(app.config['RECORDS_CACHE_MAX_BYTES'])
+# 日期范围超过这个天数时不按日期分区判断失效
+RECORD_CACHE_MAX_DATE_PARTITIONS = 62
+
+def record_cache_dependencies(args):
+    """筛选结果依赖的写入代数名称。
+
+    影响结果的写入一定同时命中筛选中的每个分区维度，所以只需检查其中一个：
+    依次选用产品规格、工序、日期范围，都没有时依赖整个表。
+    """
+    if args.get('product'):
+        names = [record_partition_name('product', args['product'])]
+    elif args.get('process'):
+        names = [record_partition_name('process', args['process'])]
+    else:
+        start_date = parse_date(args.get('start_date'))
+        end_date = parse_date(args.get('end_date'))
+        if start_date and end_date and 0 <= (end_date - start_date).days < RECORD_CACHE_MAX_DATE_PARTITIONS:
+            names = [record_partition_name('date', start_date + timedelta(days=offset))
+                     for offset in range((end_date - start_date).days + 1)]
+        else:
+            return ['production_record']
+    return names + [RECORD_BULK_PARTITION]
+
+def record_cache_key(args, fields, compact, binary):
+    """规范化的缓存键：忽略空筛选值和参数顺序"""
+    filters = tuple((key, args[key]) for key in ('start_date', 'end_date') + RECORD_FILTER_FIELDS if args.get(key))
+    return (filters, tuple(fields), compact, binary, args.get('limit'), args.get('after'))
+
+def paged_records_body(binary, records_body, next_cursor, sync_cursor):
+    """把缓存的记录部分与本次请求的游标拼成完整响应体"""
+    encode = functools.partial(encode_api_body, binary=binary)
+    if binary:
+        # MessagePack 中 0x83 表示含 3 个键值对的 map
+        return (b'\x83' + encode('records') + records_body + encode('next_cursor') + encode(next_cursor)
+                + encode('sync_cursor') + encode(sync_cursor))
+    return (b'{"records":' + records_body + b',"next_cursor":' + encode(next_cursor)
+            + b',"sync_cursor":' + encode(sync_cursor) + b'}')
+
+# 记录列表按 (date, id) 倒序，id 保证同一天内顺序稳定
+RECORD_ORDER = (ProductionRecord.date.desc(), ProductionRecord.id.desc())
+RECORDS_PAGE_SIZE = 200
+RECORDS_MAX_PAGE_SIZE = 1000
+
+def encode_record_cursor(record):
+    """分页游标：最后一条记录的 日期_ID"""
+    return f'{record.date.isoformat()}_{record.id}'
+
+def decode_record_cursor(cursor):
+    """解析分页游标，无效时返回None"""
+    date_text, _, id_text = cursor.partition('_')
+    cursor_date = parse_date(date_text)
+    if cursor_date is None or not id_text.isdigit():
+        return None
+    return cursor_date, int(id_text)
+
+def record_page_query(args, cursor=None):
+    """筛选后取游标之后的一页记录的查询"""
+    query = filter_records(ProductionRecord.query, args)
+    if cursor:
+        query = query.filter(sa.tuple_(ProductionRecord.date, ProductionRecord.id) < cursor)
+    return query.order_by(*RECORD_ORDER)
+
+def records_using_query(field, value):
+    """统计引用某员工/工序/产品的记录数的查询，直接走索引计数"""
+    return db.session.query(db.func.count(ProductionRecord.id)).filter(
+        getattr(ProductionRecord, field) == value
+    )
+
+def count_records_using(field, value):
+    return records_using_query(field, value).scalar()
+
+def plans_using_process_query(process_name):
+    """统计使用某工序的产量计划数，走 (process, plan_id) 索引"""
+    return db.session.query(db.func.count(db.distinct(ProductionPlanStep.plan_id))).filter(
+        ProductionPlanStep.process == process_name
+    )
+
+def record_filter_conditions(args, model=None):
+    """把 start_date/end_date 日期范围和各等值筛选参数转换为条件列表。
+
+    model 默认为 ProductionRecord，也可以是列名相同的 RecordDailyRollup。
+    """
+    model = model or ProductionRecord
+    conditions = []
+    start_date = parse_date(args.get('start_date'))
+    end_date = parse_date(args.get('end_date'))
+    if start_date:
+        conditions.append(model.date >= start_date)
+    if end_date:
+        conditions.append(model.date <= end_date)
+    for field in RECORD_FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            conditions.append(getattr(model, field) == value)
+    return conditions
+
+def filter_records(query, args):
+    """按 start_date/end_date 日期范围和各等值条件筛选记录"""
+    return query.filter(*record_filter_conditions(args))
+
+# 增量同步：写事务在提交前取 updated_at，游标回退一段余量，避免漏掉稍后才提交的修改；
+# 余量内的记录会重复返回，客户端按 id 覆盖即可
+RECORD_CHANGES_OVERLAP = timedelta(seconds=5)
+RECORD_CHANGES_MAX = 1000
+RECORD_TOMBSTONE_DAYS = 7
+
+def record_changes_cursor():
+    """当前的增量同步游标，需在读取数据之前获取"""
+    return (datetime.utcnow() - RECORD_CHANGES_OVERLAP).isoformat()
+
+def record_changes_query(since, args):
+    """since 之后修改过的记录，附带是否仍满足筛选条件"""
+    matches = sa.and_(sa.true(), *record_filter_conditions(args))
+    return db.session.query(ProductionRecord, matches.label('matches')).filter(
+        ProductionRecord.updated_at >= since
+    ).order_by(ProductionRecord.updated_at, ProductionRecord.id)
+
+def publish_change(kind, action, **payload):
+    """记录一条变更事件（不提交，随当前事务一起提交）"""
+    db.session.add(ChangeEvent(kind=kind, action=action,
+                               payload=json.dumps(payload, ensure_ascii=False)))
+
+def add_record_tombstones(record_ids):
+    """为删除的记录写墓碑，并清理过期墓碑（不提交）"""
+    now = datetime.utcnow()
+    db.session.execute(sa.insert(RecordTombstone),
+                       [{'record_id': record_id, 'deleted_at': now} for record_id in record_ids])
+    RecordTombstone.query.filter(
+        RecordTombstone.deleted_at < now - timedelta(days=RECORD_TOMBSTONE_DAYS)
+    ).delete(synchronize_session=False)
+
+# 响应压缩：按 Accept-Encoding 选择算法，优先 zstd，其次 br、gzip
+COMPRESSORS = (
+    ('zstd', zstandard and (lambda data: zstandard.ZstdCompressor(level=3).compress(data))),
+    ('br', brotli and (lambda data: brotli.compress(data, quality=4))),
+    ('gzip', lambda data: gzip.compress(data, compresslevel=5)),
+)
+COMPRESS_MIMETYPES = {'application/json', 'text/html', MSGPACK_MIMETYPE}
+
+def choose_content_encoding(accept_encodings):
+    """客户端接受且本机可用的第一个压缩算法，没有时返回 (None, None)"""
+    for encoding, compress in COMPRESSORS:
+        if compress and accept_encodings[encoding] > 0:
+            return encoding, compress
+    return None, None
+
+@app.after_request
+def compress_response(response):
+    """压缩超过 COMPRESS_MIN_SIZE 字节的 JSON/HTML 响应；流式响应（SSE、文件）不处理"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESS_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding, compress = choose_content_encoding(request.accept_encodings)
+    if encoding:
+        response.set_data(compress(data))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 # 路由
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/records')
+@conditional_by_generation('production_record')
 def get_records():
-    """获取所有记录，支持筛选"""
-    # 获取筛选参数
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    name = request.args.get('name')
-    product = request.args.get('product')
-    process = request.args.get('process')
-    adjustment_master = request.args.get('adjustment_master')
+    """获取记录，支持筛选。
+
+    传入 limit 或 after 时按 (date, id) 倒序分页，返回
+    {'records': [...], 'next_cursor': ..., 'sync_cursor': ...}；next_cursor 为 None 表示没有更多数据，
+    sync_cursor 可作为 /api/records/changes 的 since 参数。
+    不带分页参数时保持旧行为，返回全部匹配记录的列表。
+    
+    fields=date,name,... 只查询并返回指定字段（id 总是返回）；
+    shape=compact 时记录以 {'columns': [...], 'rows': [[...]]} 返回，不带分页参数时直接返回该对象。
+    Accept: application/msgpack 时以 MessagePack 返回，记录格式见 pack_record_rows。
+    """
+    fields = parse_record_fields(request.args.get('fields'))
+    if fields is None:
+        return jsonify({'success': False, 'message': '无效的字段'}), 400
+    compact = request.args.get('shape') == 'compact'
+    binary = wants_msgpack()
+    if binary:
+        encode_rows = functools.partial(pack_record_rows, fields)
+    else:
+        encode_rows = functools.partial(serialize_record_rows, fields, compact=compact)
+    paged = 'limit' in request.args or 'after' in request.args
     
-    # 构建查询
-    query = ProductionRecord.query
+    if paged:
+        limit = request.args.get('limit', RECORDS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, RECORDS_MAX_PAGE_SIZE))
+        after = request.args.get('after')
+        cursor = decode_record_cursor(after) if after else None
+        if after and cursor is None:
+            return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+        sync_cursor = record_changes_cursor()
     
-    # 应用筛选条件
-    if start_date:
-        query = query.filter(ProductionRecord.date >= start_date)
-    if end_date:
-        query = query.filter(ProductionRecord.date <= end_date)
-    if name:
-        query = query.filter(ProductionRecord.name == name)
-    if product:
-        query = query.filter(ProductionRecord.product == product)
-    if process:
-        query = query.filter(ProductionRecord.process == process)
-    if adjustment_master:
-        query = query.filter(ProductionRecord.adjustment_master == adjustment_master)
+    # 缓存编码后的记录部分；代数在查询之前读取，查询期间的写入只会让条目提前失效
+    cache_key = record_cache_key(request.args, fields, compact, binary)
+    generations = table_generations(record_cache_dependencies(request.args))
+    cached = record_response_cache.get(cache_key, generations)
+    if cached is None:
+        if paged:
+            # 多取一条用于判断是否还有下一页
+            query = record_columns_query(record_page_query(request.args, cursor), fields)
+            rows = query.limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = encode_record_cursor(rows[-1]) if has_more else None
+        else:
+            query = filter_records(ProductionRecord.query, request.args).order_by(*RECORD_ORDER)
+            # 分批读取，PostgreSQL 上使用服务端游标，不把整个结果集一次读入驱动
+            rows = record_columns_query(query, fields).yield_per(app.config['RECORDS_STREAM_BATCH'])
+            next_cursor = None
+        cached = (encode_api_body(encode_rows(rows), binary), next_cursor)
+        record_response_cache.put(cache_key, generations, cached, len(cached[0]))
     
-    records = query.order_by(ProductionRecord.date.desc()).all()
-    result = []
-    for record in records:
-        record_dict = {
-            'id': record.id,
-            'date': record.date,
-            'name': record.name,
-            'position': record.position,
-            'product': record.product,
-            'process': record.process,
-            'theoretical_runtime': record.theoretical_runtime,
-            'actual_runtime': record.actual_runtime,
-            'single_time': record.single_time,
-            'theoretical_qty': record.theoretical_qty,
-            'actual_qty': record.actual_qty,
-            'total_weight': record.total_weight,
-            'unit_weight': record.unit_weight,
-            'tare_weight': record.tare_weight,
-            'capacity_rate': record.capacity_rate,
-            'time_rate': record.time_rate,
-            'downtime_duration': record.downtime_duration,
-            'adjustment_time': record.adjustment_time,
-            'adjustment_master': record.adjustment_master,
-            'created_at': record.created_at.isoformat(),
-            'updated_at': record.updated_at.isoformat()
-        }
-        result.append(record_dict)
-    return jsonify(result)
+    records_body, next_cursor = cached
+    if not paged:
+        return raw_api_response(records_body, binary)
+    return raw_api_response(paged_records_body(binary, records_body, next_cursor, sync_cursor), binary)
 
 @app.route('/api/records', methods=['POST'])
+@serialized_write
 def add_record():
     """添加新记录"""
     data = request.json
-    record = ProductionRecord(
-        date=data.get('date', ''),
-        name=data.get('name', ''),
-        position=data.get('position', ''),
-        product=data.get('product', ''),
-        process=data.get('process', ''),
-        theoretical_runtime=data.get('theoretical_runtime', ''),
-        actual_runtime=data.get('actual_runtime', ''),
-        single_time=data.get('single_time', ''),
-        theoretical_qty=data.get('theoretical_qty', ''),
-        actual_qty=data.get('actual_qty', ''),
-        total_weight=data.get('total_weight', ''),
-        unit_weight=data.get('unit_weight', ''),
-        tare_weight=data.get('tare_weight', ''),
-        capacity_rate=data.get('capacity_rate', ''),
-        time_rate=data.get('time_rate', ''),
-        downtime_duration=data.get('downtime_duration', ''),
-        adjustment_time=data.get('adjustment_time', ''),
-        adjustment_master=data.get('adjustment_master', '')
-    )
+    values = {field: parse_record_value(field, data.get(field, '')) for field in RECORD_FIELDS}
+    if values['date'] is None:
+        return jsonify({'success': False, 'message': '日期格式无效，应为 YYYY-MM-DD'}), 400
+    # 自动计算相关字段，与输入字段一起一次提交
+    values.update(derive_fields(values, record_shift_minutes(values)))
+    record = ProductionRecord(**values)
     db.session.add(record)
+    db.session.flush()
+    publish_change('record', 'upsert', ids=[record.id])
     db.session.commit()
     
-    # 自动计算相关字段
-    calculate_derived_fields(record.id)
-    db.session.commit()  # 保存计算结果
-    
     return jsonify({'success': True, 'id': record.id})
 
 @app.route('/api/records/<int:record_id>', methods=['PUT'])
+@serialized_write
 def update_record(record_id):
     """更新记录"""
     record = ProductionRecord.query.get_or_404(record_id)
     data = request.json
     
+    if 'date' in data and parse_date(data['date']) is None:
+        return jsonify({'success': False, 'message': '日期格式无效，应为 YYYY-MM-DD'}), 400
+    
     # 更新字段
-    for field in ['date', 'name', 'position', 'product', 'process', 
-                  'theoretical_runtime', 'actual_runtime', 'single_time',
-                  'theoretical_qty', 'actual_qty', 'total_weight', 
-                  'unit_weight', 'tare_weight', 'capacity_rate', 
-                  'time_rate', 'downtime_duration', 'adjustment_time', 
-                  'adjustment_master']:
+    for field in RECORD_FIELDS:
         if field in data:
-            setattr(record, field, data[field])
+            setattr(record, field, parse_record_value(field, data[field]))
     
+    # 自动计算相关字段，与输入字段一起一次提交
+    apply_derived_fields(record)
     record.updated_at = datetime.utcnow()
+    publish_change('record', 'upsert', ids=[record_id])
     db.session.commit()
     
-    # 自动计算相关字段
-    calculate_derived_fields(record_id)
-    db.session.commit()  # 保存计算结果
-    
     return jsonify({'success': True})
 
 @app.route('/api/records/<int:record_id>', methods=['DELETE'])
+@serialized_write
 def delete_record(record_id):
     """删除记录"""
     record = ProductionRecord.query.get_or_404(record_id)
@@ -209,18 +1215,442 @@ def delete_record(record_id):
     Comment.query.filter_by(record_id=record_id).delete()
     
     db.session.delete(record)
+    add_record_tombstones([record_id])
+    publish_change('record', 'delete', ids=[record_id])
     db.session.commit()
     
     return jsonify({'success': True})
 
+# 批量接口单次最多处理的记录数
+RECORDS_BATCH_MAX = 1000
+
+def batch_items(data, key):
+    """取出批量请求体中的列表，格式不对或超过上限时返回错误信息"""
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, f'请求体应包含非空列表 {key}'
+    if len(items) > RECORDS_BATCH_MAX:
+        return None, f'单次最多处理 {RECORDS_BATCH_MAX} 条记录'
+    return items, None
+
+def is_record_id(value):
+    """JSON 中的整数记录ID；true/false 在 Python 中是 int 的子类，不算ID"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def batch_response(results):
+    """汇总逐条结果；只要有一条成功即视为请求成功"""
+    failed = sum(1 for item in results if not item['success'])
+    return jsonify({'success': failed < len(results), 'failed': failed, 'results': results})
+
+@app.route('/api/records/batch', methods=['POST'])
+@serialized_write
+def add_records_batch():
+    """批量添加记录，请求体为 {'records': [...]}，全部在一个事务中插入。
+
+    每条记录单独校验，无效的记录不插入，并在 results 中返回原因。
+    """
+    items, error = batch_items(request.json, 'records')
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    results = []
+    rows = []
+    calendar = shift_calendar()
+    for index, data in enumerate(items):
+        if not isinstance(data, dict):
+            results.append({'index': index, 'success': False, 'message': '记录格式无效'})
+            continue
+        values = {field: parse_record_value(field, data.get(field, '')) for field in RECORD_FIELDS}
+        if values['date'] is None:
+            results.append({'index': index, 'success': False, 'message': '日期格式无效，应为 YYYY-MM-DD'})
+            continue
+        values.update(derive_fields(values, calendar.minutes(values['date'], values['process'])))
+        results.append({'index': index, 'success': True})
+        rows.append(values)
+
+    if rows:
+        # executemany 插入，RETURNING 按参数顺序返回新记录的 id
+        ids = db.session.scalars(
+            sa.insert(ProductionRecord).returning(ProductionRecord.id, sort_by_parameter_order=True),
+            rows, execution_options={'added_records': rows}
+        ).all()
+        publish_change('record', 'upsert', ids=ids)
+        db.session.commit()
+        inserted = iter(ids)
+        for item in results:
+            if item['success']:
+                item['id'] = next(inserted)
+
+    return batch_response(results)
+
+@app.route('/api/records/batch', methods=['PUT'])
+@serialized_write
+def update_records_batch():
+    """批量更新记录，请求体为 {'records': [{'id': 1, 字段: 值, ...}, ...]}。
+
+    只更新每条中出现的字段，派生字段按合并后的值重新计算，全部在一个事务中提交。
+    """
+    items, error = batch_items(request.json, 'records')
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    ids = [data.get('id') for data in items
+           if isinstance(data, dict) and is_record_id(data.get('id'))]
+    records = {record.id: record for record in
+               ProductionRecord.query.filter(ProductionRecord.id.in_(ids)).all()}
+
+    results = []
+    rows = {}
+    now = datetime.utcnow()
+    calendar = shift_calendar()
+    for index, data in enumerate(items):
+        record_id = data.get('id') if isinstance(data, dict) else None
+        record = records.get(record_id) if is_record_id(record_id) else None
+        if record is None:
+            results.append({'index': index, 'id': record_id, 'success': False, 'message': '记录不存在'})
+            continue
+        if 'date' in data and parse_date(data['date']) is None:
+            results.append({'index': index, 'id': record_id, 'success': False, 'message': '日期格式无效，应为 YYYY-MM-DD'})
+            continue
+        # 同一 id 出现多次时，后面的修改叠加在前面的结果上
+        values = rows.get(record_id) or {field: parse_record_value(field, getattr(record, field))
+                                         for field in RECORD_FIELDS}
+        for field in RECORD_FIELDS:
+            if field in data:
+                values[field] = parse_record_value(field, data[field])
+        values.update(derive_fields(values, calendar.minutes(values['date'], values['process'])))
+        values['id'] = record_id
+        values['updated_at'] = now
+        rows[record_id] = values
+        results.append({'index': index, 'id': record_id, 'success': True})
+
+    if rows:
+        # 按主键的批量 UPDATE，一次 executemany 完成；声明修改前后的完整值，供分区失效和汇总表增量使用
+        old_values = [{field: getattr(records[record_id], field) for field in ROLLUP_RECORD_FIELDS}
+                      for record_id in rows]
+        db.session.expunge_all()
+        db.session.execute(sa.update(ProductionRecord), list(rows.values()),
+                           execution_options={'removed_records': old_values, 'added_records': list(rows.values())})
+        publish_change('record', 'upsert', ids=list(rows))
+        db.session.commit()
+
+    return batch_response(results)
+
+@app.route('/api/records/batch', methods=['DELETE'])
+@serialized_write
+def delete_records_batch():
+    """批量删除记录及其注释，请求体为 {'ids': [...]}"""
+    ids, error = batch_items(request.json, 'ids')
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    valid_ids = [record_id for record_id in ids if is_record_id(record_id)]
+    deleted_rows = db.session.execute(
+        sa.select(ProductionRecord.id, *(getattr(ProductionRecord, field) for field in ROLLUP_RECORD_FIELDS))
+        .where(ProductionRecord.id.in_(valid_ids))
+    ).mappings().all()
+    existing = {row['id'] for row in deleted_rows}
+    if existing:
+        Comment.query.filter(Comment.record_id.in_(existing)).delete(synchronize_session=False)
+        db.session.execute(
+            sa.delete(ProductionRecord).where(ProductionRecord.id.in_(existing)),
+            execution_options={'synchronize_session': False, 'removed_records': deleted_rows}
+        )
+        add_record_tombstones(existing)
+        publish_change('record', 'delete', ids=sorted(existing))
+        db.session.commit()
+
+    results = []
+    for record_id in ids:
+        if is_record_id(record_id) and record_id in existing:
+            results.append({'id': record_id, 'success': True})
+        else:
+            results.append({'id': record_id, 'success': False, 'message': '记录不存在'})
+    return batch_response(results)
+
+# 批量重算派生字段：与记录分页相同按 (日期, ID) 倒序分批读取（各筛选条件的索引都以日期结尾），
+# 每批向量化计算后只更新结果有变化的记录
+RECALCULATE_BATCH_SIZE = 5000
+
+def recalculation_query(args, cursor, limit):
+    """分页游标 cursor 之后、满足筛选条件的至多 limit 条记录，含计算派生字段和汇总表增量需要的字段"""
+    fields = dict.fromkeys(ROLLUP_RECORD_FIELDS + DERIVATION_INPUT_FIELDS)
+    query = sa.select(ProductionRecord.id, *(getattr(ProductionRecord, field) for field in fields)).where(
+        *record_filter_conditions(args))
+    if cursor:
+        query = query.where(sa.tuple_(ProductionRecord.date, ProductionRecord.id) < cursor)
+    return query.order_by(*RECORD_ORDER).limit(limit)
+
+def recalculate_records(args, cursor, limit, calendar):
+    """按 calendar 的班次设置重新计算一批记录的派生字段，更新有变化的记录（不提交）。
+
+    返回 (读取条数, 更新条数, 下一批的分页游标)；读取条数小于 limit 时已全部处理完。
+    """
+    result = db.session.execute(recalculation_query(args, cursor, limit))
+    keys = tuple(result.keys())
+    result = result.all()
+    if not result:
+        return 0, 0, None
+    rows = [dict(zip(keys, row)) for row in result]
+    # 同一批中日期和工序的组合很少，每个组合只查一次班次设置
+    shifts = {}
+    for row in rows:
+        key = (row['date'], row['process'])
+        if key not in shifts:
+            shifts[key] = calendar.minutes(*key)
+    derived = derive_fields_batch({field: [row[field] for row in rows] for field in DERIVATION_INPUT_FIELDS},
+                                  [shifts[row['date'], row['process']] for row in rows])
+    now = datetime.utcnow()
+    removed, added, updates = [], [], []
+    for row, values in zip(rows, zip(*(derived[field] for field in DERIVED_FIELDS))):
+        values = dict(zip(DERIVED_FIELDS, values))
+        if all(values[field] == row[field] for field in DERIVED_FIELDS):
+            continue
+        removed.append(row)
+        added.append({**row, **values})
+        updates.append({'id': row['id'], **values, 'updated_at': now})
+    if updates:
+        # 按主键的批量 UPDATE，声明修改前后的完整值，供分区失效和汇总表增量使用
+        db.session.execute(sa.update(ProductionRecord), updates,
+                           execution_options={'removed_records': removed, 'added_records': added})
+        publish_change('record', 'upsert', ids=[item['id'] for item in updates])
+    return len(rows), len(updates), encode_record_cursor(result[-1])
+
+@app.route('/api/records/recalculate', methods=['POST'])
+@serialized_write
+def recalculate_records_batch():
+    """按当前班次设置重新计算记录的派生字段，每次请求处理一批并提交。
+
+    请求体可含与 /api/records 相同的筛选条件，cursor 为上一批返回的 next_cursor（首次不传），
+    limit 为每批条数；返回本批读取和更新的条数，next_cursor 为空时已全部处理完。
+    首次请求另返回满足筛选条件的记录总数，用于显示进度。
+    """
+    data = request.json or {}
+    cursor = None
+    if data.get('cursor'):
+        cursor = decode_record_cursor(str(data['cursor']))
+        if cursor is None:
+            return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+    limit = data.get('limit', RECALCULATE_BATCH_SIZE)
+    if not isinstance(limit, int) or not 0 < limit <= RECALCULATE_BATCH_SIZE:
+        return jsonify({'success': False, 'message': f'limit 应为 1 到 {RECALCULATE_BATCH_SIZE} 之间的整数'}), 400
+    args = {key: data[key] for key in ('start_date', 'end_date') + RECORD_FILTER_FIELDS if data.get(key)}
+    result = {'success': True}
+    if cursor is None:
+        result['total'] = db.session.scalar(
+            sa.select(sa.func.count(ProductionRecord.id)).where(*record_filter_conditions(args)))
+    scanned, updated, next_cursor = recalculate_records(args, cursor, limit, shift_calendar())
+    db.session.commit()
+    result.update(scanned=scanned, updated=updated, next_cursor=next_cursor if scanned == limit else None)
+    return jsonify(result)
+
+@app.route('/api/records/changes')
+def get_record_changes():
+    """增量同步：返回 since 游标之后新增、修改和删除的记录。
+
+    返回 {'records': [...], 'deleted': [...], 'cursor': ...}。records 为仍满足筛选条件的
+    变更记录；deleted 为已删除的记录 id，以及修改后不再满足筛选条件的记录 id，
+    客户端应先移除 deleted 再按 id 覆盖 records。不带 since 时只返回当前游标。
+    reset 为 True 表示游标过旧或变更过多，客户端应重新加载完整列表。
+    """
+    now = datetime.utcnow()
+    result = {'records': [], 'deleted': [], 'cursor': record_changes_cursor()}
+    since_text = request.args.get('since')
+    if not since_text:
+        return jsonify(result)
+    try:
+        since = datetime.fromisoformat(since_text)
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的同步游标'}), 400
+    if since < now - timedelta(days=RECORD_TOMBSTONE_DAYS):
+        result['reset'] = True
+        return jsonify(result)
+    
+    changes = record_changes_query(since, request.args).limit(RECORD_CHANGES_MAX + 1).all()
+    if len(changes) > RECORD_CHANGES_MAX:
+        result['reset'] = True
+        return jsonify(result)
+    
+    deleted = set(db.session.scalars(
+        sa.select(RecordTombstone.record_id).where(RecordTombstone.deleted_at >= since)
+    ))
+    for record, matches in changes:
+        if matches:
+            result['records'].append(record_to_dict(record))
+        else:
+            deleted.add(record.id)
+    result['deleted'] = sorted(deleted)
+    return jsonify(result)
+
+def record_facets_query(field, args):
+    """某个筛选字段的不同取值及记录数，按其他已选筛选条件收窄"""
+    column = getattr(ProductionRecord, field)
+    other_args = {key: value for key, value in args.items() if key != field}
+    return db.session.query(column, sa.func.count()).filter(
+        *record_filter_conditions(other_args)
+    ).filter(column != '').group_by(column).order_by(column)
+
+# 分面结果按筛选参数缓存，生产记录的写入代数变化（任意 worker 有写入）时整体失效
+_facets_cache = {}
+_facets_cache_generation = None
+_facets_cache_lock = threading.Lock()
+FACETS_CACHE_SIZE = 256
+
+@app.route('/api/records/facets')
+@conditional_by_generation('production_record')
+def get_record_facets():
+    """筛选下拉框使用的不同取值及记录数。
+
+    返回 {'name': [{'value': ..., 'count': ...}], 'product': [...], ...}。
+    可传入与 /api/records 相同的筛选参数，每个字段的计数按其他字段的筛选条件收窄；
+    fields 参数可限定只返回部分字段，如 fields=product,name。
+    """
+    global _facets_cache_generation
+    fields = [field for field in request.args.get('fields', ','.join(RECORD_FILTER_FIELDS)).split(',')
+              if field in RECORD_FILTER_FIELDS]
+    args = {key: value for key, value in request.args.items()
+            if key in ('start_date', 'end_date') + RECORD_FILTER_FIELDS and value}
+    key = (tuple(fields), tuple(sorted(args.items())))
+    generation = table_generations(['production_record'])
+
+    with _facets_cache_lock:
+        if _facets_cache_generation != generation:
+            _facets_cache.clear()
+            _facets_cache_generation = generation
+        result = _facets_cache.get(key)
+    if result is None:
+        # 在 Python 中排序，结果与数据库的排序规则（如 PostgreSQL 的 en_US.UTF-8）无关
+        result = {field: [{'value': value, 'count': count}
+                          for value, count in sorted(record_facets_query(field, args))]
+                  for field in fields}
+        with _facets_cache_lock:
+            if _facets_cache_generation == generation and len(_facets_cache) < FACETS_CACHE_SIZE:
+                _facets_cache[key] = result
+    return jsonify(result)
+
+# SSE 推送：轮询间隔、心跳间隔和事件保留时长
+CHANGE_POLL_SECONDS = 1.0
+SSE_HEARTBEAT_SECONDS = 15
+CHANGE_EVENT_RETENTION = timedelta(hours=1)
+# 推送连接数已满时，客户端至少等待这么久再重新连接
+SSE_RETRY_AFTER_SECONDS = 60
+
+class ChangeBroadcaster:
+    """每个进程一个后台线程轮询 change_event 表，把新事件分发给本进程的 SSE 连接。
+
+    事件表在数据库中，多个 gunicorn worker 各自轮询即可拿到其他 worker 写入的事件，
+    不需要额外的消息中间件。线程在第一个连接订阅时才启动，避免在 fork 前创建。
+    """
+
+    def __init__(self, interval=CHANGE_POLL_SECONDS):
+        self.interval = interval
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self):
+        """登记一个连接；本进程的连接数已达 SSE_MAX_STREAMS 时返回 None"""
+        subscriber = queue.Queue(maxsize=1000)
+        with self.lock:
+            if len(self.subscribers) >= app.config['SSE_MAX_STREAMS']:
+                return None
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='change-broadcaster', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, message):
+        """分发给本进程的所有连接；队列满（客户端太慢）时断开该连接，让它重连后重新同步"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self.unsubscribe(subscriber)
+
+    def _run(self):
+        with app.app_context():
+            last_id = db.session.scalar(sa.select(sa.func.max(ChangeEvent.id))) or 0
+            db.session.remove()
+            last_prune = time.monotonic()
+            while True:
+                time.sleep(self.interval)
+                try:
+                    events = ChangeEvent.query.filter(ChangeEvent.id > last_id).order_by(ChangeEvent.id).all()
+                    if time.monotonic() - last_prune > CHANGE_EVENT_RETENTION.total_seconds() / 6:
+                        prune_change_events(last_id)
+                        last_prune = time.monotonic()
+                except Exception as exc:
+                    app.logger.warning('读取变更事件失败: %s', exc)
+                    events = []
+                finally:
+                    # 结束读事务，不长期占用 SQLite 快照
+                    db.session.remove()
+                for event in events:
+                    last_id = event.id
+                    self.publish(format_change_event(event))
+
+@serialized_write
+def prune_change_events(last_id):
+    """删除超过保留时长的变更事件。保留最新一条，id 不会因表被清空而重新从 1 开始（id 同时用作缓存代数）"""
+    ChangeEvent.query.filter(
+        ChangeEvent.created_at < datetime.utcnow() - CHANGE_EVENT_RETENTION,
+        ChangeEvent.id < last_id
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+def format_change_event(event):
+    """把变更事件格式化为 SSE 消息"""
+    data = dict(json.loads(event.payload), action=event.action)
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+change_broadcaster = ChangeBroadcaster()
+
+@app.route('/api/events')
+def stream_events():
+    """SSE 推送记录、注释和计划的变更事件。
+
+    事件只说明哪些数据变了，连接建立或重连后客户端应先调用一次
+    /api/records/changes 补齐断开期间的变化。
+
+    每个连接一直占用一个 worker 线程，每个进程最多 SSE_MAX_STREAMS 个连接，其余线程留给普通请求；
+    超过时返回 503，客户端改为定时轮询 /api/records/changes，稍后再尝试连接。
+    """
+    subscriber = change_broadcaster.subscribe()
+    if subscriber is None:
+        return jsonify({'success': False, 'message': '推送连接数已满，请改为轮询 /api/records/changes'}), 503, \
+            {'Retry-After': str(SSE_RETRY_AFTER_SECONDS)}
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    yield subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    if subscriber not in change_broadcaster.subscribers:
+                        return
+                    yield ': ping\n\n'
+        finally:
+            change_broadcaster.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/employees')
+@conditional_by_generation('employee')
 def get_employees():
     """获取员工列表"""
-    employees = Employee.query.all()
-    result = [{'id': emp.id, 'name': emp.name, 'position': emp.position} for emp in employees]
-    return jsonify(result)
+    return master_data['employee'].response()
 
 @app.route('/api/employees', methods=['POST'])
+@serialized_write
 def add_employee():
     """添加员工"""
     data = request.json
@@ -230,14 +1660,13 @@ def add_employee():
     return jsonify({'success': True, 'id': employee.id})
 
 @app.route('/api/employees/<int:employee_id>', methods=['DELETE'])
+@serialized_write
 def delete_employee(employee_id):
     """删除员工"""
     employee = Employee.query.get_or_404(employee_id)
     
     # 检查是否有记录使用此员工
-    records_using_employee = ProductionRecord.query.filter(
-        (ProductionRecord.name == employee.name)
-    ).count()
+    records_using_employee = count_records_using('name', employee.name)
     
     if records_using_employee > 0:
         return jsonify({'success': False, 'message': f'无法删除，有 {records_using_employee} 条记录正在使用此员工'}), 400
@@ -248,6 +1677,7 @@ def delete_employee(employee_id):
     return jsonify({'success': True, 'message': '员工删除成功'})
 
 @app.route('/api/comments/<int:record_id>/<column_key>')
+@conditional_by_generation('comment')
 def get_comment(record_id, column_key):
     """获取注释"""
     comment = Comment.query.filter_by(record_id=record_id, column_key=column_key).first()
@@ -256,6 +1686,7 @@ def get_comment(record_id, column_key):
     return jsonify({'comment': ''})
 
 @app.route('/api/comments/<int:record_id>/<column_key>', methods=['POST'])
+@serialized_write
 def save_comment(record_id, column_key):
     """保存注释"""
     data = request.json
@@ -274,275 +1705,1174 @@ def save_comment(record_id, column_key):
         if comment:
             db.session.delete(comment)
     
+    publish_change('comment', 'upsert' if comment_text else 'delete',
+                   record_id=record_id, column_key=column_key, comment=comment_text)
     db.session.commit()
     return jsonify({'success': True})
 
-def calculate_derived_fields(record_id):
-    """计算派生字段"""
-    record = ProductionRecord.query.get(record_id)
-    if not record:
-        return
-    
-    # 计算理论运行时长 = 480 - 调机时长
-    try:
-        adjustment_time = int(record.adjustment_time) if record.adjustment_time else 0
-        theoretical_runtime = max(0, 480 - adjustment_time)
-        record.theoretical_runtime = str(theoretical_runtime)
-    except (ValueError, TypeError):
-        record.theoretical_runtime = '480'
-    
-    # 计算实际运行时长 = 理论运行时长 - 停机时长
-    try:
-        theoretical_runtime = int(record.theoretical_runtime) if record.theoretical_runtime else 480
-        downtime_duration = int(record.downtime_duration) if record.downtime_duration else 0
-        actual_runtime = max(0, theoretical_runtime - downtime_duration)
-        record.actual_runtime = str(actual_runtime)
-    except (ValueError, TypeError):
-        record.actual_runtime = ''
-    
-    # 计算理论数量 = 实际运行时长 / 单个时间
-    try:
-        actual_runtime = int(record.actual_runtime) if record.actual_runtime else 0
-        single_time = int(record.single_time) if record.single_time else 0
-        if single_time > 0:
-            theoretical_qty = round((actual_runtime * 60) / single_time)
-            record.theoretical_qty = str(theoretical_qty)
-        else:
-            record.theoretical_qty = ''
-    except (ValueError, TypeError):
-        record.theoretical_qty = ''
-    
-    # 计算实际数量 = (总重 - 去皮重量) / 单重
-    try:
-        total_weight = float(record.total_weight) if record.total_weight else 0
-        tare_weight = float(record.tare_weight) if record.tare_weight else 0
-        unit_weight = float(record.unit_weight) if record.unit_weight else 0
-        if unit_weight > 0:
-            actual_qty = (total_weight - tare_weight) / unit_weight
-            record.actual_qty = str(round(actual_qty))
-        else:
-            record.actual_qty = ''
-    except (ValueError, TypeError):
-        record.actual_qty = ''
-    
-    # 计算产能稼动率 = 实际数量 / 理论数量
-    try:
-        actual_qty = int(record.actual_qty) if record.actual_qty else 0
-        theoretical_qty = int(record.theoretical_qty) if record.theoretical_qty else 0
-        if theoretical_qty > 0:
-            capacity_rate = round((actual_qty / theoretical_qty) * 100, 2)
-            record.capacity_rate = f"{capacity_rate}%"
-        else:
-            record.capacity_rate = ''
-    except (ValueError, TypeError):
-        record.capacity_rate = ''
-    
-    # 计算时间稼动率 = 实际运行时长 / 理论运行时长
-    try:
-        actual_runtime = int(record.actual_runtime) if record.actual_runtime else 0
-        theoretical_runtime = int(record.theoretical_runtime) if record.theoretical_runtime else 0
-        if theoretical_runtime > 0:
-            time_rate = round((actual_runtime / theoretical_runtime) * 100, 2)
-            record.time_rate = f"{time_rate}%"
-        else:
-            record.time_rate = ''
-    except (ValueError, TypeError):
-        record.time_rate = ''
-    
-    db.session.commit()
+# 列式分析缓存（可选，需要 numpy）：每个 worker 把生产记录按列保存在内存中，
+# 统计、计划完成量和分组汇总用数组掩码和 bincount 计算，不经过 SQL 和 ORM
+RECORD_COLUMN_CODED = ('product', 'process', 'name', 'adjustment_master')
+# 分组合计的顺序，与 record_groups_query 的合计列相同
+RECORD_GROUP_TOTALS = ('actual_qty', 'theoretical_qty', 'actual_runtime', 'downtime_duration',
+                       'capacity_rate', 'capacity_rate_valid', 'time_rate', 'time_rate_valid')
+# 一次合并的变更超过此条数时整体重新加载
+RECORD_COLUMNS_MAX_CHANGES = 50000
+
+def record_column_select():
+    """列式缓存读取的记录列"""
+    record = ProductionRecord
+    return sa.select(record.id, record.date, *(getattr(record, field) for field in RECORD_COLUMN_CODED),
+                     *(getattr(record, field) for field in ROLLUP_VALUE_FIELDS))
+
+class ColumnCodes:
+    """文本列的字典编码。只增不减，各快照共用；编码只在持有缓存锁时进行"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+def _locate(ids, wanted):
+    """wanted 中各 id 在有序数组 ids 中的位置，以及是否存在"""
+    positions = numpy.searchsorted(ids, wanted)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == wanted[found]
+    return positions, found
+
+class RecordColumns:
+    """生产记录的一份列式快照，数组整体替换，读取方拿到的快照不会被修改。
+
+    日期存为序数，产品规格、工序、姓名、调机师傅存为字典编码；合计字段的空值存为 0，
+    比率存为百分之一的整数，另有 *_valid 数组标记哪些行有值。删除的行只清除 live 标记。
+    """
+
+    def __init__(self, arrays, codes, generations, cursor):
+        self.arrays = arrays
+        self.codes = codes
+        self.generations = generations
+        self.cursor = cursor
+
+    def merge(self, changed, deleted_ids, generations, cursor):
+        """合并一批变更（changed 为 encode_record_columns 的结果），返回新快照"""
+        arrays = {name: array.copy() for name, array in self.arrays.items()}
+        ids = arrays['id']
+        # 先删后写：id 被重用时新记录的 updated_at 一定晚于墓碑
+        positions, found = _locate(ids, numpy.array(deleted_ids, dtype=numpy.int64))
+        arrays['live'][positions[found]] = False
+        positions, found = _locate(ids, changed['id'])
+        for name, array in arrays.items():
+            array[positions[found]] = changed[name][found]
+        if not found.all():
+            arrays = {name: numpy.concatenate((array, changed[name][~found])) for name, array in arrays.items()}
+            if (numpy.diff(arrays['id']) < 0).any():
+                order = numpy.argsort(arrays['id'], kind='stable')
+                arrays = {name: array[order] for name, array in arrays.items()}
+        live = arrays['live']
+        if numpy.count_nonzero(live) < len(live) * 3 // 4:
+            arrays = {name: array[live] for name, array in arrays.items()}
+        return RecordColumns(arrays, self.codes, generations, cursor)
+
+    def mask(self, args):
+        """与 record_filter_conditions 相同的筛选，返回选中行的布尔数组"""
+        arrays = self.arrays
+        mask = arrays['live']
+        start_date = parse_date(args.get('start_date'))
+        end_date = parse_date(args.get('end_date'))
+        if start_date:
+            mask = mask & (arrays['date'] >= start_date.toordinal())
+        if end_date:
+            mask = mask & (arrays['date'] <= end_date.toordinal())
+        for field in RECORD_FILTER_FIELDS:
+            value = args.get(field)
+            if value:
+                code = self.codes[field].codes.get(value)
+                if code is None:
+                    return numpy.zeros_like(mask)
+                mask = mask & (arrays[field] == code)
+        return mask
+
+    def select(self, mask, names):
+        """取出 names 中各列参与计算的部分，返回 (各列数组, where)。
+
+        选中的行不到一半时按下标取出这些行，where 为 True；否则直接使用整列，where 为 mask，
+        归约时带 where 参数，两种情况都不按布尔掩码复制整列。
+        """
+        if numpy.count_nonzero(mask) < len(mask) // 2:
+            rows = numpy.flatnonzero(mask)
+            return {name: self.arrays[name][rows] for name in names}, True
+        return {name: self.arrays[name] for name in names}, mask
+
+    def statistics(self, args):
+        """与 statistics_query 结果相同顺序的元组"""
+        names = ROLLUP_EXTREME_FIELDS + tuple(f'{field}_valid' for field in ROLLUP_EXTREME_FIELDS)
+        arrays, where = self.select(self.mask(args), names)
+        valid = {field: arrays[f'{field}_valid'] & where for field in ROLLUP_EXTREME_FIELDS}
+        count = len(arrays['actual_qty']) if where is True else numpy.count_nonzero(where)
+        result = [int(count), int(arrays['actual_qty'].sum(where=where))]
+        for field in ROLLUP_RATE_FIELDS:
+            result += [int(arrays[field].sum(where=valid[field])), int(numpy.count_nonzero(valid[field]))]
+        limits = numpy.iinfo(numpy.int32)
+        for field in ROLLUP_EXTREME_FIELDS:
+            if not valid[field].any():
+                result += [None, None]
+                continue
+            low = int(arrays[field].min(where=valid[field], initial=limits.max))
+            high = int(arrays[field].max(where=valid[field], initial=limits.min))
+            result += [low / 100, high / 100] if field in ROLLUP_RATE_FIELDS else [low, high]
+        return tuple(result)
+
+    def groups(self, by, mask, totals=RECORD_GROUP_TOTALS):
+        """按 by 中的字段对选中行分组，返回 [(分组值, (记录数, 各合计...))]，合计为 totals 中各列之和"""
+        arrays, where = self.select(mask, tuple(by) + tuple(totals))
+        length = len(arrays[by[0]])
+        selected = length if where is True else int(numpy.count_nonzero(where))
+        index = numpy.zeros(length, dtype=numpy.int64)
+        radices = []
+        for field in by:
+            column = arrays[field]
+            if field != 'date':
+                low, radix = 0, len(self.codes[field].values)
+            elif selected:
+                # 日期序数只取实际出现的范围
+                low = int(column.min(where=where, initial=numpy.iinfo(numpy.int32).max))
+                radix = int(column.max(where=where, initial=0)) - low + 1
+            else:
+                low, radix = 0, 1
+            index = index * radix + (column - low)
+            radices.append((field, low, radix))
+        size = 1
+        for _, _, radix in radices:
+            size *= radix
+        keys = None
+        if size > max(4 * selected, 1 << 20):
+            # 组合编码的取值范围太大时先压缩为连续编号，bincount 的长度不超过行数
+            keys, inverse = numpy.unique(index if where is True else index[where], return_inverse=True)
+            if where is True:
+                index = inverse
+            else:
+                index[where] = inverse
+            size = len(keys)
+        if where is not True:
+            # 未选中的行计入最后一个分组，结果中丢弃
+            index[~where] = size
+        counts = numpy.bincount(index, minlength=size + 1)
+        sums = [numpy.bincount(index, weights=arrays[name], minlength=size + 1) for name in totals]
+        result = []
+        for position in numpy.flatnonzero(counts[:size]):
+            code = int(keys[position]) if keys is not None else int(position)
+            key = []
+            for field, low, radix in reversed(radices):
+                code, part = divmod(code, radix)
+                key.append(date.fromordinal(part + low) if field == 'date' else self.codes[field].values[part])
+            result.append((tuple(reversed(key)),
+                           (int(counts[position]),) + tuple(int(total[position]) for total in sums)))
+        return result
+
+    def plan_completion(self, products):
+        """{(产品, 工序): 实际产量合计}，只统计 products 中的产品"""
+        codes = self.codes['product']
+        wanted = numpy.zeros(len(codes.values), dtype=bool)
+        wanted[[codes.codes[product] for product in products if product in codes.codes]] = True
+        mask = self.arrays['live'] & wanted[self.arrays['product']]
+        return {key: totals[1] for key, totals in self.groups(('product', 'process'), mask, ('actual_qty',))}
+
+class RecordColumnCache:
+    """按需加载并保持最新的 RecordColumns，与 MasterDataSnapshot 一样按写入代数判断是否过期。
+
+    过期时只读取 updated_at 在上次游标之后的记录和墓碑合并进新快照（与 /api/records/changes
+    相同的增量同步）；未声明分区的批量写入、游标过旧或变更过多时整体重新加载。
+    未安装 numpy 或未启用 RECORDS_COLUMNAR_CACHE 时 current() 返回 None。
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.codes = {field: ColumnCodes() for field in RECORD_COLUMN_CODED}
+        self.lock = threading.Lock()
+
+    def current(self):
+        if numpy is None or not app.config['RECORDS_COLUMNAR_CACHE']:
+            return None
+        generations = table_generations([ProductionRecord.__tablename__, RECORD_BULK_PARTITION])
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.generations != generations:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.generations != generations:
+                    snapshot = self._refresh(snapshot, generations)
+                    self.snapshot = snapshot
+        return snapshot
+
+    def _refresh(self, snapshot, generations):
+        # 代数和游标先于数据读取，读取期间的写入只会让下次请求再合并一次
+        now = datetime.utcnow()
+        cursor = now - RECORD_CHANGES_OVERLAP
+        if (snapshot is None or snapshot.generations[1] != generations[1]
+                or snapshot.cursor < now - timedelta(days=RECORD_TOMBSTONE_DAYS)):
+            return self._load(generations, cursor)
+        changed = db.session.execute(record_column_select().where(
+            ProductionRecord.updated_at >= snapshot.cursor
+        ).limit(RECORD_COLUMNS_MAX_CHANGES + 1)).all()
+        if len(changed) > RECORD_COLUMNS_MAX_CHANGES:
+            return self._load(generations, cursor)
+        deleted = db.session.scalars(
+            sa.select(RecordTombstone.record_id).where(RecordTombstone.deleted_at >= snapshot.cursor)
+        ).all()
+        return snapshot.merge(self.encode(changed), deleted, generations, cursor)
+
+    def _load(self, generations, cursor):
+        result = db.session.execute(record_column_select().order_by(ProductionRecord.id).execution_options(
+            yield_per=app.config['RECORDS_STREAM_BATCH']))
+        chunks = [self.encode(rows) for rows in result.partitions()] or [self.encode([])]
+        arrays = {name: numpy.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+        return RecordColumns(arrays, self.codes, generations, cursor)
+
+    def encode(self, rows):
+        """把 record_column_select 的结果行转换为各列数组"""
+        count = len(rows)
+        names = ('id', 'date') + RECORD_COLUMN_CODED + ROLLUP_VALUE_FIELDS
+        columns = dict(zip(names, zip(*rows))) if rows else dict.fromkeys(names, ())
+        arrays = {
+            'id': numpy.fromiter(columns['id'], dtype=numpy.int64, count=count),
+            'live': numpy.ones(count, dtype=bool),
+            'date': numpy.fromiter((value.toordinal() for value in columns['date']), dtype=numpy.int32, count=count),
+        }
+        for field in RECORD_COLUMN_CODED:
+            codes = self.codes[field]
+            arrays[field] = numpy.fromiter((codes.encode(value or '') for value in columns[field]),
+                                           dtype=numpy.int32, count=count)
+        for field in ROLLUP_SUM_FIELDS:
+            arrays[field] = numpy.fromiter((value or 0 for value in columns[field]), dtype=numpy.int32, count=count)
+        arrays['actual_qty_valid'] = numpy.fromiter((value is not None for value in columns['actual_qty']),
+                                                    dtype=bool, count=count)
+        for field in ROLLUP_RATE_FIELDS:
+            values = columns[field]
+            arrays[field] = numpy.fromiter((0 if value is None else round(value * 100) for value in values),
+                                           dtype=numpy.int32, count=count)
+            arrays[f'{field}_valid'] = numpy.fromiter((value is not None for value in values),
+                                                      dtype=bool, count=count)
+        return arrays
+
+record_columns = RecordColumnCache()
+
+def preload_record_columns():
+    """worker 启动时加载列式缓存（启用时），第一个统计请求无需等待整表读取"""
+    with app.app_context():
+        try:
+            record_columns.current()
+        except sa.exc.SQLAlchemyError as exc:
+            app.logger.warning('预加载列式缓存失败: %s', exc)
+        finally:
+            db.session.remove()
 
 # 产量管理API
 @app.route('/api/statistics')
+@conditional_by_generation('production_record')
 def get_statistics():
-    """获取统计数据"""
+    """获取统计数据，支持与 /api/records 相同的筛选参数"""
     try:
-        # 计算合计实际数量
-        total_actual_qty = db.session.query(db.func.sum(ProductionRecord.actual_qty)).scalar() or 0
-        
-        # 计算平均产能稼动率
-        records_with_capacity = ProductionRecord.query.filter(
-            ProductionRecord.capacity_rate != '',
-            ProductionRecord.capacity_rate.isnot(None)
-        ).all()
-        
-        if records_with_capacity:
-            capacity_rates = []
-            for record in records_with_capacity:
-                try:
-                    rate = float(record.capacity_rate.replace('%', ''))
-                    capacity_rates.append(rate)
-                except (ValueError, AttributeError):
-                    continue
-            avg_capacity_rate = sum(capacity_rates) / len(capacity_rates) if capacity_rates else 0
-        else:
-            avg_capacity_rate = 0
-        
-        # 计算平均时间稼动率
-        records_with_time = ProductionRecord.query.filter(
-            ProductionRecord.time_rate != '',
-            ProductionRecord.time_rate.isnot(None)
-        ).all()
-        
-        if records_with_time:
-            time_rates = []
-            for record in records_with_time:
-                try:
-                    rate = float(record.time_rate.replace('%', ''))
-                    time_rates.append(rate)
-                except (ValueError, AttributeError):
-                    continue
-            avg_time_rate = sum(time_rates) / len(time_rates) if time_rates else 0
-        else:
-            avg_time_rate = 0
-        
-        return jsonify({
-            'total_actual_qty': total_actual_qty,
-            'avg_capacity_rate': round(avg_capacity_rate, 2),
-            'avg_time_rate': round(avg_time_rate, 2),
-            'total_records': ProductionRecord.query.count()
-        })
+        return api_response(record_statistics(request.args))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/records/groups')
+@conditional_by_generation('production_record')
+def get_record_groups():
+    """按 by 参数中的字段（date、product、process、name、adjustment_master，逗号分隔）分组汇总。
+
+    支持与 /api/records 相同的筛选参数，返回 {'by': [...], 'groups': [{分组字段..., 'total_records': ...,
+    'total_actual_qty': ..., 'avg_capacity_rate': ..., ...}]}，按分组字段排序。
+    """
+    by = [field for field in request.args.get('by', '').split(',') if field]
+    if not by or any(field not in ROLLUP_GROUP_FIELDS for field in by) or len(set(by)) != len(by):
+        return jsonify({'success': False, 'message': f"by 应为 {', '.join(ROLLUP_GROUP_FIELDS)} 中不重复的字段"}), 400
+    columns = record_columns.current()
+    if columns:
+        groups = columns.groups(by, columns.mask(request.args))
+    else:
+        groups = [(tuple(row[:len(by)]), tuple(row[len(by):])) for row in record_groups_query(by, request.args)]
+    # 在 Python 中排序，顺序与数据库的排序规则无关
+    groups.sort(key=lambda group: group[0])
+    return api_response({'by': by, 'groups': [record_group_result(by, key, totals) for key, totals in groups]})
+
+def record_groups_query(by, args):
+    """从汇总表按 by 分组，合计列的顺序与 RECORD_GROUP_TOTALS 相同（记录数在最前）"""
+    rollup = RecordDailyRollup
+    keys = [getattr(rollup, field) for field in by]
+    return db.session.query(
+        *keys,
+        db.func.sum(rollup.record_count),
+        db.func.sum(rollup.actual_qty_sum),
+        db.func.sum(rollup.theoretical_qty_sum),
+        db.func.sum(rollup.actual_runtime_sum),
+        db.func.sum(rollup.downtime_duration_sum),
+        db.func.sum(rollup.capacity_rate_sum),
+        db.func.sum(rollup.capacity_rate_count),
+        db.func.sum(rollup.time_rate_sum),
+        db.func.sum(rollup.time_rate_count)
+    ).filter(*record_filter_conditions(args, RecordDailyRollup)).group_by(*keys)
+
+def record_group_result(by, key, totals):
+    (total_records, actual_qty, theoretical_qty, actual_runtime, downtime_duration,
+     capacity_rate_sum, capacity_rate_count, time_rate_sum, time_rate_count) = totals
+    result = {field: value.isoformat() if isinstance(value, date) else value for field, value in zip(by, key)}
+    result.update({
+        'total_records': int(total_records),
+        'total_actual_qty': int(actual_qty or 0),
+        'total_theoretical_qty': int(theoretical_qty or 0),
+        'total_actual_runtime': int(actual_runtime or 0),
+        'total_downtime_duration': int(downtime_duration or 0),
+        'avg_capacity_rate': _average(capacity_rate_sum, capacity_rate_count),
+        'avg_time_rate': _average(time_rate_sum, time_rate_count),
+    })
+    return result
+
+def statistics_query(args):
+    """统计用的单条聚合查询，从汇总表读取，耗时与分组数而不是记录数成正比"""
+    rollup = RecordDailyRollup
+    return db.session.query(
+        db.func.sum(rollup.record_count),
+        db.func.sum(rollup.actual_qty_sum),
+        db.func.sum(rollup.capacity_rate_sum),
+        db.func.sum(rollup.capacity_rate_count),
+        db.func.sum(rollup.time_rate_sum),
+        db.func.sum(rollup.time_rate_count),
+        db.func.min(rollup.actual_qty_min),
+        db.func.max(rollup.actual_qty_max),
+        db.func.min(rollup.capacity_rate_min),
+        db.func.max(rollup.capacity_rate_max),
+        db.func.min(rollup.time_rate_min),
+        db.func.max(rollup.time_rate_max)
+    ).filter(*record_filter_conditions(args, RecordDailyRollup))
+
+def _average(total, count):
+    # 汇总表中比率合计的单位是百分之一；用 Decimal 精确相除并四舍五入，避免 SQL 的整数除法和浮点误差
+    if not count:
+        return 0
+    return float((Decimal(total) / count / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+def record_statistics(args):
+    """筛选范围内的合计、平均值和最值（空值不参与平均），启用列式缓存时在内存中计算，否则读汇总表"""
+    columns = record_columns.current()
+    (total_records, total_actual_qty, capacity_rate_sum, capacity_rate_count, time_rate_sum, time_rate_count,
+     min_actual_qty, max_actual_qty, min_capacity_rate, max_capacity_rate,
+     min_time_rate, max_time_rate) = columns.statistics(args) if columns else statistics_query(args).one()
+    return {
+        'total_actual_qty': total_actual_qty or 0,
+        'avg_capacity_rate': _average(capacity_rate_sum, capacity_rate_count),
+        'avg_time_rate': _average(time_rate_sum, time_rate_count),
+        'total_records': total_records or 0,
+        'min_actual_qty': min_actual_qty,
+        'max_actual_qty': max_actual_qty,
+        'min_capacity_rate': min_capacity_rate,
+        'max_capacity_rate': max_capacity_rate,
+        'min_time_rate': min_time_rate,
+        'max_time_rate': max_time_rate
+    }
+
+# 导出：列与页面表格一致，另加创建、更新时间（UTC）
+RECORD_EXPORT_COLUMNS = (
+    ('date', '日期'), ('name', '姓名'), ('position', '职位'), ('product', '产品规格'), ('process', '工序'),
+    ('theoretical_runtime', '理论运行时长(分钟)'), ('actual_runtime', '实际运行时长(分钟)'),
+    ('single_time', '单个时间(秒)'), ('theoretical_qty', '理论数量'), ('actual_qty', '实际数量'),
+    ('total_weight', '总重'), ('unit_weight', '单重'), ('tare_weight', '去皮重量'),
+    ('capacity_rate', '产能稼动率'), ('time_rate', '时间稼动率'),
+    ('downtime_duration', '异常停机时长(分钟)'), ('adjustment_time', '计划停机时长(分钟)'),
+    ('adjustment_master', '调机师傅'), ('created_at', '创建时间(UTC)'), ('updated_at', '更新时间(UTC)'),
+)
+RECORD_EXPORT_FILTERS = (('start_date', '开始日期'), ('end_date', '结束日期'), ('name', '姓名'),
+                         ('product', '产品规格'), ('process', '工序'), ('adjustment_master', '调机师傅'))
+# 每攒够这么多字节交给 WSGI 服务器发送一次
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# 统计部分的表头；导入导出的 CSV 时读到这一行即结束
+EXPORT_SUMMARY_HEADER = ('统计项目', '数值', '单位')
+
+def export_summary_rows(args):
+    """导出文件中的统计部分：筛选条件和与 /api/statistics 相同的统计值"""
+    statistics = record_statistics(args)
+    rows = [EXPORT_SUMMARY_HEADER]
+    rows += [(f'筛选条件：{label}', args[field], '') for field, label in RECORD_EXPORT_FILTERS if args.get(field)]
+    rows += [
+        ('合计实际数量', statistics['total_actual_qty'], '件'),
+        ('平均产能稼动率', statistics['avg_capacity_rate'], '%'),
+        ('平均时间稼动率', statistics['avg_time_rate'], '%'),
+        ('总记录数', statistics['total_records'], '条'),
+        ('导出时间(UTC)', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), ''),
+    ]
+    return rows
+
+def format_export_timestamp(value):
+    return value.isoformat(' ', 'seconds') if value else ''
+
+def export_csv_formatter(field):
+    """CSV 列的格式化函数，结果与 /api/records 相同；文本、整数和日期列由 csv 模块直接输出（None 为空），返回 None"""
+    if field in ('created_at', 'updated_at'):
+        return format_export_timestamp
+    if field in DECIMAL_FIELDS or field in RATE_FIELDS:
+        return functools.partial(format_record_value, field)
+    return None
+
+def export_records_csv(rows, summary):
+    """逐批生成 CSV：带 BOM 以便 Excel 识别 UTF-8，记录之后空一行接统计部分"""
+    formatters = [(index, export_csv_formatter(field)) for index, (field, _) in enumerate(RECORD_EXPORT_COLUMNS)]
+    formatters = [(index, formatter) for index, formatter in formatters if formatter]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([label for _, label in RECORD_EXPORT_COLUMNS])
+    for row in rows:
+        row = list(row)
+        for index, formatter in formatters:
+            row[index] = formatter(row[index])
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    writer.writerow([])
+    writer.writerows(summary)
+    yield buffer.getvalue().encode('utf-8')
+
+class _ChunkBuffer:
+    """只能追加写入的缓冲区。zipfile 在不能 seek 的文件上改用数据描述符，压缩好的数据随写随取"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+# XLSX 每个工作表最多 1048576 行（含表头），超出时续写到下一个工作表
+XLSX_MAX_ROWS = 1048576
+XLSX_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+# 单元格样式序号，对应 _xlsx_styles 中 cellXfs 的顺序
+XLSX_DATE_STYLE, XLSX_DATETIME_STYLE, XLSX_PERCENT_STYLE = 1, 2, 3
+XLSX_EPOCH = datetime(1899, 12, 30)
+_XLSX_ILLEGAL_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_XLSX_SPECIAL_CHARACTERS = re.compile('[&<>\x00-\x08\x0b\x0c\x0e-\x1f]')
+# 单元格引用的列字母，导出的工作表都不超过 26 列
+XLSX_COLUMN_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def _xlsx_text(value):
+    return escape(_XLSX_ILLEGAL_CHARACTERS.sub('', value))
+
+def _xlsx_text_cell(ref, value):
+    """文本单元格，用内联字符串（无需共享字符串表，可以流式写出）"""
+    if not value:
+        return ''
+    if _XLSX_SPECIAL_CHARACTERS.search(value):
+        value = _xlsx_text(value)
+    return f'<c r="{ref}" t="inlineStr"><is><t>{value}</t></is></c>'
+
+def _xlsx_number_cell(ref, value, style=0):
+    if isinstance(value, str):
+        # 迁移完成前旧表中仍是文本
+        value = parse_number(value)
+    if value is None:
+        return ''
+    style_attribute = f' s="{style}"' if style else ''
+    return f'<c r="{ref}"{style_attribute}><v>{value}</v></c>'
+
+def _xlsx_date_cell(ref, value):
+    """日期和时间转为 Excel 序列号（1899-12-30 起的天数）并设置显示格式"""
+    if isinstance(value, str):
+        value = parse_date(value)
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return _xlsx_number_cell(ref, (value - XLSX_EPOCH).total_seconds() / 86400, XLSX_DATETIME_STYLE)
+    return _xlsx_number_cell(ref, (value - XLSX_EPOCH.date()).days, XLSX_DATE_STYLE)
+
+def _xlsx_cell(ref, value):
+    """按值的类型生成单元格，用于表头和统计数据"""
+    if isinstance(value, str):
+        return _xlsx_text_cell(ref, value)
+    if isinstance(value, date):
+        return _xlsx_date_cell(ref, value)
+    return _xlsx_number_cell(ref, value)
+
+def _xlsx_cell_writer(field):
+    """记录列的单元格生成函数，按列类型预先选定，不必逐个单元格判断类型"""
+    if field in ('date', 'created_at', 'updated_at'):
+        return _xlsx_date_cell
+    if field in RATE_FIELDS:
+        return functools.partial(_xlsx_number_cell, style=XLSX_PERCENT_STYLE)
+    if field in INTEGER_FIELDS or field in DECIMAL_FIELDS:
+        return _xlsx_number_cell
+    return _xlsx_text_cell
+
+def _xlsx_row(number, values, writers=None):
+    writers = writers or itertools.repeat(_xlsx_cell)
+    cells = ''.join([writer(f'{letter}{number}', value)
+                     for writer, letter, value in zip(writers, XLSX_COLUMN_LETTERS, values)])
+    return f'<row r="{number}">{cells}</row>'
+
+def _xlsx_sheet_start(columns):
+    return (f'{XLSX_XML_HEADER}<worksheet xmlns="{XLSX_NAMESPACE}">'
+            f'<cols><col min="1" max="{columns}" width="16" customWidth="1"/></cols><sheetData>')
+
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+def _xlsx_styles():
+    # 比率列保存的是百分数数值（97.83），格式中的 % 是字面字符，不再乘 100
+    return (f'{XLSX_XML_HEADER}<styleSheet xmlns="{XLSX_NAMESPACE}">'
+            '<numFmts count="3"><numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+            '<numFmt numFmtId="165" formatCode="yyyy-mm-dd hh:mm:ss"/>'
+            '<numFmt numFmtId="166" formatCode="0.00&quot;%&quot;"/></numFmts>'
+            '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+            '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+            '<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>')
+
+def _xlsx_package_parts(sheet_names):
+    """工作簿、关系和内容类型，工作表全部写完、数量确定后最后写入"""
+    count = len(sheet_names)
+    sheets = ''.join(f'<sheet name="{_xlsx_text(name)}" sheetId="{index}" r:id="rId{index}"/>'
+                     for index, name in enumerate(sheet_names, 1))
+    sheet_relationships = ''.join(
+        f'<Relationship Id="rId{index}" Type="{XLSX_RELATIONSHIPS}/worksheet" Target="worksheets/sheet{index}.xml"/>'
+        for index in range(1, count + 1))
+    sheet_types = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for index in range(1, count + 1))
+    return {
+        'xl/workbook.xml': (f'{XLSX_XML_HEADER}<workbook xmlns="{XLSX_NAMESPACE}" xmlns:r="{XLSX_RELATIONSHIPS}">'
+                            f'<sheets>{sheets}</sheets></workbook>'),
+        'xl/styles.xml': _xlsx_styles(),
+        'xl/_rels/workbook.xml.rels': (
+            f'{XLSX_XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{sheet_relationships}<Relationship Id="rId{count + 1}" Type="{XLSX_RELATIONSHIPS}/styles" '
+            'Target="styles.xml"/></Relationships>'),
+        '_rels/.rels': (
+            f'{XLSX_XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{XLSX_RELATIONSHIPS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'),
+        '[Content_Types].xml': (
+            f'{XLSX_XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{sheet_types}</Types>'),
+    }
+
+def export_records_xlsx(rows, summary):
+    """逐批生成 XLSX（不依赖第三方库）：记录写入“产量记录”工作表，超过单表行数上限时续写到
+    “产量记录(2)”等，最后是“统计数据”工作表。压缩后的数据每攒够 EXPORT_CHUNK_BYTES 发送一次"""
+    buffer = _ChunkBuffer()
+    # 压缩级别 1：文件约大三成，生成耗时约少三分之一
+    archive = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+    header = [label for _, label in RECORD_EXPORT_COLUMNS]
+    writers = [_xlsx_cell_writer(field) for field, _ in RECORD_EXPORT_COLUMNS]
+    sheet_names = []
+    part = None
+    number = XLSX_MAX_ROWS
+    pending = []
+
+    def open_sheet(name, columns):
+        sheet_names.append(name)
+        sheet = archive.open(f'xl/worksheets/sheet{len(sheet_names)}.xml', 'w')
+        sheet.write(_xlsx_sheet_start(columns).encode('utf-8'))
+        return sheet
+
+    def close_sheet(sheet):
+        sheet.write((''.join(pending) + XLSX_SHEET_END).encode('utf-8'))
+        pending.clear()
+        sheet.close()
+
+    for row in rows:
+        if number == XLSX_MAX_ROWS:
+            if part is not None:
+                close_sheet(part)
+            part = open_sheet('产量记录' if part is None else f'产量记录({len(sheet_names) + 1})', len(header))
+            pending.append(_xlsx_row(1, header))
+            number = 1
+        number += 1
+        pending.append(_xlsx_row(number, row, writers))
+        if len(pending) >= 1000:
+            part.write(''.join(pending).encode('utf-8'))
+            pending.clear()
+            if buffer.size >= EXPORT_CHUNK_BYTES:
+                yield buffer.take()
+    if part is None:
+        part = open_sheet('产量记录', len(header))
+        pending.append(_xlsx_row(1, header))
+    close_sheet(part)
+
+    summary_sheet = open_sheet('统计数据', 3)
+    pending.extend(_xlsx_row(index, values) for index, values in enumerate(summary, 1))
+    close_sheet(summary_sheet)
+    for name, content in _xlsx_package_parts(sheet_names).items():
+        archive.writestr(name, content)
+    archive.close()
+    yield buffer.take()
+
+EXPORT_FORMATS = {
+    'csv': (export_records_csv, 'text/csv'),
+    'xlsx': (export_records_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/api/records/export')
+def export_records():
+    """按与 /api/records 相同的筛选条件导出记录和统计，format=csv 或 xlsx（默认）。
+
+    记录按 (date, id) 倒序从服务端游标分批读取，边读边生成文件发送，内存占用与记录数无关。
+    """
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'format 应为 csv 或 xlsx'}), 400
+    generate, mimetype = EXPORT_FORMATS[export_format]
+    summary = export_summary_rows(request.args)
+    query = filter_records(ProductionRecord.query, request.args).order_by(*RECORD_ORDER).with_entities(
+        *(getattr(ProductionRecord, field) for field, _ in RECORD_EXPORT_COLUMNS))
+    rows = query.yield_per(app.config['RECORDS_STREAM_BATCH'])
+    filename = f"产量记录_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(generate(rows, summary)), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename=records.{export_format}; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+# 导入：每批插入的记录数，每批与导入进度在同一事务中提交。批次越大索引和汇总表的页面重复写入越少，
+# 但写事务占用时间越长（SQLite 上 2 万条约 1 秒，其他写请求在 busy_timeout 内等待）
+IMPORT_BATCH_SIZE = 20000
+# 结果中最多列出的出错行数（失败总数不受限制）
+IMPORT_MAX_ERRORS = 100
+# 可以识别的表头：字段名、导出文件和页面表格的列名、桌面版旧 CSV 的 item 列（产品规格）、旧版网页导出的列名。
+# 比较时忽略大小写和末尾括号中的单位，如“单重(g)”与“单重”相同
+IMPORT_UNIT_SUFFIX = re.compile(r'\s*[(（][^()（）]*[)）]$')
+
+def import_column_key(name):
+    return IMPORT_UNIT_SUFFIX.sub('', name.strip()).lower()
+
+IMPORT_COLUMNS = {import_column_key(field): field for field in RECORD_FIELDS}
+IMPORT_COLUMNS.update((import_column_key(label), field) for field, label in RECORD_EXPORT_COLUMNS)
+IMPORT_COLUMNS.update({
+    'item': 'item', '单件时间': 'single_time', '总重量': 'total_weight', '皮重': 'tare_weight',
+    '停机时长': 'downtime_duration', '调机时间': 'adjustment_time',
+})
+# 从文件读取的字段；派生字段按当前公式和班次设置重新计算，文件中的值不使用。
+# 实际数量例外：未填写单重、无法按重量计算时保留文件中的值，与桌面版保留手工填写的实际数量相同
+IMPORT_INPUT_FIELDS = tuple(field for field in RECORD_FIELDS if field not in DERIVED_FIELDS) + ('actual_qty',)
+IMPORT_NUMBER_FIELDS = frozenset(INTEGER_FIELDS + DECIMAL_FIELDS).intersection(IMPORT_INPUT_FIELDS)
+IMPORT_FIELD_LABELS = dict(RECORD_EXPORT_COLUMNS)
+
+def iter_csv_rows(file):
+    """逐行读取 CSV。UTF-8（可带 BOM）；开头不是有效 UTF-8 时按 GB18030 读取（中文版 Excel 另存的 CSV）"""
+    head = file.read(64 * 1024)
+    file.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'gb18030'
+    yield from csv.reader(io.TextIOWrapper(file, encoding=encoding, newline=''))
+
+@functools.lru_cache(maxsize=None)
+def _xlsx_column_index(letters):
+    """列字母（如 AB）的列序号，从 0 开始"""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+def _xlsx_part(archive, name):
+    """压缩包中的文件内容；不存在时抛出 ValueError（zipfile 抛出的是 KeyError）"""
+    if name not in archive.namelist():
+        raise ValueError(f'XLSX 文件中缺少 {name}')
+    return archive.read(name)
+
+def _xlsx_first_sheet(archive):
+    """第一个工作表在压缩包中的路径"""
+    namespace = f'{{{XLSX_NAMESPACE}}}'
+    workbook = ElementTree.fromstring(_xlsx_part(archive, 'xl/workbook.xml'))
+    sheet = workbook.find(f'{namespace}sheets/{namespace}sheet')
+    if sheet is not None:
+        relationship_id = sheet.get(f'{{{XLSX_RELATIONSHIPS}}}id')
+        for relationship in ElementTree.fromstring(_xlsx_part(archive, 'xl/_rels/workbook.xml.rels')):
+            if relationship.get('Id') == relationship_id:
+                target = relationship.get('Target')
+                path = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+                if path in archive.namelist():
+                    return path
+    raise ValueError('XLSX 文件中找不到工作表')
+
+class _XlsxSheetReader:
+    """XMLParser 的 target：按解析到的标签直接拼出各行的值，不建立元素树；读完的行放在 rows 中等待取走"""
+
+    ROW, CELL = f'{{{XLSX_NAMESPACE}}}row', f'{{{XLSX_NAMESPACE}}}c'
+    # 单元格的值在 <v> 中，内联文本在 <is> 下的一个或多个 <t> 中
+    TEXT = frozenset((f'{{{XLSX_NAMESPACE}}}v', f'{{{XLSX_NAMESPACE}}}t'))
+
+    def __init__(self, shared_strings):
+        self.shared_strings = shared_strings
+        self.rows = []
+        self.row = []
+        self.kind = None
+        self.text = []
+        self.reading = False
+
+    def start(self, tag, attrs):
+        if tag == self.CELL:
+            ref = attrs.get('r')
+            index = _xlsx_column_index(ref.rstrip('0123456789')) if ref else len(self.row)
+            if index > len(self.row):
+                self.row.extend([None] * (index - len(self.row)))
+            self.kind = attrs.get('t')
+            self.text.clear()
+        elif tag in self.TEXT:
+            self.reading = True
+        elif tag == self.ROW:
+            self.row = []
+
+    def data(self, data):
+        if self.reading:
+            self.text.append(data)
+
+    def end(self, tag):
+        if tag in self.TEXT:
+            self.reading = False
+        elif tag == self.CELL:
+            self.row.append(self.value(''.join(self.text)))
+        elif tag == self.ROW:
+            self.rows.append(self.row)
+
+    def value(self, text):
+        kind = self.kind
+        if kind == 'inlineStr':
+            return text
+        # 未计算的公式没有值；错误值（#N/A 等）按空值处理
+        if not text or kind == 'e':
+            return None
+        if kind == 's':
+            try:
+                return self.shared_strings[int(text)]
+            except IndexError:
+                raise ValueError(f'XLSX 文件中的共享字符串序号 {text} 无效') from None
+        if kind == 'd':
+            return text[:10]
+        if kind in ('str', 'b'):
+            return text
+        return float(text)
+
+    def close(self):
+        pass
+
+def iter_xlsx_rows(file):
+    """逐行读取 XLSX 的第一个工作表（不依赖第三方库），单元格文本为 str、数值为 float，空单元格为 None。
+
+    工作表分块增量解析，读完的行随即交出；共享字符串表（只含不重复的文本）整体读入。
+    """
+    namespace = f'{{{XLSX_NAMESPACE}}}'
+    with zipfile.ZipFile(file) as archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            for _, element in ElementTree.iterparse(archive.open('xl/sharedStrings.xml')):
+                if element.tag == f'{namespace}si':
+                    # 纯文本在 <t> 中，带格式的文本分段在 <r><t> 中；不取注音（<rPh>）
+                    runs = element.findall(f'{namespace}t') + element.findall(f'{namespace}r/{namespace}t')
+                    shared_strings.append(''.join(run.text or '' for run in runs))
+                    element.clear()
+        reader = _XlsxSheetReader(shared_strings)
+        parser = ElementTree.XMLParser(target=reader)
+        with archive.open(_xlsx_first_sheet(archive)) as sheet:
+            for chunk in iter(functools.partial(sheet.read, EXPORT_CHUNK_BYTES), b''):
+                parser.feed(chunk)
+                yield from reader.rows
+                reader.rows.clear()
+        parser.close()
+        yield from reader.rows
+
+IMPORT_READERS = {'csv': iter_csv_rows, 'xlsx': iter_xlsx_rows}
+
+# 各输入字段为空时的取值，与 parse_record_value 对空值的结果相同
+IMPORT_EMPTY_VALUES = {field: parse_record_value(field, '') for field in IMPORT_INPUT_FIELDS}
+
+@functools.lru_cache(maxsize=4096)
+def import_date(value):
+    """导入文件中的日期：文本按 parse_date 解析，XLSX 中的数值为 1899-12-30 起的天数，无效时为 None。
+    同一日期在文件中反复出现，结果缓存"""
+    if isinstance(value, float):
+        return (XLSX_EPOCH + timedelta(days=value)).date()
+    return parse_date(value)
+
+def import_number(value):
+    """导入文件中的数值（兼容 '97.83%'），空白为 None，无效时抛出 ValueError"""
+    if isinstance(value, float):
+        return value
+    text = value.strip().rstrip('%').strip()
+    return float(text) if text else None
+
+def import_text(value):
+    # XLSX 中数字形式的文本，如产品规格 12312
+    return format_number(value) if isinstance(value, float) else value.strip()
+
+def import_record_values(row, columns):
+    """把导入文件中的一行转换为记录的输入字段，columns 为 (列序号, 字段) 列表。
+    返回 (values, 错误信息)；整行为空时两者都为 None"""
+    values = dict(IMPORT_EMPTY_VALUES)
+    item = None
+    blank = True
+    for index, field in columns:
+        value = row[index] if index < len(row) else None
+        if value is None or value == '':
+            continue
+        blank = False
+        if field in IMPORT_NUMBER_FIELDS:
+            try:
+                number = import_number(value)
+            except ValueError:
+                return None, f'{IMPORT_FIELD_LABELS[field]}不是有效数字：{value.strip()}'
+            values[field] = int(round(number)) if number is not None and field in INTEGER_FIELDS else number
+        elif field == 'date':
+            values['date'] = import_date(value.strip() if isinstance(value, str) else value)
+        elif field == 'item':
+            item = import_text(value)
+        else:
+            values[field] = import_text(value)
+    if blank:
+        return None, None
+    if values['date'] is None:
+        return None, '日期格式无效，应为 YYYY-MM-DD'
+    if not values['product'] and item:
+        values['product'] = item
+    return values, None
+
+@serialized_write
+def write_import_batch(import_id, rows, consumed, failed, completed=False):
+    """插入一批导入的记录并推进导入进度，在同一事务中提交；SQLite 写锁等待超时时整批重试"""
+    if rows:
+        # 表级 insert：ORM 批量插入会按各行为空的列把一批拆成许多条语句，表级 insert 整批一次 executemany
+        db.session.execute(sa.insert(ProductionRecord.__table__), rows, execution_options={'added_records': rows})
+        # 大批量导入只通知条数，客户端收到事件后按增量同步拉取
+        publish_change('record', 'upsert', imported=len(rows))
+    db.session.execute(sa.update(RecordImport).where(RecordImport.id == import_id).values(
+        rows_done=RecordImport.rows_done + consumed,
+        imported=RecordImport.imported + len(rows),
+        failed=RecordImport.failed + failed,
+        completed=completed,
+        updated_at=datetime.utcnow(),
+    ))
+    db.session.commit()
+
+class RecordImporter:
+    """把 CSV/XLSX 文件流式导入生产记录。
+
+    文件逐行读取，每 batch_size 行计算派生字段并插入一批，与导入进度一起提交。进度按文件内容的
+    SHA-256 保存在 record_import 表中：中断后再次导入同一文件时跳过已处理的行继续，
+    已完整导入的文件不会重复导入（restart 为 True 时从头重新导入）。
+    文件格式或表头有问题时 run 抛出 ValueError。
+    """
+
+    def __init__(self, file, filename, file_format=None, batch_size=IMPORT_BATCH_SIZE, restart=False):
+        file_format = (file_format or os.path.splitext(filename)[1].lstrip('.')).lower()
+        if file_format not in IMPORT_READERS:
+            raise ValueError('文件格式应为 csv 或 xlsx')
+        self.file = file
+        self.filename = filename
+        self.read_rows = IMPORT_READERS[file_format]
+        self.batch_size = batch_size
+        self.restart = restart
+        self.errors = []
+        self.failed = 0
+        self.imported = 0
+        self.ignored_columns = []
+        self.progress = None
+        self.resumed_from = 0
+        self.already_imported = False
+
+    def file_hash(self):
+        digest = hashlib.sha256()
+        for block in iter(functools.partial(self.file.read, 1024 * 1024), b''):
+            digest.update(block)
+        self.file.seek(0)
+        return digest.hexdigest()
+
+    def start(self):
+        """取得或建立本文件的导入进度，返回需要跳过的数据行数"""
+        file_hash = self.file_hash()
+        progress = RecordImport.query.filter_by(file_hash=file_hash).first()
+        if progress is None:
+            progress = RecordImport(file_hash=file_hash, filename=self.filename[:255])
+            db.session.add(progress)
+        elif self.restart:
+            progress.rows_done = progress.imported = progress.failed = 0
+            progress.completed = False
+        elif progress.completed:
+            self.already_imported = True
+        db.session.commit()
+        self.progress = progress
+        return progress.rows_done
+
+    def map_columns(self, header):
+        """表头中要读取的列，返回 (列序号, 字段) 列表；缺少日期列时抛出 ValueError。
+        派生字段（实际数量除外）和创建/更新时间列不读取，不认识的列记入 ignored_columns"""
+        columns = []
+        for index, name in enumerate(header):
+            name = '' if name is None else str(name).strip()
+            field = IMPORT_COLUMNS.get(import_column_key(name))
+            if field is None and name:
+                self.ignored_columns.append(name)
+            if field in IMPORT_INPUT_FIELDS or field == 'item':
+                columns.append((index, field))
+        if 'date' not in dict(columns).values():
+            raise ValueError('表头中没有日期列（date 或 日期）')
+        return columns
+
+    def run(self):
+        """逐批导入，每提交一批产出一次 (已处理行数, 已导入条数, 失败行数)"""
+        skip = self.start()
+        if self.already_imported:
+            return
+        self.resumed_from = skip
+        rows = self.read_rows(self.file)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError('文件为空')
+        columns = self.map_columns(header)
+        calendar = shift_calendar()
+        shift_minutes = {}
+        batch, consumed, failed = [], 0, 0
+        # 表头为第 1 行
+        for number, row in enumerate(itertools.islice(rows, skip, None), skip + 2):
+            if tuple(row[:3]) == EXPORT_SUMMARY_HEADER:
+                break
+            consumed += 1
+            values, error = import_record_values(row, columns)
+            if values is None and error is None:
+                continue
+            if error:
+                failed += 1
+                if len(self.errors) < IMPORT_MAX_ERRORS:
+                    self.errors.append({'row': number, 'message': error})
+                continue
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                self.write(batch, consumed, failed, calendar, shift_minutes)
+                batch, consumed, failed = [], 0, 0
+                yield self.progress.rows_done, self.imported, self.failed
+        self.write(batch, consumed, failed, calendar, shift_minutes, completed=True)
+        yield self.progress.rows_done, self.imported, self.failed
+
+    def write(self, batch, consumed, failed, calendar, shift_minutes, completed=False):
+        minutes = []
+        for values in batch:
+            key = (values['date'], values['process'])
+            if key not in shift_minutes:
+                shift_minutes[key] = calendar.minutes(*key)
+            minutes.append(shift_minutes[key])
+        derived = derive_fields_batch({field: [values[field] for values in batch] for field in DERIVATION_INPUT_FIELDS},
+                                      minutes)
+        for values, row in zip(batch, zip(*derived.values())):
+            actual_qty = values['actual_qty']
+            values.update(zip(derived, row))
+            keep_actual_qty(values, actual_qty)
+        write_import_batch(self.progress.id, batch, consumed, failed, completed)
+        db.session.refresh(self.progress)
+        self.imported += len(batch)
+        self.failed += failed
+
+    def result(self):
+        progress = self.progress
+        return {
+            'success': True,
+            'import_id': progress.id,
+            'already_imported': self.already_imported,
+            'resumed_from_row': self.resumed_from + 2 if self.resumed_from else None,
+            'rows': progress.rows_done,
+            'imported': self.imported,
+            'failed': self.failed,
+            'total_imported': progress.imported,
+            'total_failed': progress.failed,
+            'errors': self.errors,
+            'ignored_columns': self.ignored_columns,
+        }
+
+# 文件损坏或不是所声明的格式时读取抛出的异常（UnicodeDecodeError 是 ValueError 的子类，须先于 ValueError 捕获）；
+# XLSX 中缺少的部件和无效的引用由读取函数抛出 ValueError
+IMPORT_READ_ERRORS = (csv.Error, UnicodeDecodeError, zipfile.BadZipFile, ElementTree.ParseError)
+
+@app.route('/api/records/import', methods=['POST'])
+def import_records_upload():
+    """上传 CSV 或 XLSX 文件（multipart 字段 file）批量导入记录，格式按扩展名或 format 参数判断。
+
+    表头可以是字段名或页面上的列名；派生字段按当前班次设置重新计算。每 IMPORT_BATCH_SIZE 行提交一次，
+    中断后重新上传同一文件会从中断处继续；restart=1 时重新导入已导入过的文件。
+    返回导入和失败的行数，以及前 IMPORT_MAX_ERRORS 个出错行的行号和原因。
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'message': '请上传文件（字段 file）'}), 400
+    try:
+        importer = RecordImporter(upload.stream, upload.filename, request.form.get('format'),
+                                  restart=request.form.get('restart') in ('1', 'true'))
+        for _ in importer.run():
+            pass
+    except IMPORT_READ_ERRORS as exc:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'无法读取文件：{exc}'}), 400
+    except ValueError as exc:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(exc)}), 400
+    return jsonify(importer.result())
+
 @app.route('/api/production-plans')
+@conditional_by_generation('production_plan', 'production_plan_step', 'production_record')
 def get_production_plans():
-    """获取所有产量计划"""
-    plans = ProductionPlan.query.all()
+    """获取产量计划，可用 ?product= 只取单个产品的计划"""
+    plans_query = ProductionPlan.query.options(db.selectinload(ProductionPlan.steps))
+    product = request.args.get('product')
+    if product:
+        plans_query = plans_query.filter(ProductionPlan.product == product)
+    plans = plans_query.all()
+    
+    # 一次分组查询取得计划涉及的所有 (产品, 工序) 实际产量，避免逐个工序查询
+    completed_qty = plan_completed_quantities(product)
+    
     result = []
     for plan in plans:
         # 计算每个工序的完成率
         process_completion = {}
-        
-        # 工序1
-        if plan.process1 and plan.qty1 > 0:
-            actual_qty = db.session.query(db.func.sum(ProductionRecord.actual_qty)).filter(
-                ProductionRecord.product == plan.product,
-                ProductionRecord.process == plan.process1
-            ).scalar() or 0
-            completion_rate = (actual_qty / plan.qty1) * 100 if plan.qty1 > 0 else 0
-            process_completion[plan.process1] = {
-                'planned_qty': plan.qty1,
-                'actual_qty': actual_qty,
-                'completion_rate': round(completion_rate, 1)
-            }
-        
-        # 工序2
-        if plan.process2 and plan.qty2 > 0:
-            actual_qty = db.session.query(db.func.sum(ProductionRecord.actual_qty)).filter(
-                ProductionRecord.product == plan.product,
-                ProductionRecord.process == plan.process2
-            ).scalar() or 0
-            completion_rate = (actual_qty / plan.qty2) * 100 if plan.qty2 > 0 else 0
-            process_completion[plan.process2] = {
-                'planned_qty': plan.qty2,
-                'actual_qty': actual_qty,
-                'completion_rate': round(completion_rate, 1)
-            }
-        
-        # 工序3
-        if plan.process3 and plan.qty3 > 0:
-            actual_qty = db.session.query(db.func.sum(ProductionRecord.actual_qty)).filter(
-                ProductionRecord.product == plan.product,
-                ProductionRecord.process == plan.process3
-            ).scalar() or 0
-            completion_rate = (actual_qty / plan.qty3) * 100 if plan.qty3 > 0 else 0
-            process_completion[plan.process3] = {
-                'planned_qty': plan.qty3,
-                'actual_qty': actual_qty,
-                'completion_rate': round(completion_rate, 1)
-            }
-        
-        # 工序4
-        if plan.process4 and plan.qty4 > 0:
-            actual_qty = db.session.query(db.func.sum(ProductionRecord.actual_qty)).filter(
-                ProductionRecord.product == plan.product,
-                ProductionRecord.process == plan.process4
-            ).scalar() or 0
-            completion_rate = (actual_qty / plan.qty4) * 100 if plan.qty4 > 0 else 0
-            process_completion[plan.process4] = {
-                'planned_qty': plan.qty4,
-                'actual_qty': actual_qty,
-                'completion_rate': round(completion_rate, 1)
-            }
+        for step in plan.steps:
+            if step.qty and step.qty > 0:
+                actual_qty = completed_qty.get((plan.product, step.process), 0)
+                completion_rate = (actual_qty / step.qty) * 100
+                process_completion[step.process] = {
+                    'planned_qty': step.qty,
+                    'actual_qty': actual_qty,
+                    'completion_rate': round(completion_rate, 1)
+                }
         
         result.append({
             'id': plan.id,
             'product': plan.product,
-            'process1': plan.process1,
-            'qty1': plan.qty1,
-            'process2': plan.process2,
-            'qty2': plan.qty2,
-            'process3': plan.process3,
-            'qty3': plan.qty3,
-            'process4': plan.process4,
-            'qty4': plan.qty4,
+            'steps': [{'process': step.process, 'qty': step.qty or 0} for step in plan.steps],
             'process_completion': process_completion,
             'created_at': plan.created_at.isoformat() if plan.created_at else None,
             'updated_at': plan.updated_at.isoformat() if plan.updated_at else None
         })
-    return jsonify(result)
+    return api_response(result)
+
+def plan_completion_query(product=None):
+    """按 (产品, 工序) 汇总实际产量，只统计有产量计划的产品（读汇总表）"""
+    rollup = RecordDailyRollup
+    query = db.session.query(
+        rollup.product,
+        rollup.process,
+        db.func.sum(rollup.actual_qty_sum)
+    )
+    if product:
+        query = query.filter(rollup.product == product)
+    else:
+        query = query.filter(rollup.product.in_(db.session.query(ProductionPlan.product)))
+    return query.group_by(rollup.product, rollup.process)
+
+def plan_completed_quantities(product=None):
+    """{(产品, 工序): 实际产量合计}"""
+    columns = record_columns.current()
+    if columns:
+        products = [product] if product else db.session.scalars(sa.select(ProductionPlan.product).distinct())
+        return columns.plan_completion(products)
+    return {(row_product, row_process): qty or 0
+            for row_product, row_process, qty in plan_completion_query(product)}
+
+def parse_plan_steps(data):
+    """读取提交的工序列表：steps=[{process, qty}]，兼容旧的 process1/qty1... 字段"""
+    if 'steps' in data:
+        raw_steps = [(step.get('process'), step.get('qty')) for step in data['steps']]
+    else:
+        raw_steps = []
+        slot = 1
+        while f'process{slot}' in data:
+            raw_steps.append((data[f'process{slot}'], data.get(f'qty{slot}')))
+            slot += 1
+    steps = []
+    for process, qty in raw_steps:
+        process = (process or '').strip()
+        if process:
+            qty = parse_number(qty)
+            steps.append((process, int(qty) if qty else 0))
+    return steps
 
 @app.route('/api/production-plans', methods=['POST'])
+@serialized_write
 def save_production_plan():
     """保存产量计划"""
     data = request.json
+    steps = parse_plan_steps(data)
     
     # 检查是否已存在相同产品的计划
-    existing_plan = ProductionPlan.query.filter_by(product=data['product']).first()
-    
-    if existing_plan:
-        # 更新现有计划
-        existing_plan.process1 = data.get('process1', '')
-        existing_plan.qty1 = data.get('qty1', 0)
-        existing_plan.process2 = data.get('process2', '')
-        existing_plan.qty2 = data.get('qty2', 0)
-        existing_plan.process3 = data.get('process3', '')
-        existing_plan.qty3 = data.get('qty3', 0)
-        existing_plan.process4 = data.get('process4', '')
-        existing_plan.qty4 = data.get('qty4', 0)
-        existing_plan.updated_at = datetime.utcnow()
+    plan = ProductionPlan.query.filter_by(product=data['product']).first()
+    
+    if plan:
+        # 更新现有计划：先删除旧工序再写入，避免同一 position 新旧并存
+        plan.steps.clear()
+        db.session.flush()
+        plan.updated_at = datetime.utcnow()
     else:
         # 创建新计划
-        plan = ProductionPlan(
-            product=data['product'],
-            process1=data.get('process1', ''),
-            qty1=data.get('qty1', 0),
-            process2=data.get('process2', ''),
-            qty2=data.get('qty2', 0),
-            process3=data.get('process3', ''),
-            qty3=data.get('qty3', 0),
-            process4=data.get('process4', ''),
-            qty4=data.get('qty4', 0)
-        )
+        plan = ProductionPlan(product=data['product'])
         db.session.add(plan)
     
+    plan.steps.extend(
+        ProductionPlanStep(position=position, process=process, qty=qty)
+        for position, (process, qty) in enumerate(steps, start=1)
+    )
+    db.session.flush()
+    publish_change('plan', 'upsert', id=plan.id, product=plan.product)
     db.session.commit()
     return jsonify({'success': True})
 
 @app.route('/api/production-plans/<int:plan_id>', methods=['DELETE'])
+@serialized_write
 def delete_production_plan(plan_id):
     """删除产量计划"""
     plan = ProductionPlan.query.get_or_404(plan_id)
     db.session.delete(plan)
+    publish_change('plan', 'delete', id=plan.id, product=plan.product)
     db.session.commit()
     return jsonify({'success': True})
 
 # 工序管理API
 @app.route('/api/processes')
+@conditional_by_generation('process')
 def get_processes():
     """获取所有工序"""
-    processes = Process.query.order_by(Process.name).all()
-    result = []
-    for process in processes:
-        result.append({
-            'id': process.id,
-            'name': process.name,
-            'description': process.description,
-            'created_at': process.created_at.isoformat() if process.created_at else None
-        })
-    return jsonify(result)
+    return master_data['process'].response()
 
 @app.route('/api/processes', methods=['POST'])
+@serialized_write
 def add_process():
     """添加工序"""
     data = request.json
@@ -564,25 +2894,19 @@ def add_process():
     return jsonify({'success': True, 'message': '工序添加成功'})
 
 @app.route('/api/processes/<int:process_id>', methods=['DELETE'])
+@serialized_write
 def delete_process(process_id):
     """删除工序"""
     process = Process.query.get_or_404(process_id)
     
     # 检查是否有记录使用此工序
-    records_using_process = ProductionRecord.query.filter(
-        (ProductionRecord.process == process.name)
-    ).count()
+    records_using_process = count_records_using('process', process.name)
     
     if records_using_process > 0:
         return jsonify({'success': False, 'message': f'无法删除，有 {records_using_process} 条记录正在使用此工序'}), 400
     
     # 检查是否有产量计划使用此工序
-    plans_using_process = ProductionPlan.query.filter(
-        (ProductionPlan.process1 == process.name) |
-        (ProductionPlan.process2 == process.name) |
-        (ProductionPlan.process3 == process.name) |
-        (ProductionPlan.process4 == process.name)
-    ).count()
+    plans_using_process = plans_using_process_query(process.name).scalar()
     
     if plans_using_process > 0:
         return jsonify({'success': False, 'message': f'无法删除，有 {plans_using_process} 个产量计划正在使用此工序'}), 400
@@ -594,20 +2918,13 @@ def delete_process(process_id):
 
 # 产品规格管理API
 @app.route('/api/products')
+@conditional_by_generation('product')
 def get_products():
     """获取所有产品规格"""
-    products = Product.query.all()
-    result = []
-    for product in products:
-        result.append({
-            'id': product.id,
-            'name': product.name,
-            'description': product.description,
-            'created_at': product.created_at.isoformat() if product.created_at else None
-        })
-    return jsonify(result)
+    return master_data['product'].response()
 
 @app.route('/api/products', methods=['POST'])
+@serialized_write
 def add_product():
     """添加产品规格"""
     data = request.json
@@ -634,12 +2951,13 @@ def add_product():
     })
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@serialized_write
 def delete_product(product_id):
     """删除产品规格"""
     product = Product.query.get_or_404(product_id)
     
     # 检查是否有记录使用此产品规格
-    records_using_product = ProductionRecord.query.filter_by(product=product.name).count()
+    records_using_product = count_records_using('product', product.name)
     if records_using_product > 0:
         return jsonify({'success': False, 'message': f'无法删除，有 {records_using_product} 条记录正在使用此产品规格'}), 400
     
@@ -653,10 +2971,937 @@ def delete_product(product_id):
     
     return jsonify({'success': True, 'message': '产品规格删除成功'})
 
+# 班次设置API
+@app.route('/api/shift-lengths')
+@conditional_by_generation('shift_length')
+def get_shift_lengths():
+    """获取班次分钟数设置"""
+    return master_data['shift_length'].response()
+
+@app.route('/api/shift-lengths', methods=['POST'])
+@serialized_write
+def set_shift_length():
+    """设置某工序（为空表示所有工序）从某日期（为空表示不限）起的班次分钟数，已有相同工序和日期的设置时覆盖。
+
+    只影响之后新增或修改的记录，已有记录需通过 /api/records/recalculate 或 recalculate-records 命令重新计算。
+    """
+    data = request.json or {}
+    process = str(data.get('process') or '').strip()
+    start_date = parse_date(data.get('start_date'))
+    if data.get('start_date') and start_date is None:
+        return jsonify({'success': False, 'message': '生效日期格式无效，应为 YYYY-MM-DD'}), 400
+    minutes = parse_number(data.get('minutes'))
+    if minutes is None or minutes != int(minutes) or not 0 < minutes <= 1440:
+        return jsonify({'success': False, 'message': '班次分钟数应为 1 到 1440 之间的整数'}), 400
+
+    item = ShiftLength.query.filter_by(process=process, start_date=start_date).first()
+    if item is None:
+        item = ShiftLength(process=process, start_date=start_date)
+        db.session.add(item)
+    item.minutes = int(minutes)
+    db.session.commit()
+
+    return jsonify({'success': True, 'id': item.id, 'message': '班次设置已保存'})
+
+@app.route('/api/shift-lengths/<int:item_id>', methods=['DELETE'])
+@serialized_write
+def delete_shift_length(item_id):
+    """删除班次设置"""
+    item = ShiftLength.query.get_or_404(item_id)
+    db.session.delete(item)
+    db.session.commit()
+
+    return jsonify({'success': True, 'message': '班次设置已删除'})
+
+
+# 数据库初始化与检查命令
+# 已被其他索引取代的旧索引，init-db 时删除
+OBSOLETE_INDEXES = ('ix_production_record_product_date', 'ix_production_record_product_process_qty')
+
+def drop_legacy_record_indexes(connection):
+    """删除 production_record_legacy 上的索引。SQLite 的索引名在整个库中唯一，改名后的旧表仍占着
+    ix_production_record_* 这些名称，新表无法建同名索引；旧表只作备份，不需要索引"""
+    if connection.dialect.name != 'sqlite':
+        return
+    names = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'production_record_legacy' "
+        "AND sql IS NOT NULL").scalars().all()
+    for name in names:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+
+def legacy_plan_slots(connection):
+    """旧版 production_plan 表上仍存在的 processN/qtyN 列的序号"""
+    columns = {column['name'] for column in sa.inspect(connection).get_columns('production_plan')}
+    return sorted(int(name[len('process'):]) for name in columns
+                  if name.startswith('process') and name[len('process'):].isdigit())
+
+def backfill_plan_steps(connection, legacy_slots):
+    """把旧的 processN/qtyN 列复制为还没有工序的计划的 production_plan_step 行"""
+    select_columns = ', '.join(f'process{slot}, qty{slot}' for slot in legacy_slots)
+    planned_ids = set(connection.scalars(sa.select(ProductionPlanStep.plan_id).distinct()))
+    steps = []
+    for row in connection.exec_driver_sql(f'SELECT id, {select_columns} FROM production_plan').all():
+        plan_id, values = row[0], row[1:]
+        if plan_id in planned_ids:
+            continue
+        position = 1
+        for process, qty in zip(values[0::2], values[1::2]):
+            if process:
+                steps.append({'plan_id': plan_id, 'position': position, 'process': process, 'qty': qty or 0})
+                position += 1
+    if steps:
+        connection.execute(ProductionPlanStep.__table__.insert(), steps)
+        bump_generations(connection, ['production_plan_step'])
+
+def init_database():
+    """创建缺失的表和索引（create_all 不会给已存在的表补建索引），新建的汇总表从现有记录生成；
+    旧版产量计划的工序复制到工序表（旧列由 migrate-plan-steps 删除）"""
+    rollup_exists = sa.inspect(db.engine).has_table(RecordDailyRollup.__tablename__)
+    db.create_all()
+    with db.engine.begin() as connection:
+        drop_legacy_record_indexes(connection)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        for name in OBSOLETE_INDEXES:
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+    if not rollup_exists:
+        with db.engine.begin() as connection:
+            refresh_record_rollup(connection)
+    with db.engine.begin() as connection:
+        legacy_slots = legacy_plan_slots(connection)
+        if legacy_slots:
+            # 升级后到执行 migrate-plan-steps 之前，旧计划也要显示工序
+            backfill_plan_steps(connection, legacy_slots)
+
+@app.cli.command('rebuild-record-rollup')
+def rebuild_record_rollup():
+    """从生产记录重新生成 record_daily_rollup 汇总表"""
+    with db.engine.begin() as connection:
+        refresh_record_rollup(connection)
+        bump_generations(connection, ['production_record'])
+        groups = connection.scalar(sa.select(sa.func.count()).select_from(RecordDailyRollup.__table__))
+    click.echo(f'汇总表已重建，共 {groups} 组')
+
+@app.cli.command('recalculate-records')
+@click.option('--batch-size', default=RECALCULATE_BATCH_SIZE, show_default=True, help='每批记录数，每批单独提交')
+@click.option('--cursor', help='从输出的游标之后继续（中断后使用）')
+@click.option('--start-date', help='开始日期 YYYY-MM-DD')
+@click.option('--end-date', help='结束日期 YYYY-MM-DD')
+@click.option('--product', help='产品规格')
+@click.option('--process', help='工序')
+def recalculate_records_command(batch_size, cursor, **filters):
+    """按当前班次设置重新计算生产记录的理论/实际运行时长、理论/实际数量和稼动率。
+
+    修改班次分钟数或计算公式后执行；按日期从新到旧分批处理，每批单独提交，
+    只更新结果有变化的记录，汇总表随之增量更新。
+    """
+    args = {key: value for key, value in filters.items() if value}
+    position = None
+    if cursor:
+        position = decode_record_cursor(cursor)
+        if position is None:
+            raise click.BadParameter('应为 日期_ID', param_hint='--cursor')
+    conditions = record_filter_conditions(args)
+    if position:
+        conditions.append(sa.tuple_(ProductionRecord.date, ProductionRecord.id) < position)
+    total = db.session.scalar(sa.select(sa.func.count(ProductionRecord.id)).where(*conditions))
+    calendar = shift_calendar()
+    started = time.perf_counter()
+    scanned = updated = 0
+    while True:
+        count, changed, cursor = recalculate_records(args, position, batch_size, calendar)
+        db.session.commit()
+        scanned += count
+        updated += changed
+        click.echo(f'已处理 {scanned}/{total} 条记录，更新 {updated} 条 (游标 {cursor})')
+        if count < batch_size:
+            break
+        position = decode_record_cursor(cursor)
+    seconds = time.perf_counter() - started
+    click.echo(f'重算完成，用时 {seconds:.1f} 秒 ({scanned / seconds if seconds else 0:.0f} 条/秒)')
+
+@app.cli.command('import-records')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(IMPORT_READERS)), help='文件格式，默认按扩展名判断')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='每批记录数，每批单独提交')
+@click.option('--restart', is_flag=True, help='重新导入已导入过的文件，而不是从上次中断处继续')
+def import_records_command(path, file_format, batch_size, restart):
+    """从 CSV 或 XLSX 文件批量导入生产记录（与 POST /api/records/import 相同）。
+
+    每批与导入进度一起提交；中断后对同一文件再次执行会跳过已处理的行继续导入。
+    """
+    started = time.perf_counter()
+    with open(path, 'rb') as file:
+        try:
+            importer = RecordImporter(file, os.path.basename(path), file_format, batch_size, restart)
+            for rows, imported, failed in importer.run():
+                click.echo(f'已处理 {rows} 行，导入 {imported} 条，失败 {failed} 行')
+        except IMPORT_READ_ERRORS as exc:
+            db.session.rollback()
+            raise click.ClickException(f'无法读取文件：{exc}')
+        except ValueError as exc:
+            db.session.rollback()
+            raise click.ClickException(str(exc))
+    result = importer.result()
+    if result['already_imported']:
+        click.echo(f'该文件已导入过（{result["total_imported"]} 条），如需重新导入请加 --restart')
+        return
+    if result['resumed_from_row']:
+        click.echo(f'从第 {result["resumed_from_row"]} 行继续导入')
+    for error in result['errors']:
+        click.echo(f'第 {error["row"]} 行：{error["message"]}', err=True)
+    if result['ignored_columns']:
+        click.echo(f'未识别的列已忽略：{"、".join(result["ignored_columns"])}')
+    seconds = time.perf_counter() - started
+    click.echo(f'导入完成，导入 {result["imported"]} 条，失败 {result["failed"]} 行，'
+               f'用时 {seconds:.1f} 秒 ({result["imported"] / seconds if seconds else 0:.0f} 条/秒)')
+
+@app.cli.command('init-db')
+def init_db_command():
+    """创建数据库表和索引"""
+    init_database()
+    click.echo('数据库表和索引已就绪')
+
+def explain_query_plan(query):
+    """返回查询在当前数据库上的执行计划明细（SQLite 为 EXPLAIN QUERY PLAN，PostgreSQL 为 EXPLAIN）"""
+    statement = getattr(query, 'statement', query)
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        # 小表上 PostgreSQL 本就倾向顺序扫描；禁用后仍出现 Seq Scan 说明没有可用的索引
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        return [row[0].strip() for row in connection.exec_driver_sql('EXPLAIN ' + sql)]
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).all()
+    return [row[-1] for row in rows]
+
+def _plan_problems(details, allowed_scans=()):
+    """找出全表扫描和临时排序，allowed_scans 中的表本就需要整表读取"""
+    problems = []
+    for detail in details:
+        if detail.startswith('SCAN ') and detail.split()[1] not in allowed_scans:
+            problems.append(detail)
+        elif 'Seq Scan on ' in detail and detail.split('Seq Scan on ')[1].split()[0] not in allowed_scans:
+            problems.append(detail)
+        elif 'USE TEMP B-TREE FOR ORDER BY' in detail:
+            problems.append(detail)
+    return problems
+
+def _checked_queries():
+    """各接口实际使用的查询，筛选条件取样例值"""
+    sample = {'start_date': '2025-01-01', 'end_date': '2025-01-31', 'name': '张三',
+              'product': '产品A', 'process': '工序A', 'adjustment_master': '李四'}
+    filter_keys = ('date',) + RECORD_FILTER_FIELDS
+    for size in range(1, len(filter_keys) + 1):
+        for keys in itertools.combinations(filter_keys, size):
+            args = {}
+            for key in keys:
+                if key == 'date':
+                    args['start_date'] = sample['start_date']
+                    args['end_date'] = sample['end_date']
+                else:
+                    args[key] = sample[key]
+            label = f"GET /api/records {'+'.join(keys)}"
+            yield label, record_page_query(args).limit(RECORDS_PAGE_SIZE + 1)
+            yield label + ' 翻页', record_page_query(args, (date(2025, 1, 15), 100)).limit(RECORDS_PAGE_SIZE + 1)
+            yield f"GET /api/statistics {'+'.join(keys)}", statistics_query(args)
+    yield 'POST /api/records/recalculate 分批读取', recalculation_query(
+        {}, (date(2025, 1, 15), 100), RECALCULATE_BATCH_SIZE)
+    yield 'POST /api/records/recalculate 分批读取+工序', recalculation_query(
+        {'process': sample['process']}, (date(2025, 1, 15), 100), RECALCULATE_BATCH_SIZE)
+    yield 'DELETE /api/employees 引用检查', records_using_query('name', sample['name'])
+    yield 'DELETE /api/processes 引用检查', records_using_query('process', sample['process'])
+    yield 'DELETE /api/products 引用检查', records_using_query('product', sample['product'])
+    yield 'DELETE /api/processes 计划引用检查', plans_using_process_query(sample['process'])
+    yield 'DELETE /api/products 计划引用检查', ProductionPlan.query.filter_by(product=sample['product'])
+    # 不带 product 时本就要列出全部计划，计划表的整表读取是预期的
+    yield 'GET /api/production-plans 完成量', plan_completion_query(), ('production_plan',)
+    yield 'GET /api/production-plans?product= 完成量', plan_completion_query(sample['product'])
+    yield 'GET /api/production-plans?product= 计划', ProductionPlan.query.filter(ProductionPlan.product == sample['product'])
+    yield 'GET /api/production-plans 工序', ProductionPlanStep.query.filter(
+        ProductionPlanStep.plan_id.in_([1, 2, 3])
+    ).order_by(ProductionPlanStep.plan_id, ProductionPlanStep.position)
+    yield 'GET /api/comments', Comment.query.filter_by(record_id=1, column_key='downtime_duration')
+    yield 'DELETE /api/records 注释清理', Comment.query.filter_by(record_id=1)
+    since = datetime(2025, 1, 15, 8, 0)
+    yield 'GET /api/records/changes', record_changes_query(since, sample).limit(RECORD_CHANGES_MAX + 1)
+    yield 'GET /api/records/changes 删除', sa.select(RecordTombstone.record_id).where(RecordTombstone.deleted_at >= since)
+    yield 'DELETE /api/records 墓碑清理', RecordTombstone.query.filter(RecordTombstone.deleted_at < since)
+    for field in RECORD_FILTER_FIELDS:
+        yield f'GET /api/records/facets {field}', record_facets_query(field, {}), ('production_record',)
+        yield f'GET /api/records/facets {field}+筛选', record_facets_query(field, sample)
+    # 不筛选时本就要读取整张汇总表
+    yield 'GET /api/records/groups', record_groups_query(('product', 'process'), {}), ('record_daily_rollup',)
+    yield 'GET /api/records/groups+筛选', record_groups_query(('date',), sample)
+    # 汇总表按主键删除分组，只需检查从生产记录重算的查询
+    group = rollup_group_params([(sample['product'], date(2025, 1, 15), sample['process'], sample['name'], '')])[0]
+    yield '记录写入 汇总分组重算', rollup_group_statements(db.engine.dialect.name)[1].select.params(group)
+    yield 'GET /api/events 起始事件', sa.select(sa.func.max(ChangeEvent.id))
+    yield 'GET 接口 ETag 写入代数', sa.select(TableGeneration.name, TableGeneration.generation).where(
+        TableGeneration.name.in_(['production_plan', 'production_plan_step', 'production_record']))
+    yield 'GET /api/events 新事件', ChangeEvent.query.filter(ChangeEvent.id > 100).order_by(ChangeEvent.id)
+    yield 'GET /api/events 事件清理', ChangeEvent.query.filter(ChangeEvent.created_at < since)
+
+def query_plan_results():
+    """逐个产出各接口查询的 (标签, 执行计划明细, 问题列表)，问题列表为空表示使用了索引"""
+    for label, query, *allowed_scans in _checked_queries():
+        details = explain_query_plan(query)
+        yield label, details, _plan_problems(details, *allowed_scans)
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """对各接口的查询查看执行计划（支持 SQLite 和 PostgreSQL），出现全表扫描时以非零状态退出"""
+    if db.engine.dialect.name not in ('sqlite', 'postgresql'):
+        raise click.ClickException('执行计划检查仅支持 SQLite 和 PostgreSQL')
+    failures = []
+    for label, details, problems in query_plan_results():
+        click.echo(f"{'FAIL' if problems else 'ok  '} {label}: {' | '.join(details)}")
+        if problems:
+            failures.append(label)
+    if failures:
+        raise click.ClickException(f'{len(failures)} 个查询未使用索引: ' + ', '.join(failures))
+    click.echo('所有查询均使用索引')
+
+def _best_time(func, repeat):
+    """多次执行取最短耗时（毫秒）和最后一次的结果"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+# 在 node 中计时 static/app.js 的两条解码路径：MessagePack（decodeMsgpack）和 JSON.parse，
+# 都包括 expandRecords 还原为记录对象，输出每次的最短耗时和两者结果是否一致
+CLIENT_DECODE_SCRIPT = r"""
+const fs = require('fs');
+function arrayBuffer(path) {
+    const data = fs.readFileSync(path);
+    return data.buffer.slice(data.byteOffset, data.byteOffset + data.length);
+}
+const jsonBody = arrayBuffer(process.argv[1]);
+const msgpackBody = arrayBuffer(process.argv[2]);
+const repeat = Number(process.argv[3]);
+const decodeJson = () => expandRecords(JSON.parse(new TextDecoder().decode(jsonBody)));
+const decodeBinary = () => expandRecords(decodeMsgpack(msgpackBody));
+function bestTime(func) {
+    let best = Infinity;
+    for (let i = 0; i < repeat; i++) {
+        const started = performance.now();
+        func();
+        best = Math.min(best, performance.now() - started);
+    }
+    return best;
+}
+console.log(JSON.stringify({
+    same: JSON.stringify(decodeJson()) === JSON.stringify(decodeBinary()),
+    json_ms: bestTime(decodeJson),
+    msgpack_ms: bestTime(decodeBinary)
+}));
+"""
+CLIENT_DECODE_FUNCTIONS = ('decodeMsgpack', 'expandRecords', 'expandCompactRecords')
+
+def client_decode_times(fields, rows, repeat=3):
+    """把记录分别编码为 /api/records 的紧凑 JSON 和 MessagePack，用 node 运行前端的解码函数，
+    返回 {'same', 'json_ms', 'msgpack_ms', 'json_bytes', 'msgpack_bytes'}；未安装 node 时返回 None"""
+    node = shutil.which('node')
+    if node is None:
+        return None
+    with open(os.path.join(app.static_folder, 'app.js'), encoding='utf-8') as f:
+        source = f.read()
+    functions = ''.join(re.search(rf'^function {name}\(.*?^}}\n', source, re.S | re.M).group(0)
+                        for name in CLIENT_DECODE_FUNCTIONS)
+    bodies = (encode_api_body(serialize_record_rows(fields, rows, compact=True), False),
+              encode_api_body(pack_record_rows(fields, rows), True))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ('records.json', 'records.msgpack')]
+        for path, body in zip(paths, bodies):
+            with open(path, 'wb') as f:
+                f.write(body)
+        output = subprocess.run([node, '-e', functions + CLIENT_DECODE_SCRIPT, *paths, str(repeat)],
+                                check=True, stdout=subprocess.PIPE, text=True).stdout
+    return dict(json.loads(output), json_bytes=len(bodies[0]), msgpack_bytes=len(bodies[1]))
+
+@app.cli.command('benchmark-encoding')
+@click.option('--sizes', default='1000,10000,100000', show_default=True, help='记录条数，逗号分隔')
+@click.option('--repeat', default=3, show_default=True, help='每项重复次数，取最短耗时')
+def benchmark_encoding(sizes, repeat):
+    """对 /api/records 响应测量编码耗时、各压缩算法下的传输字节数，以及前端解码耗时
+
+    用数据库中已有的记录循环填充到指定条数，输出格式与 /api/records 相同。
+    前端解码在 node 中运行 static/app.js 的函数，比较 MessagePack 与 JSON.parse（未安装 node 时跳过）。
+    """
+    fields = list(RECORD_OUTPUT_FIELDS)
+    query = record_columns_query(ProductionRecord.query.order_by(*RECORD_ORDER), fields)
+    sample_rows = query.limit(10000).all()
+    sample = serialize_record_rows(fields, sample_rows)
+    if not sample:
+        raise click.ClickException('数据库中没有记录，无法生成测试数据')
+
+    click.echo(f"JSON 编码器: {'orjson' if orjson else '标准库 json'}")
+    for size in (int(value) for value in sizes.split(',')):
+        rows = [dict(row, id=index) for index, row in zip(range(size), itertools.cycle(sample))]
+        stdlib_ms, stdlib_body = _best_time(
+            lambda: json.dumps(rows, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode(), repeat)
+        encode_ms, body = _best_time(lambda: app.json.dumps(rows).encode(), repeat)
+        click.echo(f'{size} 条: 旧编码(标准库, ASCII 转义) {stdlib_ms:.1f} ms {len(stdlib_body)} 字节; '
+                   f'当前编码 {encode_ms:.1f} ms {len(body)} 字节')
+        for encoding, compress in COMPRESSORS:
+            if not compress:
+                click.echo(f'  {encoding}: 未安装')
+                continue
+            compress_ms, compressed = _best_time(lambda: compress(body), repeat)
+            click.echo(f'  {encoding}: +{compress_ms:.1f} ms {len(compressed)} 字节')
+        # 字段顺序与 RECORD_OUTPUT_FIELDS 相同，第一列为 id
+        decoded = client_decode_times(fields, [(index, *row[1:]) for index, row in
+                                               zip(range(size), itertools.cycle(sample_rows))], repeat)
+        if decoded is None:
+            click.echo('  前端解码: 未安装 node，跳过')
+        elif not decoded['same']:
+            raise click.ClickException('前端解码 MessagePack 与 JSON 的结果不一致')
+        else:
+            click.echo(f"  前端解码(含还原记录对象): JSON.parse {decoded['json_ms']:.1f} ms {decoded['json_bytes']} 字节; "
+                       f"MessagePack {decoded['msgpack_ms']:.1f} ms {decoded['msgpack_bytes']} 字节")
+
+def _benchmark_payload(rng):
+    """并发测试用的一条随机记录（与前端提交的格式相同）"""
+    return {
+        'date': (date.today() - timedelta(days=rng.randrange(60))).isoformat(),
+        'name': f'员工{rng.randrange(20)}', 'position': '操作工',
+        'product': f'产品{rng.randrange(10)}', 'process': f'工序{rng.randrange(5)}',
+        'single_time': '10', 'adjustment_time': '20', 'downtime_duration': str(rng.randrange(60)),
+        'total_weight': str(rng.randrange(500, 2000)), 'unit_weight': '1', 'tare_weight': '0',
+        'adjustment_master': ''
+    }
+
+def _concurrency_setup(rows, batch_size=10000):
+    """benchmark-concurrency 准备阶段：建表并分批写入初始记录"""
+    rng = random.Random(0)
+    with app.app_context():
+        init_database()
+        calendar = shift_calendar()
+        for start in range(0, rows, batch_size):
+            records = []
+            for _ in range(min(batch_size, rows - start)):
+                values = {field: parse_record_value(field, value) for field, value in _benchmark_payload(rng).items()}
+                values.update(derive_fields(values, calendar.minutes(values['date'], values['process'])))
+                records.append(values)
+            db.session.execute(sa.insert(ProductionRecord), records, execution_options={'added_records': records})
+            db.session.commit()
+
+def _concurrency_worker(seconds, seed, threads):
+    """benchmark-concurrency 的一个进程：多个线程混合读写，结束时输出一行 JSON 统计"""
+    app.testing = True  # 让异常直接抛出，便于区分锁错误
+    with app.app_context():
+        record_ids = db.session.scalars(sa.select(ProductionRecord.id)).all()
+        db.session.remove()
+    stats = Counter()
+    stats_lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run(rng):
+        client = app.test_client()
+        counts = Counter()
+        while time.monotonic() < deadline:
+            choice = rng.random()
+            kind = 'reads' if choice < 0.8 else 'writes'
+            try:
+                if choice < 0.65:
+                    response = client.get('/api/records', query_string={
+                        'product': f'产品{rng.randrange(10)}', 'limit': 50})
+                elif choice < 0.75:
+                    response = client.get('/api/statistics', query_string={'process': f'工序{rng.randrange(5)}'})
+                elif choice < 0.8:
+                    # 整表导出：长时间的读
+                    response = client.get('/api/records', query_string={'start_date': '2000-01-01'})
+                elif choice < 0.88:
+                    response = client.post('/api/records', json=_benchmark_payload(rng))
+                elif choice < 0.98:
+                    response = client.put(f'/api/records/{rng.choice(record_ids)}',
+                                          json={'downtime_duration': str(rng.randrange(60))})
+                else:
+                    # 批量导入：长时间的写事务
+                    response = client.post('/api/records/batch', json={
+                        'records': [_benchmark_payload(rng) for _ in range(200)]})
+            except sa.exc.OperationalError as exc:
+                counts['locked' if is_database_locked(exc) else 'errors'] += 1
+                continue
+            counts[kind if response.status_code == 200 else 'errors'] += 1
+        with stats_lock:
+            stats.update(counts)
+
+    workers = [threading.Thread(target=run, args=(random.Random(seed * 1000 + index),)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    click.echo(json.dumps({key: stats[key] for key in ('reads', 'writes', 'locked', 'errors')}))
+
+def concurrency_totals(processes, threads, seconds, rows):
+    """在临时 SQLite 数据库上运行 benchmark-concurrency 的读写进程，返回各进程合计的
+    {'reads', 'writes', 'locked', 'errors'} 次数"""
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'benchmark.db'))
+        def run(code):
+            return subprocess.Popen([sys.executable, '-c', 'import web_app; web_app.' + code], env=env,
+                                    cwd=app.root_path, stdout=subprocess.PIPE, text=True)
+        if run(f'_concurrency_setup({rows})').wait() != 0:
+            raise click.ClickException('初始化测试数据库失败')
+        workers = [run(f'_concurrency_worker({seconds}, {seed}, {threads})') for seed in range(processes)]
+        results = [json.loads(worker.communicate()[0].splitlines()[-1]) for worker in workers]
+    return {key: sum(result[key] for result in results) for key in results[0]}
+
+@app.cli.command('benchmark-concurrency')
+@click.option('--processes', default=4, show_default=True, help='并发进程数')
+@click.option('--threads', default=4, show_default=True, help='每个进程的线程数（对应 gunicorn --threads）')
+@click.option('--seconds', default=10.0, show_default=True, help='运行时长')
+@click.option('--rows', default=5000, show_default=True, help='初始记录条数')
+def benchmark_concurrency(processes, threads, seconds, rows):
+    """多进程同时读写一个临时 SQLite 数据库，统计吞吐量和锁错误
+
+    请求中 80% 为读（记录分页、统计、整表导出），20% 为写（新增、修改、批量新增记录），
+    与 gunicorn 多 worker、多线程部署时的访问方式相同；不会读写当前配置的数据库。
+    """
+    totals = concurrency_totals(processes, threads, seconds, rows)
+    click.echo(f"{processes} 个进程 x {threads} 线程, {seconds:g} 秒: 读 {totals['reads']} 次 ({totals['reads'] / seconds:.0f}/s), "
+               f"写 {totals['writes']} 次 ({totals['writes'] / seconds:.0f}/s), "
+               f"锁错误 {totals['locked']}, 其他错误 {totals['errors']}")
+    if totals['locked'] or totals['errors']:
+        raise SystemExit(1)
+
+def _analytics_benchmark(repeat):
+    """benchmark-analytics 的测量阶段：在已写入记录的数据库上对比汇总表查询和列式缓存"""
+    with app.app_context():
+        for index in range(5):
+            db.session.add(ProductionPlan(product=f'产品{index}', steps=[
+                ProductionPlanStep(position=position, process=f'工序{position}', qty=100000) for position in range(5)]))
+        db.session.commit()
+        started = time.perf_counter()
+        columns = record_columns.current()
+        click.echo(f"加载列式缓存: {len(columns.arrays['id'])} 条 {(time.perf_counter() - started):.2f} 秒, "
+                   f"{sum(array.nbytes for array in columns.arrays.values()) / 1024 / 1024:.0f} MB")
+        products = db.session.scalars(sa.select(ProductionPlan.product).distinct()).all()
+        week_ago = (date.today() - timedelta(days=7)).isoformat()
+        cases = [
+            ('统计 全部', lambda: statistics_query({}).one(), lambda: columns.statistics({})),
+            ('统计 产品', lambda: statistics_query({'product': '产品3'}).one(),
+             lambda: columns.statistics({'product': '产品3'})),
+            ('统计 近7天+工序', lambda: statistics_query({'start_date': week_ago, 'process': '工序1'}).one(),
+             lambda: columns.statistics({'start_date': week_ago, 'process': '工序1'})),
+            ('计划完成量', lambda: {(row[0], row[1]): row[2] or 0 for row in plan_completion_query()},
+             lambda: columns.plan_completion(products)),
+        ]
+        for by in (('product', 'process'), ('date',), ('name', 'date')):
+            cases.append((f"分组 {','.join(by)}",
+                          lambda by=by: sorted((tuple(row[:len(by)]), tuple(row[len(by):]))
+                                               for row in record_groups_query(by, {})),
+                          lambda by=by: sorted(columns.groups(by, columns.mask({})))))
+        for label, sql, columnar in cases:
+            sql_ms, sql_result = _best_time(sql, repeat)
+            columnar_ms, columnar_result = _best_time(columnar, repeat)
+            same = '一致' if sql_result == columnar_result else '不一致'
+            click.echo(f'{label}: 汇总表 {sql_ms:.1f} ms, 列式缓存 {columnar_ms:.1f} ms ({same})')
+        db.session.remove()
+        client = app.test_client()
+        record_id = db.session.scalar(sa.select(sa.func.max(ProductionRecord.id)))
+        # 第一次合并还包含写入阶段末尾落在游标重叠窗口内的记录，取第二次的耗时
+        for downtime in ('5', '6'):
+            client.put(f'/api/records/{record_id}', json={'downtime_duration': downtime})
+            started = time.perf_counter()
+            record_columns.current()
+        click.echo(f'写入一条记录后合并变更: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+@app.cli.command('benchmark-analytics')
+@click.option('--rows', default=1000000, show_default=True, help='记录条数')
+@click.option('--repeat', default=5, show_default=True, help='每项重复次数，取最短耗时')
+def benchmark_analytics(rows, repeat):
+    """在临时 SQLite 数据库中写入指定条数的记录，对比统计、计划完成量和分组汇总
+    读汇总表与使用列式缓存的耗时，并检查两者结果一致；不会读写当前配置的数据库。
+    """
+    if numpy is None:
+        raise click.ClickException('列式缓存需要安装 numpy')
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'benchmark.db'),
+                   RECORDS_COLUMNAR_CACHE='1')
+        for code in (f'_concurrency_setup({rows})', f'_analytics_benchmark({repeat})'):
+            if subprocess.run([sys.executable, '-c', 'import web_app; web_app.' + code],
+                              env=env, cwd=app.root_path).returncode != 0:
+                raise click.ClickException('测试进程失败')
+
+# 对比时忽略的字段：时间戳和基于时间的同步游标在两次运行之间必然不同
+PARITY_IGNORED_KEYS = {'created_at', 'updated_at', 'sync_cursor', 'cursor'}
+
+def _parity_normalize(value):
+    if isinstance(value, dict):
+        return {key: _parity_normalize(item) for key, item in value.items() if key not in PARITY_IGNORED_KEYS}
+    if isinstance(value, list):
+        return [_parity_normalize(item) for item in value]
+    return value
+
+def _parity_requests(rng, rows):
+    """check-database-parity 的固定操作序列，产生 (标签, 方法, 地址, 参数) """
+    yield 'employee', 'POST', '/api/employees', {'json': {'name': '员工1', 'position': '操作工'}}
+    for index in range(3):
+        yield f'process {index}', 'POST', '/api/processes', {'json': {'name': f'工序{index}', 'description': ''}}
+        yield f'product {index}', 'POST', '/api/products', {'json': {'name': f'产品{index}', 'description': '规格'}}
+    for offset in range(0, rows, RECORDS_BATCH_MAX):
+        records = [_benchmark_payload(rng) for _ in range(min(RECORDS_BATCH_MAX, rows - offset))]
+        yield f'batch create {offset}', 'POST', '/api/records/batch', {'json': {'records': records}}
+    yield 'create', 'POST', '/api/records', {'json': dict(_benchmark_payload(rng), unit_weight='0.37')}
+    yield 'update', 'PUT', '/api/records/1', {'json': {'total_weight': '1234.5', 'adjustment_master': '师傅'}}
+    yield 'batch update', 'PUT', '/api/records/batch', {'json': {'records': [
+        {'id': record_id, 'downtime_duration': str(record_id % 90), 'single_time': '7'} for record_id in range(2, 200)]}}
+    yield 'delete', 'DELETE', '/api/records/3', {}
+    yield 'batch delete', 'DELETE', '/api/records/batch', {'json': {'ids': list(range(200, 260))}}
+    yield 'comment', 'POST', '/api/comments/1/downtime_duration', {'json': {'comment': '换模'}}
+    yield 'plan', 'POST', '/api/production-plans', {'json': {'product': '产品1', 'steps': [
+        {'process': '工序1', 'qty': '5000'}, {'process': '工序2', 'qty': '3000'}]}}
+    yield 'shift length', 'POST', '/api/shift-lengths', {'json': {'minutes': 600}}
+    yield 'shift length 工序', 'POST', '/api/shift-lengths', {'json': {
+        'process': '工序1', 'start_date': (date.today() - timedelta(days=10)).isoformat(), 'minutes': 540}}
+    yield 'recalculate', 'POST', '/api/records/recalculate', {'json': {'process': '工序1'}}
+
+    yield 'GET employees', 'GET', '/api/employees', {}
+    yield 'GET processes', 'GET', '/api/processes', {}
+    yield 'GET products', 'GET', '/api/products', {}
+    yield 'GET shift-lengths', 'GET', '/api/shift-lengths', {}
+    yield 'GET comment', 'GET', '/api/comments/1/downtime_duration', {}
+    yield 'GET records 全部', 'GET', '/api/records', {}
+    yield 'GET records compact', 'GET', '/api/records', {'query_string': {'shape': 'compact', 'fields': 'date,name,actual_qty,capacity_rate'}}
+    yield 'GET records 筛选', 'GET', '/api/records', {'query_string': {'product': '产品1', 'process': '工序2'}}
+    yield 'GET records 日期', 'GET', '/api/records', {'query_string': {
+        'start_date': (date.today() - timedelta(days=20)).isoformat(), 'end_date': date.today().isoformat()}}
+    yield 'GET records 分页', 'GET', '/api/records', {'query_string': {'limit': 100}}
+    yield 'GET statistics', 'GET', '/api/statistics', {}
+    for field, value in (('product', '产品1'), ('process', '工序2'), ('name', '员工3')):
+        yield f'GET statistics {field}', 'GET', '/api/statistics', {'query_string': {field: value}}
+    yield 'GET facets', 'GET', '/api/records/facets', {}
+    yield 'GET facets 筛选', 'GET', '/api/records/facets', {'query_string': {'process': '工序1'}}
+    yield 'GET production-plans', 'GET', '/api/production-plans', {}
+
+def _parity_run(rows):
+    """在 DATABASE_URL 指向的空数据库上执行固定操作序列，输出各响应和耗时的 JSON"""
+    app.testing = True
+    with app.app_context():
+        if sa.inspect(db.engine).get_table_names():
+            raise SystemExit('数据库不是空的，拒绝执行')
+        init_database()
+    client = app.test_client()
+    responses, timings = {}, {}
+    try:
+        for label, method, url, kwargs in _parity_requests(random.Random(0), rows):
+            started = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            timings[label] = (time.perf_counter() - started) * 1000
+            responses[label] = [response.status_code, _parity_normalize(response.get_json())]
+            # 分页读取走完所有页，顺带比较游标
+            while label == 'GET records 分页' and response.get_json()['next_cursor']:
+                response = client.get(url, query_string={'limit': 100, 'after': response.get_json()['next_cursor']})
+                responses[label].append(_parity_normalize(response.get_json()))
+    finally:
+        with app.app_context():
+            db.drop_all()
+    click.echo(json.dumps({'responses': responses, 'timings': timings}))
+
+def database_parity_results(database_url, rows):
+    """在临时 SQLite 库和 database_url（需为空库）上各执行一遍 check-database-parity 的操作序列，
+    返回 (标签, SQLite 的响应, 对比库的响应, SQLite 耗时, 对比库耗时) 列表"""
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for backend, url in (('sqlite', 'sqlite:///' + os.path.join(directory, 'parity.db')), ('other', database_url)):
+            output = subprocess.run([sys.executable, '-c', f'import web_app; web_app._parity_run({rows})'],
+                                    env=dict(os.environ, DATABASE_URL=url), cwd=app.root_path,
+                                    stdout=subprocess.PIPE, text=True)
+            if output.returncode != 0:
+                raise click.ClickException(f'{url} 上执行失败')
+            results[backend] = json.loads(output.stdout.splitlines()[-1])
+    sqlite_run, other_run = results['sqlite'], results['other']
+    return [(label, expected, other_run['responses'][label], sqlite_run['timings'][label], other_run['timings'][label])
+            for label, expected in sqlite_run['responses'].items()]
+
+@app.cli.command('check-database-parity')
+@click.argument('database_url')
+@click.option('--rows', default=5000, show_default=True, help='写入的记录条数')
+def check_database_parity(database_url, rows):
+    """在临时 SQLite 数据库和 DATABASE_URL（需为空库，结束后删除建立的表）上执行相同的写入和查询，
+    比较两边的响应是否一致，并列出各请求的耗时
+    """
+    mismatches = 0
+    for label, expected, actual, sqlite_ms, other_ms in database_parity_results(database_url, rows):
+        same = actual == expected
+        mismatches += not same
+        click.echo(f"{'ok  ' if same else 'DIFF'} {label}: SQLite {sqlite_ms:.1f} ms, 对比库 {other_ms:.1f} ms")
+        if not same:
+            click.echo(f'  SQLite: {json.dumps(expected, ensure_ascii=False)[:300]}')
+            click.echo(f'  对比库: {json.dumps(actual, ensure_ascii=False)[:300]}')
+    if mismatches:
+        raise click.ClickException(f'{mismatches} 个请求的结果不一致')
+    click.echo('所有请求结果一致')
+
+def _calc_parity_cells(rng):
+    """check-calc-parity 的一行随机输入（桌面版表格中的文本）：含空白、0、整数列填成小数、去皮重量大于总重，
+    以及净重恰好是单重的 n.5 倍（四舍五入进位处）"""
+    def number(low, high, places):
+        choice = rng.random()
+        if choice < 0.1:
+            return ''
+        if choice < 0.15:
+            return '0'
+        return f'{rng.uniform(low, high):.{places}f}'
+    # 整数列偶尔是小数（如导入的 CSV），两个版本都用 round 取整
+    integer_places = 1 if rng.random() < 0.1 else 0
+    cells = {'adjustment_time': number(0, 120, integer_places), 'downtime_duration': number(0, 600, integer_places),
+             'single_time': number(1, 120, integer_places), 'total_weight': number(0, 5000, 3),
+             'tare_weight': number(0, 300, 3), 'unit_weight': number(0.001, 50, 3)}
+    if rng.random() < 0.3:
+        unit_weight = Decimal(rng.randint(1, 5000)) / 100
+        cells['unit_weight'] = str(unit_weight)
+        cells['total_weight'] = str((rng.randint(0, 5000) + Decimal('0.5')) * unit_weight
+                                    + Decimal(cells['tare_weight'] or 0))
+    return cells
+
+def _desktop_weight_quantity(cells):
+    """桌面版原先按重量计算实际数量的方法：Decimal 四舍五入（ROUND_HALF_UP），负数按 0，单重为空或 0 时为空"""
+    total_weight, tare_weight, unit_weight = (float(cells[field] or 0)
+                                              for field in ('total_weight', 'tare_weight', 'unit_weight'))
+    if unit_weight <= 0:
+        return None
+    quotient = (Decimal(str(total_weight)) - Decimal(str(tare_weight))) / Decimal(str(unit_weight))
+    return max(0, int(quotient.quantize(Decimal('1'), rounding=ROUND_HALF_UP)))
+
+class _DesktopRow:
+    """代替 Treeview 供桌面版 _recalculate_row 读写一行单元格"""
+
+    def __init__(self, cells, shift_minutes):
+        self.cells = dict(cells, actual_qty='')
+        self.shift_minutes = shift_minutes
+        self.tree = self
+
+    def set(self, row_id, column, value=None):
+        if value is None:
+            return self.cells.get(column, '')
+        self.cells[column] = value
+
+# check-calc-parity 比较的各条计算路径
+CALC_PARITY_LABELS = ('桌面版原先的实际数量', 'Web 逐条', 'Web 批量', 'Web 批量（无 numpy）')
+
+def calc_parity_mismatches(rows, seed=0):
+    """用 rows 行随机输入比较桌面版 _recalculate_row 与各条计算路径，返回 (各路径不一致的行数, 各路径的首个反例)，
+    反例为 (输入, 班次分钟数, 桌面版结果, 该路径结果)。桌面版依赖 tkinter，无法导入时抛出 ImportError"""
+    from app import ProductionApp
+    import calc
+
+    rng = random.Random(seed)
+    inputs = [_calc_parity_cells(rng) for _ in range(rows)]
+    shift_minutes = [rng.choice((480, 540, 600, 30, 0)) for _ in inputs]
+    values = [{field: parse_record_value(field, cells[field]) for field in DERIVATION_INPUT_FIELDS}
+              for cells in inputs]
+    columns = {field: [row[field] for row in values] for field in DERIVATION_INPUT_FIELDS}
+    batch = derive_fields_batch(columns, shift_minutes)
+    vectorized, calc.numpy = calc.numpy, None
+    try:
+        fallback = derive_fields_batch(columns, shift_minutes)
+    finally:
+        calc.numpy = vectorized
+
+    mismatches = Counter()
+    examples = {}
+    for index, (cells, minutes, row) in enumerate(zip(inputs, shift_minutes, values)):
+        desktop = _DesktopRow(cells, minutes)
+        ProductionApp._recalculate_row(desktop, index)
+        expected = {field: parse_record_value(field, desktop.cells[field]) for field in DERIVED_FIELDS}
+        results = dict(zip(CALC_PARITY_LABELS, (
+            dict(expected, actual_qty=_desktop_weight_quantity(cells)),
+            derive_fields(row, minutes),
+            {field: batch[field][index] for field in DERIVED_FIELDS},
+            {field: fallback[field][index] for field in DERIVED_FIELDS},
+        )))
+        for label, actual in results.items():
+            if actual != expected:
+                mismatches[label] += 1
+                examples.setdefault(label, (cells, minutes, expected, actual))
+    return mismatches, examples
+
+@app.cli.command('check-calc-parity')
+@click.option('--rows', default=100000, show_default=True, help='随机生成的记录条数')
+def check_calc_parity(rows):
+    """用随机输入比较桌面版（app.py 的 _recalculate_row）与 Web 版逐条（derive_fields）、批量
+    （derive_fields_batch，有无 numpy）计算的派生字段，并核对实际数量与桌面版原先的计算相同
+    """
+    try:
+        mismatches, examples = calc_parity_mismatches(rows)
+    except ImportError as exc:
+        raise click.ClickException(f'无法加载桌面版：{exc}')
+
+    for label in CALC_PARITY_LABELS:
+        if not mismatches[label]:
+            click.echo(f'ok   {label}: {rows} 条与桌面版相同')
+            continue
+        cells, minutes, expected, actual = examples[label]
+        click.echo(f'DIFF {label}: {mismatches[label]} 条与桌面版不同')
+        click.echo(f'  输入: {json.dumps(cells, ensure_ascii=False)}，班次 {minutes} 分钟')
+        click.echo(f'  桌面版: {expected}')
+        click.echo(f'  {label}: {actual}')
+    if mismatches:
+        raise click.ClickException(f'{sum(mismatches.values())} 处计算结果不一致')
+    click.echo('桌面版与 Web 版计算结果一致')
+
+
+# 数据迁移命令
+def _legacy_record_table():
+    """旧版 production_record 表：除时间戳外全部为文本列"""
+    return sa.Table(
+        'production_record', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        *[sa.Column(field, sa.String) for field in RECORD_FIELDS],
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime)
+    )
+
+def _convert_legacy_row(row):
+    """把旧表的一行文本数据转换为新表的列值，日期无效时返回None"""
+    values = {field: parse_record_value(field, row[field]) for field in RECORD_FIELDS}
+    if values['date'] is None:
+        return None
+    values['id'] = row['id']
+    values['created_at'] = row['created_at']
+    values['updated_at'] = row['updated_at']
+    return values
+
+def _copy_legacy_rows(conn, legacy, typed, rows):
+    """把旧表的行写入新表，返回因日期无效而跳过的记录ID"""
+    converted = []
+    skipped = []
+    for row in rows:
+        values = _convert_legacy_row(row)
+        if values is None:
+            skipped.append(row['id'])
+        else:
+            converted.append(values)
+    if converted:
+        conn.execute(typed.delete().where(typed.c.id.in_([v['id'] for v in converted])))
+        conn.execute(typed.insert(), converted)
+    return skipped
+
+def _sync_legacy_changes(conn, legacy, typed):
+    """补齐复制期间旧表中新增、修改和删除的记录"""
+    changed_ids = conn.execute(sa.text(
+        'SELECT l.id FROM production_record l '
+        'LEFT JOIN production_record_typed t ON t.id = l.id '
+        'WHERE t.id IS NULL OR l.updated_at IS NOT t.updated_at'
+    )).scalars().all()
+    skipped = []
+    for start in range(0, len(changed_ids), 500):
+        ids = changed_ids[start:start + 500]
+        rows = conn.execute(sa.select(legacy).where(legacy.c.id.in_(ids))).mappings().all()
+        skipped.extend(_copy_legacy_rows(conn, legacy, typed, rows))
+    conn.execute(sa.text(
+        'DELETE FROM production_record_typed '
+        'WHERE id NOT IN (SELECT id FROM production_record)'
+    ))
+    return len(changed_ids), skipped
+
+@app.cli.command('migrate-record-types')
+@click.option('--batch-size', default=1000, show_default=True, help='每批复制的行数')
+@click.option('--pause', default=0.05, show_default=True, help='每批之间的停顿秒数，给在线写入让出写锁')
+def migrate_record_types(batch_size, pause):
+    """把旧的全文本 production_record 表在线转换为数值/日期类型的新表。
+
+    数据按ID分批复制到 production_record_typed，每批单独提交，服务无需停机；
+    中断后重新执行会从已复制的位置继续。最后在一个事务中补齐复制期间的
+    改动、交换表名并为新表建立索引，旧表保留为 production_record_legacy（不带索引）。
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('该命令仅用于迁移 SQLite 数据库 (production.db)')
+
+    inspector = sa.inspect(db.engine)
+    columns = {column['name']: column['type'] for column in inspector.get_columns('production_record')}
+    if isinstance(columns['actual_qty'], sa.Integer):
+        click.echo('production_record 已是新结构，无需迁移')
+        return
+    if inspector.has_table('production_record_legacy'):
+        raise click.ClickException('production_record_legacy 已存在，请先确认并删除旧的备份表')
+
+    legacy = _legacy_record_table()
+    typed = ProductionRecord.__table__.to_metadata(sa.MetaData(), name='production_record_typed')
+    typed.indexes.clear()
+    typed.create(db.engine, checkfirst=True)
+
+    with db.engine.connect() as conn:
+        last_id = conn.scalar(sa.select(sa.func.max(typed.c.id))) or 0
+        total = conn.scalar(sa.select(sa.func.count()).select_from(legacy))
+    if last_id:
+        click.echo(f'从记录ID {last_id} 之后继续迁移')
+
+    copied = 0
+    skipped = []
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                sa.select(legacy).where(legacy.c.id > last_id).order_by(legacy.c.id).limit(batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+            skipped.extend(_copy_legacy_rows(conn, legacy, typed, rows))
+        last_id = rows[-1]['id']
+        copied += len(rows)
+        click.echo(f'已复制 {copied}/{total} 条记录 (ID <= {last_id})')
+        time.sleep(pause)
+
+    # 先在锁外补齐大部分改动，再在交换表名的事务中补齐剩余部分
+    with db.engine.begin() as conn:
+        _sync_legacy_changes(conn, legacy, typed)
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA legacy_alter_table = ON')
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        synced, final_skipped = _sync_legacy_changes(conn, legacy, typed)
+        skipped.extend(final_skipped)
+        conn.exec_driver_sql('ALTER TABLE production_record RENAME TO production_record_legacy')
+        conn.exec_driver_sql('ALTER TABLE production_record_typed RENAME TO production_record')
+        # 索引在交换的事务中建立：旧表的索引先删除让出名称，提交后新表即带有全部索引
+        drop_legacy_record_indexes(conn)
+        for index in ProductionRecord.__table__.indexes:
+            index.create(conn)
+        RecordDailyRollup.__table__.create(conn, checkfirst=True)
+        refresh_record_rollup(conn)
+        bump_generations(conn, ['production_record', RECORD_BULK_PARTITION])
+        conn.commit()
+        conn.exec_driver_sql('PRAGMA legacy_alter_table = OFF')
+
+    click.echo(f'迁移完成，交换前补齐 {synced} 条改动')
+    if skipped:
+        skipped_ids = ', '.join(str(record_id) for record_id in sorted(set(skipped)))
+        click.echo(f'以下记录日期无效，未迁移（仍保留在 production_record_legacy 中）: {skipped_ids}')
+    click.echo('确认数据无误后可删除 production_record_legacy 表')
+
+
+@app.cli.command('migrate-plan-steps')
+def migrate_plan_steps():
+    """把旧的 process1..4/qty1..4 列转换为 production_plan_step 工序行，并删除旧列"""
+    # init_database 已把旧列复制为工序行
+    init_database()
+    with db.engine.begin() as conn:
+        legacy_slots = legacy_plan_slots(conn)
+        if not legacy_slots:
+            click.echo('production_plan 已是工序表结构，无需迁移')
+            return
+        # 复制之后旧版本仍在运行时写入的计划
+        backfill_plan_steps(conn, legacy_slots)
+        for slot in legacy_slots:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS ix_production_plan_process{slot}')
+            conn.exec_driver_sql(f'ALTER TABLE production_plan DROP COLUMN process{slot}')
+            conn.exec_driver_sql(f'ALTER TABLE production_plan DROP COLUMN qty{slot}')
+        bump_generations(conn, ['production_plan', 'production_plan_step'])
+        plans = conn.scalar(sa.select(sa.func.count(sa.distinct(ProductionPlanStep.plan_id))))
+        steps = conn.scalar(sa.select(sa.func.count()).select_from(ProductionPlanStep))
+    click.echo(f'旧列已删除，{plans} 个产量计划共 {steps} 道工序')
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_database()
+    preload_master_data()
     
     # 获取端口号
     port = int(os.environ.get('PORT', 5000))